@@ -0,0 +1,83 @@
+"""
+Recall versus latency report of the index types chosen by `choose_index_factory`.
+
+Description:
+------------
+Builds flat, HNSW and IVF indexes over a synthetic clustered corpus that mimics caption embeddings, and reports
+recall@k against exact search together with the mean query latency for several search parameters. The defaults of
+`FLAT_INDEX_MAX_VECTORS`, `HNSW_INDEX_MAX_VECTORS`, `HNSW_EF_SEARCH` and `IVF_NPROBE` in `helpers/constants.py` are
+chosen from this report.
+
+Usage:
+------------
+python -m benchmarks.ann_index_report --sizes 50000 200000 --dimensions 256
+"""
+from helpers.index_factory import build_index, set_search_parameters
+import numpy as np
+import argparse
+import time
+import math
+
+
+def synthetic_corpus(
+        count: int,
+        dimensions: int,
+        topic_count: int,
+        seed: int = 0,
+        latent_dimensions: int = 32
+) -> np.ndarray:
+    # Sentence embeddings occupy a low-dimensional manifold with soft topic clusters, so vectors are drawn around topic
+    # centroids in a small latent space and projected into the embedding space
+    rng = np.random.default_rng(seed)
+    projection = np.random.default_rng(42).standard_normal((latent_dimensions, dimensions)).astype(np.float32)
+    centroids = np.random.default_rng(43).standard_normal((topic_count, latent_dimensions)).astype(np.float32)
+    assignments = rng.integers(0, len(centroids), size=count)
+    latent = centroids[assignments] + rng.standard_normal((count, latent_dimensions)).astype(np.float32)
+    vectors = latent @ projection
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def measure(index, queries: np.ndarray, ground_truth: np.ndarray, k: int):
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    recall = np.mean([len(set(f) & set(g)) / k for f, g in zip(found, ground_truth)])
+    return recall, latency_ms
+
+
+def report(sizes, dimensions: int, query_count: int, k: int) -> None:
+    print("| vectors | index | search parameter | recall@k | ms/query |")
+    print("|---|---|---|---|---|")
+
+    for size in sizes:
+        corpus = synthetic_corpus(size, dimensions, topic_count=max(size // 200, 1))
+        queries = synthetic_corpus(query_count, dimensions, topic_count=max(size // 200, 1), seed=1)
+
+        flat_index = build_index(corpus, "Flat")
+        ground_truth = flat_index.search(queries, k)[1]
+        recall, latency_ms = measure(flat_index, queries, ground_truth, k)
+        print(f"| {size} | Flat | - | {recall:.3f} | {latency_ms:.3f} |")
+
+        hnsw_index = build_index(corpus, "HNSW32", hnsw_ef_construction=80)
+        for ef_search in (16, 32, 64, 128):
+            set_search_parameters(hnsw_index, hnsw_ef_search=ef_search, ivf_nprobe=1)
+            recall, latency_ms = measure(hnsw_index, queries, ground_truth, k)
+            print(f"| {size} | HNSW32 | efSearch={ef_search} | {recall:.3f} | {latency_ms:.3f} |")
+
+        nlist = 2 ** round(math.log2(4 * math.sqrt(size)))
+        ivf_index = build_index(corpus, f"IVF{nlist},Flat")
+        for nprobe in (4, 8, 16, 32):
+            set_search_parameters(ivf_index, hnsw_ef_search=16, ivf_nprobe=nprobe)
+            recall, latency_ms = measure(ivf_index, queries, ground_truth, k)
+            print(f"| {size} | IVF{nlist},Flat | nprobe={nprobe} | {recall:.3f} | {latency_ms:.3f} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50000, 200000])
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    arguments = parser.parse_args()
+
+    report(arguments.sizes, arguments.dimensions, arguments.queries, arguments.k)
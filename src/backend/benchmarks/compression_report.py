@@ -0,0 +1,102 @@
+"""
+Memory per hour of video versus recall report of the vector compression settings.
+
+Description:
+------------
+Reads the vectors and segment times of an ingested corpus folder and rebuilds its index with every combination of
+output dimensions and `VECTOR_ENCODING`. Reduced dimensions are emulated by truncating the stored vectors to their
+leading components and renormalizing them, which is how `text-embedding-3` models shorten their output when
+`EMBEDDING_DIMENSIONS` is set. A sample of the segments is held out as queries, and the report gives recall@k against
+exact search over the full float32 vectors together with the serialized index size per hour of video.
+
+Usage:
+------------
+python -m benchmarks.compression_report --folder ./faiss_metadata --dimensions 512 256 --queries 200 --k 4
+"""
+from helpers.constants import (
+    FLAT_INDEX_MAX_VECTORS,
+    HNSW_INDEX_MAX_VECTORS,
+    HNSW_M,
+    HNSW_EF_SEARCH,
+    IVF_NPROBE
+)
+from helpers.index_factory import (
+    choose_index_factory,
+    build_index,
+    extract_vectors,
+    set_search_parameters,
+    VECTOR_ENCODINGS
+)
+from helpers.vectorstore import read_corpus_index
+from helpers.segment_store import SegmentStore
+import numpy as np
+import argparse
+import faiss
+
+
+def video_hours(docstore: SegmentStore, ids: np.ndarray) -> float:
+    spans = {}
+    for vector_id in ids:
+        metadata = docstore.search(str(vector_id)).metadata
+        if metadata["start"] is None:
+            continue
+
+        end = metadata["end"] if metadata["end"] is not None else metadata["start"]
+        first, last = spans.get(metadata["video_id"], (metadata["start"], end))
+        spans[metadata["video_id"]] = (min(first, metadata["start"]), max(last, end))
+
+    return sum(last - first for first, last in spans.values()) / 3600
+
+
+def truncate(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    shortened = np.ascontiguousarray(vectors[:, :dimensions])
+    return shortened / np.maximum(np.linalg.norm(shortened, axis=1, keepdims=True), 1e-12)
+
+
+def report(folder_path: str, dimension_options, query_count: int, k: int) -> None:
+    vectors, ids = extract_vectors(read_corpus_index(folder_path))
+    docstore = SegmentStore(folder_path)
+    live = np.isin(ids, docstore.live_ids()) if ids is not None else np.ones(len(vectors), dtype=bool)
+    # Decoded float16 and int8 vectors are not exactly unit length, so all settings start from renormalized vectors
+    vectors = truncate(vectors[live], vectors.shape[1])
+    ids = ids[live] if ids is not None else np.arange(len(vectors), dtype=np.int64)
+    hours = video_hours(docstore, ids) or float("nan")
+
+    order = np.random.default_rng(0).permutation(len(vectors))
+    query_positions, corpus_positions = order[:query_count], order[query_count:]
+    corpus, queries = vectors[corpus_positions], vectors[query_positions]
+    ground_truth = build_index(corpus, "Flat").search(queries, k)[1]
+
+    print(f"{len(corpus)} segments, {hours:.2f} hours of video, {len(queries)} held-out queries")
+    print("| dimensions | encoding | factory | recall@k | MB | MB/hour |")
+    print("|---|---|---|---|---|---|")
+
+    native_dimensions = vectors.shape[1]
+    for dimensions in [native_dimensions] + [d for d in dimension_options if d < native_dimensions]:
+        for encoding in VECTOR_ENCODINGS:
+            factory = choose_index_factory(
+                len(corpus),
+                FLAT_INDEX_MAX_VECTORS,
+                HNSW_INDEX_MAX_VECTORS,
+                HNSW_M,
+                encoding=encoding
+            )
+            index = build_index(truncate(corpus, dimensions), factory, ids=np.arange(len(corpus), dtype=np.int64))
+            set_search_parameters(index, hnsw_ef_search=HNSW_EF_SEARCH, ivf_nprobe=IVF_NPROBE)
+            found = index.search(truncate(queries, dimensions), k)[1]
+            recall = np.mean([len(set(f) & set(g)) / k for f, g in zip(found, ground_truth)])
+            megabytes = len(faiss.serialize_index(index)) / 2 ** 20
+            print(
+                f"| {dimensions} | {encoding} | {factory} | {recall:.3f} | {megabytes:.2f} | {megabytes / hours:.2f} |"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--folder", default="./faiss_metadata")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[512, 256])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    arguments = parser.parse_args()
+
+    report(arguments.folder, arguments.dimensions, arguments.queries, arguments.k)
@@ -0,0 +1,66 @@
+"""
+Chat throughput and event loop responsiveness report under concurrent requests.
+
+Description:
+------------
+Sends rounds of concurrent questions about an ingested video to `/process/rag_tool` while polling the health check
+`/`. For each concurrency level the report gives the wall time of the round, the resulting requests per second and the
+worst health check latency. With a non-blocking backend the wall time stays close to a single request's latency as
+concurrency grows, and the health check keeps answering in milliseconds. Run the backend with `ANSWER_CACHE_SIZE=0`,
+otherwise repeated questions are answered from the answer cache.
+
+Usage:
+------------
+python -m benchmarks.concurrency_report --url http://localhost:8000 --video-url "https://www.youtube.com/watch?v=..."
+"""
+import argparse
+import asyncio
+import httpx
+import time
+
+
+async def ask(client: httpx.AsyncClient, url: str, video_url: str, question: str) -> None:
+    response = await client.post(f"{url}/process/rag_tool", data={"chat_message": question, "video_url": video_url})
+    response.raise_for_status()
+
+
+async def poll_health(client: httpx.AsyncClient, url: str, stop: asyncio.Event) -> float:
+    worst_ms = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(f"{url}/")
+        worst_ms = max(worst_ms, (time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.05)
+    return worst_ms
+
+
+async def run_round(url: str, video_url: str, concurrency: int):
+    async with httpx.AsyncClient(timeout=300) as client:
+        stop = asyncio.Event()
+        health = asyncio.create_task(poll_health(client, url, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            ask(client, url, video_url, f"Question {index}: what is explained in the video?")
+            for index in range(concurrency)
+        ])
+        wall_seconds = time.perf_counter() - start
+        stop.set()
+        return wall_seconds, await health
+
+
+def report(url: str, video_url: str, levels) -> None:
+    print("| concurrent requests | wall s | requests/s | worst health check ms |")
+    print("|---|---|---|---|")
+    for concurrency in levels:
+        wall_seconds, worst_health_ms = asyncio.run(run_round(url, video_url, concurrency))
+        print(f"| {concurrency} | {wall_seconds:.2f} | {concurrency / wall_seconds:.2f} | {worst_health_ms:.0f} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--video-url", required=True)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16])
+    arguments = parser.parse_args()
+
+    report(arguments.url, arguments.video_url, arguments.levels)
@@ -0,0 +1,103 @@
+"""
+Recall versus latency report of vector, BM25 and hybrid retrieval over an ingested corpus.
+
+Description:
+------------
+Samples segments of a corpus folder and turns each into two queries: a quoted run of consecutive words, as a user
+quoting the video would ask, and a handful of its words in random order, as a loosely worded question. Every query is
+answered by vector search alone, by the BM25 index alone and by `CorpusFAISS.hybrid_search`, and the report gives
+recall@k of the source segment, the mean latency and the number of embedding requests of each method. Vector and hybrid
+latencies include the embedding request of the configured `EMBEDDING_MODEL`.
+
+Usage:
+------------
+python -m benchmarks.hybrid_retrieval_report --folder ./faiss_metadata --queries 200 --k 4
+"""
+from helpers.vectorstore import load_vectorstore
+import numpy as np
+import argparse
+import time
+import re
+
+
+def sample_queries(vectorstore, query_count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    live_ids = vectorstore.docstore.live_ids()
+    queries = []
+
+    for vector_id in rng.permutation(live_ids):
+        text = vectorstore.docstore.search(str(vector_id)).page_content
+        words = re.findall(r"\w+", text)
+        if len(words) < 6:
+            continue
+
+        start = rng.integers(0, len(words) - 3)
+        queries.append(("phrase", f'"{" ".join(words[start:start + 4])}"', text))
+        queries.append(("keywords", " ".join(rng.permutation(words)[:4]), text))
+        if len(queries) >= 2 * query_count:
+            break
+
+    return queries
+
+
+def vector_search(vectorstore, query: str, k: int):
+    return [document.page_content for document in vectorstore.similarity_search(query, k=k)]
+
+
+def lexical_search(vectorstore, query: str, k: int):
+    return [
+        vectorstore.docstore.search(str(vector_id)).page_content
+        for vector_id, _ in vectorstore.docstore.lexical_search(query, k)
+    ]
+
+
+def hybrid_search(vectorstore, query: str, k: int):
+    return [document.page_content for document in vectorstore.hybrid_search(query, k=k)]
+
+
+class CountingEmbedding:
+    # FAISS calls non-`Embeddings` embedding functions directly, which lets the report count the embedding requests
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.requests = 0
+
+    def __call__(self, text: str):
+        self.requests += 1
+        return self.embeddings.embed_query(text)
+
+
+def report(folder_path: str, query_count: int, k: int) -> None:
+    vectorstore = load_vectorstore(folder_path)
+    queries = sample_queries(vectorstore, query_count)
+    embeddings = vectorstore.embedding_function
+
+    print("| query type | method | recall@k | ms/query | embedding requests |")
+    print("|---|---|---|---|---|")
+
+    try:
+        for query_type in ("phrase", "keywords"):
+            typed_queries = [(query, source) for kind, query, source in queries if kind == query_type]
+
+            for method_name, method in (("vector", vector_search), ("bm25", lexical_search), ("hybrid", hybrid_search)):
+                vectorstore.embedding_function = CountingEmbedding(embeddings)
+                hits = 0
+                start = time.perf_counter()
+                for query, source in typed_queries:
+                    hits += source in method(vectorstore, query, k)
+                latency_ms = (time.perf_counter() - start) * 1000 / max(len(typed_queries), 1)
+
+                recall = hits / max(len(typed_queries), 1)
+                requests = vectorstore.embedding_function.requests
+                print(f"| {query_type} | {method_name} | {recall:.3f} | {latency_ms:.2f} | {requests} |")
+    finally:
+        vectorstore.embedding_function = embeddings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--folder", default="./faiss_metadata")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    arguments = parser.parse_args()
+
+    report(arguments.folder, arguments.queries, arguments.k)
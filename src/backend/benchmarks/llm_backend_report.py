@@ -0,0 +1,139 @@
+"""
+Latency and throughput report of chat model backends on the backend's own prompts.
+
+Description:
+------------
+Every backend runs the request identification prompt on the example requests of the intent classifier, whose categories
+are known, and the RAG prompt on a fixed transcript excerpt. For classification the report gives the median and 95th
+percentile latency and the share of correctly parsed categories. For generation it gives the median time to the first
+streamed token, the median answer time and the generation speed in tokens per second. Throughput is measured with
+`--concurrency` answers in flight at once. In-process llama.cpp models generate one answer at a time, so their
+throughput equals their sequential speed.
+
+Backends are given as `backend:model`, for instance:
+    openai:gpt-4o-mini
+    openai_compatible:qwen2.5-3b-instruct@http://localhost:8080/v1
+    llamacpp:/models/qwen2.5-1.5b-instruct-q4_k_m.gguf
+
+Usage:
+------------
+python -m benchmarks.llm_backend_report --backend openai:gpt-4o-mini --backend llamacpp:/models/model.gguf
+"""
+from helpers.chat_models import load_chat_model
+from helpers.constants import request_identification_prompt_template, rag_prompt_template
+from helpers.helper_functions import RequestParser
+from helpers.intent_classifier import INTENT_PROTOTYPES
+from helpers.tokenizer import count_tokens
+from langchain_core.output_parsers import PydanticOutputParser, StrOutputParser
+from langchain_core.prompts import PromptTemplate
+import numpy as np
+import argparse
+import asyncio
+import time
+
+CONTEXT = (
+    "[00:12 - 01:05] Today we are baking a simple country loaf. You only need flour, water, salt and a little yeast. "
+    "Mix five hundred grams of bread flour with three hundred and fifty grams of lukewarm water and let it rest for "
+    "thirty minutes, so the flour can absorb the water before you add the salt.\n\n"
+    "[01:05 - 02:40] After the rest, add ten grams of salt and two grams of instant yeast and knead for about ten "
+    "minutes until the dough is smooth. I prefer folding the dough every half hour instead of long kneading, because "
+    "it builds the same strength with less effort and keeps the crumb open.\n\n"
+    "[02:40 - 04:10] Let the dough rise for four hours at room temperature, then shape it into a tight ball and "
+    "proof it in a floured basket overnight in the fridge. Bake it in a preheated dutch oven at two hundred and fifty "
+    "degrees, twenty minutes with the lid on and twenty five minutes without."
+)
+QUESTIONS = [
+    "Which ingredients do I need for the loaf?",
+    "Why does the baker fold the dough instead of kneading it?",
+    "How long should the dough rise and where?",
+    "At which temperature and for how long is the bread baked?"
+]
+
+
+def parse_backend(specification: str):
+    backend, _, model = specification.partition(":")
+    model_name, _, base_url = model.partition("@")
+    if backend == "llamacpp":
+        return load_chat_model(backend, model_name, model_path=model_name)
+
+    return load_chat_model(backend, model_name, base_url=base_url or None)
+
+
+async def classification_timings(chat_model, rounds: int) -> dict:
+    output_parser = PydanticOutputParser(pydantic_object=RequestParser)
+    chain = PromptTemplate(
+        template=request_identification_prompt_template,
+        input_variables=["request"],
+        partial_variables={"format_instructions": output_parser.get_format_instructions()}
+    ) | chat_model | output_parser
+
+    latencies, correct, total = [], 0, 0
+    for _ in range(rounds):
+        for category, requests in INTENT_PROTOTYPES.items():
+            for request in requests:
+                start = time.perf_counter()
+                try:
+                    correct += (await chain.ainvoke({"request": request})).request_category == category
+                except Exception:
+                    pass
+                latencies.append((time.perf_counter() - start) * 1000)
+                total += 1
+
+    return {"p50": np.percentile(latencies, 50), "p95": np.percentile(latencies, 95), "accuracy": correct / total}
+
+
+async def answer_timings(chain, question: str) -> dict:
+    start = time.perf_counter()
+    first_token_ms, answer = None, ""
+    async for token in chain.astream({"question": question, "chat_history": "None", "context": CONTEXT}):
+        if first_token_ms is None and token:
+            first_token_ms = (time.perf_counter() - start) * 1000
+        answer += token
+
+    total_ms = (time.perf_counter() - start) * 1000
+    generation_seconds = max(total_ms - (first_token_ms or total_ms), 1.0) / 1000
+    return {
+        "first_token": first_token_ms or total_ms,
+        "total": total_ms,
+        "tokens_per_second": count_tokens(answer, "gpt-4o-mini") / generation_seconds
+    }
+
+
+async def report_backend(specification: str, rounds: int, concurrency: int) -> str:
+    chat_model = parse_backend(specification)
+    classification = await classification_timings(chat_model, rounds)
+
+    chain = PromptTemplate.from_template(rag_prompt_template) | chat_model | StrOutputParser()
+    answers = [await answer_timings(chain, question) for _ in range(rounds) for question in QUESTIONS]
+
+    start = time.perf_counter()
+    questions = [QUESTIONS[index % len(QUESTIONS)] for index in range(concurrency)]
+    await asyncio.gather(*(answer_timings(chain, question) for question in questions))
+    answers_per_minute = concurrency / (time.perf_counter() - start) * 60
+
+    medians = {key: np.median([answer[key] for answer in answers]) for key in answers[0]}
+    return (
+        f"| {specification} | {classification['p50']:.0f} | {classification['p95']:.0f} | "
+        f"{classification['accuracy']:.2f} | {medians['first_token']:.0f} | {medians['total']:.0f} | "
+        f"{medians['tokens_per_second']:.1f} | {answers_per_minute:.1f} |"
+    )
+
+
+async def report(backends: list, rounds: int, concurrency: int) -> None:
+    print(
+        "| backend | classify p50 ms | classify p95 ms | classify accuracy | answer first token ms | answer ms | "
+        "tokens/s | answers/min at concurrency |"
+    )
+    print("|---|---|---|---|---|---|---|---|")
+    for specification in backends:
+        print(await report_backend(specification, rounds, concurrency))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backend", action="append", required=True)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=8)
+    arguments = parser.parse_args()
+
+    asyncio.run(report(arguments.backend, arguments.rounds, arguments.concurrency))
@@ -0,0 +1,68 @@
+"""
+Latency report of speculative retrieval against classifying and retrieving one after the other.
+
+Description:
+------------
+For questions about an ingested video, the serial path classifies the request and then retrieves its context, as the
+chat graph does with `SPECULATIVE_RETRIEVAL=false`. The speculative path runs both concurrently, as
+`classify_and_retrieve` does. Classification is forced through the LLM, the worst case the local intent classifier
+escalates to, and every trial uses a fresh question text so no embedding is served from the cache. The report gives the
+median latency of each path and the saving, which approaches the shorter of the two round trips.
+
+Usage:
+------------
+python -m benchmarks.speculative_retrieval_report --video-id bG4VYwFnU8k --trials 5
+"""
+from helpers.tools import request_identifier, rag_tool
+import numpy as np
+import argparse
+import asyncio
+import time
+
+QUESTIONS = [
+    "Could you summarize the main points of the video?",
+    "What does the speaker recommend to beginners?",
+    "Which tools or ingredients are mentioned?",
+    "Why does the speaker prefer this approach?"
+]
+
+
+async def classify(question: str):
+    return await request_identifier._identification_chain().ainvoke({"request": question})
+
+
+async def serial(question: str, video_id: str) -> float:
+    start = time.perf_counter()
+    await classify(question)
+    await rag_tool.aretrieve(question, video_id=video_id)
+    return (time.perf_counter() - start) * 1000
+
+
+async def speculative(question: str, video_id: str) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(classify(question), rag_tool.aretrieve(question, video_id=video_id))
+    return (time.perf_counter() - start) * 1000
+
+
+async def report(video_id: str, trials: int) -> None:
+    timings = {"serial": [], "speculative": []}
+    for trial in range(trials):
+        for question in QUESTIONS:
+            timings["serial"].append(await serial(f"{question} (serial {trial})", video_id))
+            timings["speculative"].append(await speculative(f"{question} (speculative {trial})", video_id))
+
+    serial_ms, speculative_ms = np.median(timings["serial"]), np.median(timings["speculative"])
+    print("| path | median ms |")
+    print("|---|---|")
+    print(f"| classify, then retrieve | {serial_ms:.0f} |")
+    print(f"| classify and retrieve concurrently | {speculative_ms:.0f} |")
+    print(f"| saving | {serial_ms - speculative_ms:.0f} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--video-id", required=True)
+    parser.add_argument("--trials", type=int, default=5)
+    arguments = parser.parse_args()
+
+    asyncio.run(report(arguments.video_id, arguments.trials))
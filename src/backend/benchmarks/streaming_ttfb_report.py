@@ -0,0 +1,76 @@
+"""
+Time-to-first-byte report of the streaming agent endpoint against the blocking one.
+
+Description:
+------------
+Sends the same questions about an ingested video to `/process/converse_with_agent`, which answers once the whole
+answer is generated, and to `/process/stream_agent`, which streams Server-Sent Events. For the blocking endpoint the
+first byte arrives with the full answer. For the streaming endpoint the report separates the first byte (the first
+node event), the first answer token and the end of the stream. Run the backend with `ANSWER_CACHE_SIZE=0`, otherwise
+the second endpoint is answered from the answer cache filled by the first.
+
+Usage:
+------------
+python -m benchmarks.streaming_ttfb_report --url http://localhost:8000 --video-url "https://www.youtube.com/watch?v=..."
+"""
+import numpy as np
+import argparse
+import httpx
+import time
+
+QUESTIONS = [
+    "Could you summarize the main points of the video?",
+    "What does the speaker recommend to beginners?",
+    "Which tools or ingredients are mentioned?",
+    "Why does the speaker prefer this approach?",
+    "What are the steps explained in the video?"
+]
+
+
+def blocking_timings(client: httpx.Client, url: str, form: dict) -> dict:
+    start = time.perf_counter()
+    client.post(f"{url}/process/converse_with_agent", data=form).raise_for_status()
+    total_ms = (time.perf_counter() - start) * 1000
+    return {"first_byte": total_ms, "first_token": total_ms, "total": total_ms}
+
+
+def streaming_timings(client: httpx.Client, url: str, form: dict) -> dict:
+    start = time.perf_counter()
+    timings = {}
+    with client.stream("POST", f"{url}/process/stream_agent", data=form) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            timings.setdefault("first_byte", elapsed_ms)
+            if line == "event: token":
+                timings.setdefault("first_token", elapsed_ms)
+
+    timings["total"] = (time.perf_counter() - start) * 1000
+    timings.setdefault("first_token", timings["total"])
+    return timings
+
+
+def report(url: str, video_url: str, rounds: int) -> None:
+    results = {"converse_with_agent": [], "stream_agent": []}
+    with httpx.Client(timeout=120) as client:
+        for _ in range(rounds):
+            for question in QUESTIONS:
+                form = {"video_url": video_url, "chat_message": question}
+                results["converse_with_agent"].append(blocking_timings(client, url, form))
+                results["stream_agent"].append(streaming_timings(client, url, form))
+
+    print("| endpoint | median first byte ms | median first token ms | median total ms |")
+    print("|---|---|---|---|")
+    for endpoint, timings in results.items():
+        medians = [np.median([timing[key] for timing in timings]) for key in ("first_byte", "first_token", "total")]
+        print(f"| {endpoint} | {medians[0]:.0f} | {medians[1]:.0f} | {medians[2]:.0f} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--video-url", required=True)
+    parser.add_argument("--rounds", type=int, default=3)
+    arguments = parser.parse_args()
+
+    report(arguments.url, arguments.video_url, arguments.rounds)
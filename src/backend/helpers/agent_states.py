@@ -5,7 +5,10 @@ from typing import (
     Union,
     Tuple,
     Dict,
-    List, Any
+    List, Any,
+    Optional,
+    Callable,
+    Awaitable
 )
 from helpers.tools import (
     transcription_checker,
@@ -13,18 +16,24 @@ from helpers.tools import (
     transcription_scrapper,
     request_identifier,
     screenshot_tool,
-    rag_tool
+    rag_tool,
+    conversation_memory,
+    video_digester
 )
 from helpers.helper_functions import (
-    create_empty_vectorstore,
     create_vectorstore_index,
     create_metadata,
-    text_embedding_v3_small,
-    search_timestamp,
+    extract_video_id,
+    search_moments,
     take_screenshot,
     YouTubeConverter,
     WhisperTranscriber
 )
+from helpers.vectorstore import corpus_contains
+from langgraph.graph.state import CompiledStateGraph
+from helpers.warmup import usage_catalog
+from helpers.executors import transcription_executor, run_blocking
+from helpers.constants import VECTORSTORE_PATH, VIDEO_DIGEST, request_flights
 import tempfile
 import asyncio
 import os
@@ -32,6 +41,20 @@ import os
 youtube_converter = YouTubeConverter(destination=".")
 whisper_transcriber = WhisperTranscriber()
 
+# Answer of image requests when the video has no caption lines to find the moment in
+NO_MOMENT_FOUND_RESPONSE = "I could not find this moment in the video's captions, so I cannot take a screenshot of it."
+
+
+# State fields the ingestion graph fills in
+INGESTION_FIELDS = (
+    "video_length",
+    "has_transcription",
+    "transcription_text",
+    "full_transcription",
+    "vectorstore_build",
+    "vectorstore_path"
+)
+
 
 class GraphState(TypedDict):
     """
@@ -41,6 +64,7 @@ class GraphState(TypedDict):
     """
     identified_query: str
     video_url: str
+    video_id: str
     vectorstore_build: bool
     video_length: int
     has_transcription: bool
@@ -51,17 +75,22 @@ class GraphState(TypedDict):
     identified_request: str
     response: str
     search_result: Dict[Any, Any]
-    total_seconds: int
+    total_seconds: Optional[int]
+    timestamp_candidates: List[Dict[str, Any]]
+    retrieved_documents: Optional[List[Any]]
+    chat_summary: str
+    chat_turns: List[Dict[str, str]]
+    prompt_tokens: int
     updated_url: str
     screenshot_base64: Any
 
 
-def check_video_length(state):
+async def check_video_length(state):
     print("---BEGIN: CHECKING VIDEO LENGTH---")
     video_url = state["video_url"]
 
     try:
-        length = video_length_checker._run(video_url)
+        length = await video_length_checker._arun(video_url)
         print(F"---PROCESS: VIDEO LENGTH IS -> {length}")
 
         if length >= 10:
@@ -85,15 +114,14 @@ def selenium_or_pytube(state):
         return "Pytube"
 
 
-def download_with_pytube(state):
+async def download_with_pytube(state):
     video_url = state["video_url"]
     print("---PROCESS: DOWNLOADING VIDEO WITH PYTUBE---")
-    audio_file = youtube_converter.convert(video_url)
-    formatted_results = whisper_transcriber.transcribe(audio_file)
+    audio_file = await run_blocking(transcription_executor, youtube_converter.convert, video_url)
+    formatted_results = await run_blocking(transcription_executor, whisper_transcriber.transcribe, audio_file)
     parsed_transcription = ". ".join(formatted_results.values())
 
-    empty_faiss_vectorstore = create_empty_vectorstore()
-    create_metadata(formatted_results, empty_faiss_vectorstore)
+    await asyncio.to_thread(create_metadata, formatted_results, state["video_id"])
 
     return {
         "transcription_text": parsed_transcription,
@@ -101,11 +129,11 @@ def download_with_pytube(state):
     }
 
 
-def extract_transcription(state):
+async def extract_transcription(state):
     print("---PROCESS: EXTRACTING TRANSCRIPTION---")
     video_url = state["video_url"]
 
-    full_transcription = transcription_scrapper._run(video_url)
+    full_transcription = await transcription_scrapper._arun(video_url)
     parsed_transcription = ". ".join(full_transcription.values())
     return {
         "transcription_text": parsed_transcription,
@@ -113,11 +141,11 @@ def extract_transcription(state):
     }
 
 
-def check_transcription_element(state):
+async def check_transcription_element(state):
     video_url = state["video_url"]
     print("---PROCESS: CHECKING TRANSCRIPTION ELEMENT---")
 
-    transcription_found = transcription_checker(video_url)
+    transcription_found = await transcription_checker._arun(video_url)
 
     if transcription_found:
         print("---CHECKING: TRANSCRIPTION FOUND---")
@@ -140,27 +168,67 @@ def scrape_or_download(state):
         return "Download"
 
 
-def init_vectorstore(state):
+async def init_vectorstore(state):
     print("---PROCESS: INITIALIZING VECTORSTORE---")
     transcription = state["transcription_text"]
-    empty_vectorstore = create_empty_vectorstore()
-    updated_vectorstore = create_vectorstore_index(vectorstore=empty_vectorstore, documents=transcription)
-    updated_vectorstore.save_local("faiss_vectorstore")
+    await asyncio.to_thread(
+        create_vectorstore_index,
+        documents=transcription,
+        video_id=state["video_id"],
+        full_transcription=state.get("full_transcription")
+    )
     print("---PROCESS: VECTORSTORE READY---")
+    if VIDEO_DIGEST:
+        video_digester.schedule(state["video_id"])
+
     return {
         "vectorstore_build": True,
-        "vectorstore_path": "./faiss_vectorstore"
+        "vectorstore_path": VECTORSTORE_PATH
     }
 
 
+def coalesce_ingestion(
+        ingestion: CompiledStateGraph
+) -> Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]:
+    """
+    Wraps the ingestion graph into a graph node that ingests each video once.
+
+    Description:
+    ------------
+    Concurrent requests for a video that is not ingested yet share one run of the whole ingestion graph, from the video
+    length check to the indexing, under a single "ingest" flight. A request arriving after a previous flight has landed
+    finds the video in the corpus and skips the ingestion.
+
+    Args:
+    ------------
+    ingestion (CompiledStateGraph): The compiled graph fetching the transcription of a video and indexing it.
+
+    Returns:
+    ------------
+    Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]: The graph node running the ingestion.
+    """
+    @request_flights.coalesce("ingest")
+    async def ingest_video(state):
+        print("---PROCESS: INGESTING VIDEO---")
+        if corpus_contains(VECTORSTORE_PATH, state["video_id"]):
+            print("---PROCESS: VIDEO ALREADY INGESTED---")
+            return {"vectorstore_build": True, "vectorstore_path": VECTORSTORE_PATH}
+
+        ingested = await ingestion.ainvoke(state)
+        return {key: ingested[key] for key in INGESTION_FIELDS if key in ingested}
+
+    return ingest_video
+
+
 def load_vectorstore_states(state):
-    print("---CHECKING: SEARCHING FOR A VECTORSTORE---")
-    vectorstore_path = state["vectorstore_path"]
+    print("---CHECKING: SEARCHING FOR THE VIDEO IN THE VECTORSTORE---")
+    video_id = extract_video_id(state["video_url"])
+    usage_catalog.record(video_id)
 
-    if vectorstore_path is not None:
-        return {"vectorstore_build": True}
+    if corpus_contains(VECTORSTORE_PATH, video_id):
+        return {"video_id": video_id, "vectorstore_build": True, "vectorstore_path": VECTORSTORE_PATH}
     else:
-        return {"vectorstore_build": False}
+        return {"video_id": video_id, "vectorstore_build": False}
 
 
 def check_vectorstore_presence(state):
@@ -174,18 +242,42 @@ def check_vectorstore_presence(state):
         return "Fetch Data"
 
 
-def query_identifier(states):
+async def query_identifier(states):
     print("---PROCESS: QUERY IDENTIFIER---")
     chat_message = states["chat_message"]
 
-    category = request_identifier._run(chat_message)
+    category = await request_flights.run(
+        states["video_id"], "classify", chat_message, lambda: request_identifier._arun(chat_message)
+    )
 
     if category.request_category == "information":
         print(f"---PROCESS: IDENTIFIED THE QUERY AS -> {category.request_category}---")
-        return {"identified_request": "information"}
+        return {"identified_request": "information", "retrieved_documents": None}
     else:
         print(f"---PROCESS: IDENTIFIED THE QUERY AS -> {category.request_category}---")
-        return {"identified_request": "image"}
+        return {"identified_request": "image", "retrieved_documents": None}
+
+
+async def classify_and_retrieve(states):
+    print("---PROCESS: QUERY IDENTIFIER WITH SPECULATIVE RETRIEVAL---")
+    chat_message = states["chat_message"]
+
+    # Retrieval does not depend on the category, so it overlaps the classification instead of following it
+    video_id = states["video_id"]
+    category, documents = await asyncio.gather(
+        request_flights.run(video_id, "classify", chat_message, lambda: request_identifier._arun(chat_message)),
+        request_flights.run(video_id, "retrieve", chat_message, lambda: rag_tool.aretrieve(chat_message, video_id)),
+        return_exceptions=True
+    )
+    if isinstance(category, Exception):
+        raise category
+
+    if isinstance(documents, Exception):
+        print(f"---WARNING: SPECULATIVE RETRIEVAL FAILED -> {documents}---")
+        documents = None
+
+    print(f"---PROCESS: IDENTIFIED THE QUERY AS -> {category.request_category}---")
+    return {"identified_request": category.request_category, "retrieved_documents": documents}
 
 
 def check_request_type(state):
@@ -197,20 +289,57 @@ def check_request_type(state):
         return "Image"
 
 
-def proceed_to_rag(state):
+async def proceed_to_rag(state, config):
     print(f"---PROCESS: GENERATING THE ANSWER---")
     chat_message = state["chat_message"]
-    response = rag_tool._run(chat_message)
+    chat_summary, chat_turns, chat_history = conversation_memory.prepare(
+        config["configurable"]["thread_id"],
+        state.get("chat_summary") or "",
+        state.get("chat_turns") or []
+    )
+
+    async def answer():
+        usage = {}
+        response = await rag_tool._arun(
+            chat_message,
+            video_id=state["video_id"],
+            documents=state.get("retrieved_documents"),
+            chat_history=chat_history,
+            usage=usage
+        )
+        return response, usage
+
+    # Answers to follow-up questions depend on the conversation, so only standalone questions share an answer
+    if chat_history:
+        response, usage = await answer()
+    else:
+        response, usage = await request_flights.run(state["video_id"], "answer", chat_message, answer)
 
-    return {"response": response}
+    return {
+        "response": response,
+        # Cached answers send no prompt
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "chat_summary": chat_summary,
+        "chat_turns": chat_turns + [{"question": chat_message, "answer": response}]
+    }
 
 
 def proceed_to_image_retrieval(state):
-    full_transcription = state["full_transcription"]
     chat_message = state["chat_message"]
     video_url = state["video_url"]
 
-    total_seconds = search_timestamp(full_transcription, chat_message)
+    timestamp_candidates = search_moments(chat_message, video_id=state["video_id"])
+    if not timestamp_candidates:
+        print("---WARNING: NO MOMENT OF THE VIDEO FOUND---")
+        return {
+            "total_seconds": None,
+            "timestamp_candidates": [],
+            "updated_url": video_url,
+            "screenshot_base64": None,
+            "response": NO_MOMENT_FOUND_RESPONSE
+        }
+
+    total_seconds = round(timestamp_candidates[0]["start"])
     if "&t=" in video_url:
         pattern_index = video_url.find("&t=")
         video_url = video_url[:pattern_index]
@@ -219,10 +348,20 @@ def proceed_to_image_retrieval(state):
     else:
         updated_url = video_url + f"&t={total_seconds}s"
 
-    return {"total_seconds": total_seconds, "updated_url": updated_url}
+    return {"total_seconds": total_seconds, "timestamp_candidates": timestamp_candidates, "updated_url": updated_url}
+
+
+def check_moment_found(state):
+    if state["timestamp_candidates"]:
+        print("---DECISION: MOMENT FOUND...TAKING THE SCREENSHOT---")
+        return "Screenshot"
+
+    else:
+        print("---DECISION: NO MOMENT FOUND---")
+        return "Not Found"
 
 
-def take_video_screenshot(state):
+async def take_video_screenshot(state):
     updated_url = state["updated_url"]
-    base64_image = screenshot_tool.run(updated_url)
+    base64_image = await screenshot_tool._arun(updated_url)
     return {"screenshot_base64": base64_image}
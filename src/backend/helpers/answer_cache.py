@@ -0,0 +1,118 @@
+from helpers.metrics import metrics
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Tuple
+import numpy as np
+import threading
+import time
+
+
+class SemanticAnswerCache:
+    """
+    A bounded cache of generated answers per video, looked up by question similarity.
+
+    Description:
+    ------------
+    Popular videos get the same few questions phrased in slightly different ways. Every generated answer is stored with
+    the normalized embedding of its question under the video ID, and a new question about the same video whose cosine
+    similarity to a stored question reaches `similarity_threshold` gets the stored answer without retrieval or
+    generation. Entries expire after `ttl_seconds`, the least recently used entries are evicted beyond `max_entries`, and
+    all entries of a video are dropped when the video is re-ingested or deleted, so answers never outlive the transcript
+    they were generated from. Hits and misses are recorded in `metrics`.
+
+    Attributes:
+    -----------
+    max_entries : int
+        The maximum number of cached answers over all videos.
+    ttl_seconds : float
+        The lifetime of a cached answer in seconds.
+    similarity_threshold : float
+        The cosine similarity a question needs to a cached question to reuse its answer.
+
+    Methods:
+    --------
+    lookup(video_id: str, query_vector: List[float]) -> Optional[str]:
+        Returns the cached answer of the most similar question about the video, or None.
+
+    store(video_id: str, question: str, query_vector: List[float], answer: str):
+        Caches the answer to a question about the video.
+
+    invalidate(video_id: str):
+        Drops all cached answers of the video.
+
+    stats() -> Dict[str, Any]:
+        Returns the size and hit rate of the cache.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _video_keys(self, video_id: str) -> List[Tuple[str, str]]:
+        return [key for key in self._entries if key[0] == video_id]
+
+    def lookup(self, video_id: str, query_vector: List[float]) -> Optional[str]:
+        query = self._normalize(query_vector)
+        now = time.time()
+        best_key, best_similarity = None, self.similarity_threshold
+
+        with self._lock:
+            for key in self._video_keys(video_id):
+                entry = self._entries[key]
+                if now - entry["created"] > self.ttl_seconds:
+                    del self._entries[key]
+                    continue
+
+                if entry["vector"].shape != query.shape:
+                    continue
+
+                similarity = float(entry["vector"] @ query)
+                if similarity >= best_similarity:
+                    best_key, best_similarity = key, similarity
+
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                answer = self._entries[best_key]["answer"]
+
+        if best_key is None:
+            metrics.increment("answer_cache.misses")
+            return None
+
+        metrics.increment("answer_cache.hits")
+        return answer
+
+    def store(self, video_id: str, question: str, query_vector: List[float], answer: str) -> None:
+        with self._lock:
+            key = (video_id, " ".join(question.lower().split()))
+            self._entries[key] = {"vector": self._normalize(query_vector), "answer": answer, "created": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, video_id: str) -> None:
+        with self._lock:
+            for key in self._video_keys(video_id):
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        counters = metrics.snapshot()["counters"]
+        hits = counters.get("answer_cache.hits", 0)
+        misses = counters.get("answer_cache.misses", 0)
+
+        with self._lock:
+            entries = len(self._entries)
+
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+        }
@@ -1,13 +1,24 @@
 from helpers.helper_functions import (
+    extract_video_id,
     FetchTranscriptionModel,
     check_transcription,
     FetchVideoLengthModel,
     scrape_video_length,
     scrape_transcription,
+    BatchQuestionsModel,
 )
-from helpers.tools import request_identifier, rag_tool
-from helpers.constants import selected_thread
+from helpers.tools import (
+    request_identifier, rag_tool, intent_classifier, conversation_memory, context_packer, video_digester
+)
+from helpers.constants import memory, model_router, request_flights, embedding_model, answer_cache, VECTORSTORE_PATH, METADATA_PATH
+from helpers.vectorstore import upgrade_vectorstore, delete_video_from_corpus, compact_corpus, vectorstore_cache
+from helpers.metrics import metrics
+from helpers.video_digest import SECTION, WINDOW
+from helpers.warmup import usage_catalog, warmup_status
 from helpers.chatbot import chatbot
+from helpers.executors import selenium_executor, run_blocking
+from helpers.streaming import stream_agent_events
+from helpers.checkpointer import conversation_config
 from typing import (
     Dict,
     List,
@@ -26,13 +37,29 @@ from fastapi import (
 from langchain_core.tracers.context import tracing_v2_enabled
 from starlette import status
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 import io
+import os
 import base64
+import asyncio
 
 functions_router = APIRouter()
 
 
+def _conversation_thread(
+        session_id: Optional[str],
+        video_url: Optional[str]
+) -> Dict[str, Any]:
+    # Malformed URLs still get their own thread, the graph reports them to the user
+    try:
+        video_id = extract_video_id(video_url) if video_url else None
+    except ValueError:
+        video_id = video_url
+
+    return conversation_config(session_id, video_id)
+
+
 @functions_router.get(path="/", summary="Check backend connection signal")
 async def check_backend_status():
     try:
@@ -41,6 +68,55 @@ async def check_backend_status():
         raise HTTPException(status_code=404, detail=str(e))
 
 
+@functions_router.get(path="/ready", summary="Check whether the startup warmup is done")
+async def check_readiness() -> Dict[str, Any]:
+    """
+    Reports readiness once the startup warmup has preloaded the indexes, model clients and hot videos.
+
+    Returns:
+    ------------
+    `Dict[str, Any]`: The warmup status, with the preloaded video IDs, their size in bytes, the warmup duration and any
+                    warmup errors.
+
+    Raises:
+    ------------
+    `HTTPException`: While the warmup is still running, an HTTP 503 error is raised.
+    """
+    if not warmup_status["ready"]:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="---WARMUP IN PROGRESS---")
+
+    return warmup_status
+
+
+@functions_router.get(path="/metrics", summary="Report cache hit rates and latencies")
+async def get_metrics() -> Dict[str, Any]:
+    """
+    Reports the process-level metrics of the backend.
+
+    Returns:
+    ------------
+    `Dict[str, Any]`: The counters and timings recorded by the backend, together with the statistics of the query
+                    embedding cache (hit rate, saved milliseconds), of the intent classifier (escalation rate), of the
+                    answer cache (hit rate), of the vectorstore cache, of the RAG context packer (prompt tokens per
+                    answer), of the conversation memory (pending summaries), of the conversation checkpointer, of the model
+                    router (health and spend per model), of the request coalescing (followers per operation) and of
+                    the video digests (builds and answers).
+    """
+    return {
+        **metrics.snapshot(),
+        "query_embedding_cache": embedding_model.stats(),
+        "intent_classifier": intent_classifier.stats(),
+        "answer_cache": answer_cache.stats(),
+        "vectorstore_cache": vectorstore_cache.stats(),
+        "context_packer": context_packer.stats(),
+        "conversation_memory": conversation_memory.stats(),
+        "checkpointer": memory.stats(),
+        "model_router": model_router.stats(),
+        "single_flight": request_flights.stats(),
+        "video_digest": video_digester.stats()
+    }
+
+
 @functions_router.post(
     path="/fetch/get_video_length",
     summary="Fetch video length",
@@ -82,7 +158,7 @@ async def fetch_video_length(payload: FetchVideoLengthModel):
     If the video length cannot be determined, the function raises a 404 error.
     """
     try:
-        video_length = scrape_video_length(payload.video_url)
+        video_length = await run_blocking(selenium_executor, scrape_video_length, payload.video_url)
 
         if video_length is not None:
             return video_length
@@ -135,7 +211,7 @@ async def fetch_transcription_element(
     If no transcription is found, the function returns: `False`
     """
     try:
-        found_transcription = check_transcription(payload.video_url)
+        found_transcription = await run_blocking(selenium_executor, check_transcription, payload.video_url)
 
         if found_transcription:
             return found_transcription
@@ -202,7 +278,7 @@ async def fetch_video_transcription(
         }
     """
     try:
-        full_transcription = scrape_transcription(video_url)
+        full_transcription = await run_blocking(selenium_executor, scrape_transcription, video_url)
 
         if full_transcription is not None:
             return full_transcription
@@ -234,6 +310,14 @@ async def converse_with_agent(
             json_schema_extra={
                 "example": "Could you tell me more about the recipe?"
             }
+        ),
+        session_id: Optional[str] = Form(
+            default=None,
+            description="ID of the client session, each session keeps its own conversation per video",
+            max_length=64,
+            json_schema_extra={
+                "example": "3f2b8c1e9a7d4e6f8b0c2d4e6f8a0b1c"
+            }
         )
 ) -> Dict[str, Any]:
     """
@@ -253,6 +337,10 @@ async def converse_with_agent(
         The message from the user to be processed by the AI agent.
         Example: "Could you tell me more about the recipe?"
 
+    `session_id: Optional[str]`
+        The ID of the client session. The conversation about the video is kept in its own thread for this session, and
+        requests without a session ID get a one-off thread.
+
     Return:
     ------------
     `Dict[str, Any]`: A dictionary containing the agent's response to the user's message.
@@ -263,8 +351,8 @@ async def converse_with_agent(
             "chat_message": chat_message
         }
 
-        with tracing_v2_enabled(project_name="TalkYou"):
-            response = chatbot.invoke(payload, config=selected_thread)
+        with tracing_v2_enabled(project_name="TalkYou"), metrics.timer("converse_with_agent.total"):
+            response = await chatbot.ainvoke(payload, config=_conversation_thread(session_id, video_url))
 
             if response is not None:
                 return response
@@ -273,6 +361,75 @@ async def converse_with_agent(
         raise HTTPException(status_code=500, detail=str(err))
 
 
+@functions_router.post(
+    path="/process/stream_agent",
+    summary="Endpoint for chatting with our agent, streaming its progress and answer tokens",
+    status_code=status.HTTP_200_OK
+)
+async def stream_agent(
+        video_url: Optional[str] = Form(
+            default=None,
+            description="URL of the YT video",
+            min_length=10,
+            max_length=100,
+            json_schema_extra={
+                "example": "https://www.youtube.com/watch?v=bG4VYwFnU8k&t=5s"
+            }
+        ),
+        chat_message: Optional[str] = Form(
+            default=None,
+            description="User's chat message",
+            min_length=5,
+            max_length=250,
+            json_schema_extra={
+                "example": "Could you tell me more about the recipe?"
+            }
+        ),
+        session_id: Optional[str] = Form(
+            default=None,
+            description="ID of the client session, each session keeps its own conversation per video",
+            max_length=64,
+            json_schema_extra={
+                "example": "3f2b8c1e9a7d4e6f8b0c2d4e6f8a0b1c"
+            }
+        )
+) -> StreamingResponse:
+    """
+    Description:
+    ------------
+    Runs the same agent graph as `/process/converse_with_agent`, but answers with a `text/event-stream` of
+    Server-Sent Events instead of waiting for the whole answer. "node" events report each graph node as it starts and
+    finishes, "token" events carry the answer as it is generated, and a final "done" event carries the same state the
+    non-streaming endpoint returns. Errors end the stream with an "error" event.
+
+    Args:
+    ------------
+    `video_url: Optional[str]`
+        The URL of the YouTube video to be used as context for the chat interaction.
+
+    `chat_message: Optional[str]`
+        The message from the user to be processed by the AI agent.
+
+    `session_id: Optional[str]`
+        The ID of the client session, selecting its conversation thread about the video.
+
+    Return:
+    ------------
+    `StreamingResponse`: The event stream.
+    """
+    payload = {
+        "video_url": video_url,
+        "chat_message": chat_message
+    }
+
+    return StreamingResponse(
+        stream_agent_events(chatbot, payload, _conversation_thread(session_id, video_url)),
+        media_type="text/event-stream",
+        # Proxies must forward every event as it is written instead of buffering the response
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @functions_router.post(
     path="/process/rag_tool",
     summary="Endpoint for chatting with the scrapped video transcription",
@@ -284,6 +441,15 @@ async def chat_with_transcriptions(
             min_length=5,
             max_length=250,
             example=["Would you tell me which version of the software was supposed to be installed?"]
+        ),
+        video_url: Optional[str] = Form(
+            default=None,
+            description="URL of the YT video the answer is restricted to, the whole corpus is searched if omitted",
+            min_length=10,
+            max_length=100,
+            json_schema_extra={
+                "example": "https://www.youtube.com/watch?v=bG4VYwFnU8k&t=5s"
+            }
         )
 ) -> Dict[str, Any]:
     """
@@ -299,6 +465,9 @@ async def chat_with_transcriptions(
     `chat_message (str)`: The user's chat message. This message will be used by the `rag_tool` to query the video transcription and
                         generate a response. The message must be between 5 and 250 characters long.
 
+    `video_url (Optional[str])`: The URL of an ingested video. Retrieval is restricted to this video's transcription. If omitted,
+                               the transcriptions of all ingested videos are searched.
+
     Returns:
     -------------
     `Dict[str, Any]`: A dictionary containing the response generated by the `rag_tool` based on the chat message and the video transcription.
@@ -310,7 +479,10 @@ async def chat_with_transcriptions(
                    is raised with a relevant error message.
     """
     try:
-        response = rag_tool._run(chat_message)
+        video_id = extract_video_id(video_url) if video_url is not None else None
+        if video_id is not None:
+            usage_catalog.record(video_id)
+        response = await rag_tool._arun(chat_message, video_id=video_id)
         if response is not None:
             return response
 
@@ -318,6 +490,99 @@ async def chat_with_transcriptions(
         raise HTTPException(status_code=404, detail=str(err))
 
 
+@functions_router.post(
+    path="/process/rag_batch",
+    summary="Endpoint for answering many questions about one video at once",
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def answer_questions_batch(
+        payload: BatchQuestionsModel
+) -> Dict[str, List[str]]:
+    """
+    Answers a list of questions about one ingested video.
+
+    Description:
+    -------------
+    Evaluation and support tools ask many questions about the same video. Instead of one `/process/rag_tool` call per
+    question, this endpoint embeds all questions in one request, retrieves for all of them with one index search over
+    the video, and generates the answers with one batch run of the RAG chain, at most `RAG_BATCH_CONCURRENCY` at a
+    time. Questions are answered standalone, without a conversation, and share the answer cache with the other
+    endpoints.
+
+    Args:
+    -------------
+    `payload (BatchQuestionsModel)`: The URL of the ingested video and the questions, at most `RAG_BATCH_MAX_QUESTIONS`.
+
+    Returns:
+    -------------
+    `Dict[str, List[str]]`: A dictionary with the "answers", in the order of the questions.
+
+    Raises:
+    -------------
+    `HTTPException`: If the URL holds no video ID or the questions cannot be answered, an HTTP 404 error is raised with
+                   the error message.
+    """
+    try:
+        video_id = extract_video_id(payload.video_url)
+        usage_catalog.record(video_id)
+        with metrics.timer("rag_batch.total"):
+            answers = await rag_tool.abatch_answer(payload.questions, video_id=video_id)
+
+        return {"answers": answers}
+
+    except Exception as err:
+        raise HTTPException(status_code=404, detail=str(err))
+
+
+@functions_router.post(
+    path="/process/build_digest",
+    summary="Builds the summary and section digest of an ingested video",
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def build_digest(
+        video_url: str = Form(
+            description="URL of the ingested YT video to digest",
+            min_length=10,
+            max_length=100,
+            json_schema_extra={
+                "example": "https://www.youtube.com/watch?v=bG4VYwFnU8k&t=5s"
+            }
+        )
+) -> Dict[str, int]:
+    """
+    Builds, or rebuilds, the digest of an ingested video.
+
+    Description:
+    ------------
+    Videos are digested in the background after their ingestion when `VIDEO_DIGEST` is enabled. This endpoint digests
+    videos ingested before, or rebuilds a digest, and waits until it is stored. Summary questions about the video are
+    answered from its digest from then on.
+
+    Args:
+    ------------
+    `video_url (str)`: The URL of the ingested video to digest.
+
+    Returns:
+    ------------
+    `Dict[str, int]`: A dictionary with the number of "sections" and "windows" of the digest.
+
+    Raises:
+    ------------
+    `HTTPException`: If the URL holds no video ID or the video has no ingested captions, an HTTP 404 error is raised with
+                   the error message.
+    """
+    try:
+        video_id = extract_video_id(video_url)
+        entries = await video_digester.abuild(video_id)
+        return {
+            "sections": sum(entry["level"] == SECTION for entry in entries),
+            "windows": sum(entry["level"] == WINDOW for entry in entries)
+        }
+
+    except Exception as err:
+        raise HTTPException(status_code=404, detail=str(err))
+
+
 @functions_router.post(
     path="/process/identify_request",
     summary='Endpoint for identifying request as either "information" or "image".',
@@ -337,7 +602,8 @@ async def identify_request(
     Description:
     ------------
     This endpoint takes a user's chat message and uses the `request_identifier`
-    tool to determine whether the request is related to text information or an image.
+    tool to determine whether the request is related to text information or an image. The local intent classifier
+    answers confident cases, and only the remaining messages are classified by the LLM.
 
     Args:
     ------------
@@ -352,10 +618,121 @@ async def identify_request(
     `HTTPException`: If an error occurs during request processing, an HTTP 422 error is raised.
     """
     try:
-        response = request_identifier._run(chat_message)
+        response = await request_identifier._arun(chat_message)
 
         if response is not None:
             return {"type": response.request_category}
 
     except Exception as err:
         raise HTTPException(status_code=422, detail=str(err))
+
+
+@functions_router.post(
+    path="/process/upgrade_indexes",
+    summary="Rebuilds saved indexes with the index type suited to their size",
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def upgrade_indexes() -> Dict[str, str]:
+    """
+    Migrates the saved vectorstores to the index type suited to their number of vectors.
+
+    Description:
+    ------------
+    Flat indexes that have outgrown `FLAT_INDEX_MAX_VECTORS` are rebuilt as HNSW or IVF indexes, following the same
+    selection that is applied whenever an index is saved. Indexes that already have the right type are left untouched.
+
+    Returns:
+    ------------
+    `Dict[str, str]`: A dictionary mapping each vectorstore folder to the factory string of its index after the upgrade.
+
+    Raises:
+    ------------
+    `HTTPException`: If an index cannot be read or rebuilt, an HTTP 500 error is raised with the error message.
+    """
+    try:
+        return {
+            folder_path: await asyncio.to_thread(upgrade_vectorstore, folder_path)
+            for folder_path in (VECTORSTORE_PATH, METADATA_PATH)
+            if os.path.isdir(folder_path)
+        }
+
+    except Exception as err:
+        raise HTTPException(status_code=500, detail=str(err))
+
+
+@functions_router.post(
+    path="/process/delete_video",
+    summary="Removes an ingested video from the shared indexes",
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def delete_video(
+        video_url: str = Form(
+            description="URL of the YT video to remove",
+            min_length=10,
+            max_length=100,
+            json_schema_extra={
+                "example": "https://www.youtube.com/watch?v=bG4VYwFnU8k&t=5s"
+            }
+        )
+) -> Dict[str, int]:
+    """
+    Removes a video from the transcription and caption indexes.
+
+    Description:
+    ------------
+    The video's segments are tombstoned and disappear from every search immediately. Their vectors are dropped by a
+    background compaction once the share of tombstoned segments reaches `COMPACTION_TOMBSTONE_RATIO`, or by
+    `/process/compact_indexes`. The video's digest is dropped with it, and the video can
+    be ingested again afterwards.
+
+    Args:
+    ------------
+    `video_url (str)`: The URL of the ingested video to remove.
+
+    Returns:
+    ------------
+    `Dict[str, int]`: A dictionary mapping each vectorstore folder to the number of tombstoned segments.
+
+    Raises:
+    ------------
+    `HTTPException`: If the URL holds no video ID or the indexes cannot be updated, an HTTP 500 error is raised with the
+                   error message.
+    """
+    try:
+        video_id = extract_video_id(video_url)
+        await asyncio.to_thread(video_digester.store.delete, video_id)
+        return {
+            folder_path: await asyncio.to_thread(delete_video_from_corpus, folder_path, video_id)
+            for folder_path in (VECTORSTORE_PATH, METADATA_PATH)
+        }
+
+    except Exception as err:
+        raise HTTPException(status_code=500, detail=str(err))
+
+
+@functions_router.post(
+    path="/process/compact_indexes",
+    summary="Removes the vectors of deleted videos from the saved indexes",
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def compact_indexes() -> Dict[str, int]:
+    """
+    Compacts the saved vectorstores right away instead of waiting for the background compaction.
+
+    Returns:
+    ------------
+    `Dict[str, int]`: A dictionary mapping each vectorstore folder to the number of vectors removed from its index.
+
+    Raises:
+    ------------
+    `HTTPException`: If an index cannot be read or rebuilt, an HTTP 500 error is raised with the error message.
+    """
+    try:
+        return {
+            folder_path: await asyncio.to_thread(compact_corpus, folder_path)
+            for folder_path in (VECTORSTORE_PATH, METADATA_PATH)
+            if os.path.isdir(folder_path)
+        }
+
+    except Exception as err:
+        raise HTTPException(status_code=500, detail=str(err))
@@ -0,0 +1,182 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult, ChatGenerationChunk
+from langchain_community.chat_models import ChatLlamaCpp
+from langchain_openai import ChatOpenAI
+from typing import Optional, Iterator, List, Dict, Any
+import threading
+import os
+
+# "openai" calls the OpenAI API, "openai_compatible" a local server speaking the same API (llama.cpp server, vLLM,
+# Ollama), and "llamacpp" runs a GGUF model inside the backend process on CPU
+CHAT_MODEL_BACKENDS = ("openai", "openai_compatible", "llamacpp")
+
+# Prices in USD per million input and output tokens, context windows in tokens, of the OpenAI models the router can use
+CHAT_MODEL_REGISTRY = {
+    "gpt-4o-mini": {"input_cost": 0.15, "output_cost": 0.60, "context_window": 128000, "quality": "high"},
+    "gpt-4o": {"input_cost": 2.50, "output_cost": 10.00, "context_window": 128000, "quality": "high"},
+    "gpt-3.5-turbo": {"input_cost": 0.50, "output_cost": 1.50, "context_window": 16385, "quality": "standard"}
+}
+
+# A llama.cpp model has a single context, so concurrent requests would corrupt each other's generation
+_llamacpp_lock = threading.Lock()
+
+
+class SerializedChatLlamaCpp(ChatLlamaCpp):
+    """
+    A llama.cpp chat model whose generations run one at a time, so it can be shared by concurrent requests.
+    """
+
+    def _generate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any
+    ) -> ChatResult:
+        with _llamacpp_lock:
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    def _stream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+            **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        with _llamacpp_lock:
+            yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+def load_chat_model(
+        backend: str,
+        model_name: str,
+        base_url: Optional[str] = None,
+        model_path: Optional[str] = None,
+        threads: Optional[int] = None,
+        context_size: int = 8192,
+        max_tokens: int = 1000
+) -> BaseChatModel:
+    """
+    Creates the chat model of the selected backend.
+
+    Description:
+    ------------
+    All backends return a LangChain chat model, so the chains, streaming and async calls work the same on each of them.
+    OpenAI-compatible servers are reached through the OpenAI client with another base URL, and any API key they ignore.
+    In-process models need `llama-cpp-python`, which is only imported when this backend is selected, and a GGUF model
+    file. Small quantized models, such as a 1.5B or 3B instruct model in Q4, answer on CPU without a network round trip.
+
+    Args:
+    ------------
+    backend (str): One of `CHAT_MODEL_BACKENDS`.
+    model_name (str): The model name sent to the OpenAI API or the compatible server.
+    base_url (Optional[str]): The URL of the OpenAI-compatible server, for instance "http://localhost:8080/v1".
+    model_path (Optional[str]): The path of the GGUF file of the in-process model.
+    threads (Optional[int]): The CPU threads of the in-process model, all cores if not given.
+    context_size (int): The context window of the in-process model in tokens.
+    max_tokens (int): The maximum number of generated tokens.
+
+    Returns:
+    ------------
+    BaseChatModel: The chat model.
+
+    Raises:
+    ------------
+    ValueError: If the backend is unknown or its server URL or model file is missing.
+    """
+    if backend not in CHAT_MODEL_BACKENDS:
+        raise ValueError(f"Unknown chat model backend '{backend}', choose one of {list(CHAT_MODEL_BACKENDS)}")
+
+    if backend == "openai":
+        return ChatOpenAI(
+            openai_api_key=os.environ.get("OPENAI_API_KEY"),
+            temperature=1e-10,
+            max_tokens=max_tokens,
+            model_name=model_name
+        )
+
+    if backend == "openai_compatible":
+        if not base_url:
+            raise ValueError("The openai_compatible backend needs LOCAL_LLM_BASE_URL")
+
+        return ChatOpenAI(
+            openai_api_key=os.environ.get("LOCAL_LLM_API_KEY", "not-needed"),
+            base_url=base_url,
+            temperature=1e-10,
+            max_tokens=max_tokens,
+            model_name=model_name
+        )
+
+    if not model_path or not os.path.exists(model_path):
+        raise ValueError(f"The llamacpp backend needs LOCAL_LLM_MODEL_PATH to point to a GGUF file, got '{model_path}'")
+
+    return SerializedChatLlamaCpp(
+        model_path=model_path,
+        n_ctx=context_size,
+        n_threads=threads or os.cpu_count(),
+        n_batch=512,
+        temperature=0.0,
+        max_tokens=max_tokens,
+        verbose=False
+    )
+
+
+def chat_model_profile(
+        backend: str,
+        model_name: str,
+        chat_model: BaseChatModel,
+        context_size: int = 8192,
+        quality: str = "standard"
+) -> Dict[str, Any]:
+    """
+    Describes a chat model for the model router.
+
+    Description:
+    ------------
+    OpenAI models take their price, context window and quality from `CHAT_MODEL_REGISTRY`. Local models cost nothing
+    per token, have the configured context window and the given quality.
+
+    Args:
+    ------------
+    backend (str): One of `CHAT_MODEL_BACKENDS`.
+    model_name (str): The name of the model.
+    chat_model (BaseChatModel): The chat model.
+    context_size (int): The context window of a local model in tokens.
+    quality (str): The quality of a local model, "high" or "standard".
+
+    Returns:
+    ------------
+    Dict[str, Any]: The "model", "input_cost", "output_cost", "context_window" and "quality" of the model.
+
+    Raises:
+    ------------
+    ValueError: If an OpenAI model is not in `CHAT_MODEL_REGISTRY`.
+    """
+    if backend != "openai":
+        return {
+            "model": chat_model, "input_cost": 0.0, "output_cost": 0.0, "context_window": context_size, "quality": quality
+        }
+
+    if model_name not in CHAT_MODEL_REGISTRY:
+        raise ValueError(f"Unknown chat model '{model_name}', choose one of {list(CHAT_MODEL_REGISTRY)}")
+
+    return {"model": chat_model, **CHAT_MODEL_REGISTRY[model_name]}
+
+
+def warm_up_chat_model(
+        chat_model: BaseChatModel
+) -> None:
+    """
+    Opens the connection of a remote chat model, or runs the first generation of an in-process one.
+
+    Args:
+    ------------
+    chat_model (BaseChatModel): The chat model to warm up.
+    """
+    if isinstance(chat_model, ChatOpenAI):
+        # Listing models is free and supported by OpenAI-compatible servers as well
+        chat_model.root_client.models.list()
+    else:
+        # The first generation pages in the weights and builds the compute buffers
+        chat_model.invoke("Hi", max_tokens=1)
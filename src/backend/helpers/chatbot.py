@@ -7,7 +7,7 @@ from typing import (
     Dict,
     List
 )
-from helpers.constants import memory
+from helpers.constants import memory, SPECULATIVE_RETRIEVAL
 from helpers.agent_states import (
     GraphState,
     check_video_length,
@@ -20,22 +20,54 @@ from helpers.agent_states import (
     load_vectorstore_states,
     check_vectorstore_presence,
     query_identifier,
+    classify_and_retrieve,
     check_request_type,
     proceed_to_rag,
     proceed_to_image_retrieval,
-    take_video_screenshot
+    check_moment_found,
+    take_video_screenshot,
+    coalesce_ingestion
 )
 
+# Fetches the transcription of a video and indexes it, run once per video by the "ingest_video" node
+ingestion_workflow = StateGraph(GraphState)
+ingestion_workflow.add_node("check_video_length", check_video_length)
+ingestion_workflow.add_node("check_transcription", check_transcription_element)
+ingestion_workflow.add_node("download_with_pytube", download_with_pytube)
+ingestion_workflow.add_node("extract_transcription", extract_transcription)
+ingestion_workflow.add_node("create_vectorstore", init_vectorstore)
+
+ingestion_workflow.add_edge(START, "check_video_length")
+ingestion_workflow.add_conditional_edges(
+    "check_video_length",
+    selenium_or_pytube,
+    {
+        "Selenium": "check_transcription",
+        "Pytube": "download_with_pytube"
+    }
+)
+
+ingestion_workflow.add_conditional_edges(
+    "check_transcription",
+    scrape_or_download,
+    {
+        "Scrape": "extract_transcription",
+        "Download": "download_with_pytube"
+    }
+)
+ingestion_workflow.add_edge("download_with_pytube", "create_vectorstore")
+ingestion_workflow.add_edge("extract_transcription", "create_vectorstore")
+ingestion_workflow.add_edge("create_vectorstore", END)
+
+ingestion = ingestion_workflow.compile()
+
 workflow = StateGraph(GraphState)
 workflow.add_node("check_vectorstore_presence", load_vectorstore_states)
-workflow.add_node("query_identifier", query_identifier)
+# The speculative variant retrieves the RAG context while the request is classified, the RAG branch then reuses it
+workflow.add_node("query_identifier", classify_and_retrieve if SPECULATIVE_RETRIEVAL else query_identifier)
 workflow.add_node("continue_rag", proceed_to_rag)
 workflow.add_node("continue_image_retrieval", proceed_to_image_retrieval)
-workflow.add_node("check_video_length", check_video_length)
-workflow.add_node("check_transcription", check_transcription_element)
-workflow.add_node("download_with_pytube", download_with_pytube)
-workflow.add_node("extract_transcription", extract_transcription)
-workflow.add_node("create_vectorstore", init_vectorstore)
+workflow.add_node("ingest_video", coalesce_ingestion(ingestion))
 workflow.add_node("take_screenshot", take_video_screenshot)
 
 workflow.add_edge(START, "check_vectorstore_presence")
@@ -44,7 +76,7 @@ workflow.add_conditional_edges(
     check_vectorstore_presence,
     {
         "Chatbot": "query_identifier",
-        "Fetch Data": "check_video_length"
+        "Fetch Data": "ingest_video"
     }
 )
 
@@ -58,28 +90,15 @@ workflow.add_conditional_edges(
 )
 
 workflow.add_edge("continue_rag", END)
-workflow.add_edge("continue_image_retrieval", "take_screenshot")
-workflow.add_edge("take_screenshot", END)
-
 workflow.add_conditional_edges(
-    "check_video_length",
-    selenium_or_pytube,
+    "continue_image_retrieval",
+    check_moment_found,
     {
-        "Selenium": "check_transcription",
-        "Pytube": "download_with_pytube"
+        "Screenshot": "take_screenshot",
+        "Not Found": END
     }
 )
-
-workflow.add_conditional_edges(
-    "check_transcription",
-    scrape_or_download,
-    {
-        "Scrape": "extract_transcription",
-        "Download": "download_with_pytube"
-    }
-)
-workflow.add_edge("download_with_pytube", "create_vectorstore")
-workflow.add_edge("extract_transcription", "create_vectorstore")
-workflow.add_edge("create_vectorstore", END)
+workflow.add_edge("take_screenshot", END)
+workflow.add_edge("ingest_video", END)
 
 chatbot = workflow.compile(checkpointer=memory)
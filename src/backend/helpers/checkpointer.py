@@ -0,0 +1,383 @@
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id
+)
+from langgraph.checkpoint.serde.types import TASKS
+from langchain_core.runnables import RunnableConfig
+from helpers.metrics import metrics
+from typing import Optional, Iterator, AsyncIterator, Sequence, Tuple, List, Dict, Any
+import threading
+import sqlite3
+import asyncio
+import time
+import uuid
+import os
+
+
+def conversation_config(
+        session_id: Optional[str],
+        video_id: Optional[str]
+) -> RunnableConfig:
+    """
+    Builds the graph config of the conversation a session holds about a video.
+
+    Description:
+    ------------
+    Every session gets its own conversation thread per video, so users never read or overwrite each other's graph state,
+    and switching videos starts a fresh thread. Requests without a session ID get a one-off thread, which is pruned with
+    the other idle threads.
+
+    Args:
+    ------------
+    session_id (Optional[str]): The ID the client generated for its session.
+    video_id (Optional[str]): The ID of the video the conversation is about.
+
+    Returns:
+    ------------
+    RunnableConfig: The config selecting the conversation thread.
+    """
+    session_id = session_id or uuid.uuid4().hex
+    return {"configurable": {"thread_id": f"{session_id}:{video_id or 'no-video'}"}}
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver):
+    """
+    A LangGraph checkpointer persisting conversation threads in a local SQLite database, with bounded history.
+
+    Description:
+    ------------
+    Checkpoints and pending writes are serialized into a SQLite file instead of process memory, so conversations survive
+    restarts and the process does not grow with traffic. Each thread keeps only its `max_checkpoints_per_thread` latest
+    checkpoints, since the graph only resumes from the latest one and reads the pending sends of its parent. At most every
+    `prune_interval_seconds`, saving a checkpoint also deletes threads idle for longer than `thread_ttl_seconds` and
+    the least recently used threads beyond `max_threads`, so the database stays bounded as well. The async methods
+    run the same queries in a worker thread, off the event loop.
+
+    Attributes:
+    -----------
+    database_path : str
+        The path of the SQLite database.
+    max_checkpoints_per_thread : int
+        The number of latest checkpoints kept per thread, at least 2.
+    thread_ttl_seconds : float
+        The idle time after which a thread is deleted.
+    max_threads : int
+        The maximum number of threads kept.
+    prune_interval_seconds : float
+        The minimum time between two prunings.
+
+    Methods:
+    --------
+    get_tuple(config: RunnableConfig) -> Optional[CheckpointTuple]:
+        Returns the checkpoint the config selects, or the latest checkpoint of its thread.
+
+    list(config: Optional[RunnableConfig], filter, before, limit) -> Iterator[CheckpointTuple]:
+        Yields the checkpoints matching the config and filters, latest first.
+
+    put(config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions) -> RunnableConfig:
+        Saves a checkpoint and trims the history of its thread.
+
+    put_writes(config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str):
+        Saves the pending writes of a task.
+
+    prune() -> int:
+        Deletes idle threads and the least recently used threads beyond the limit, and returns their number.
+
+    stats() -> Dict[str, Any]:
+        Returns the number of threads and checkpoints and the size of the database.
+    """
+
+    def __init__(
+            self,
+            database_path: str,
+            max_checkpoints_per_thread: int,
+            thread_ttl_seconds: float,
+            max_threads: int,
+            prune_interval_seconds: float = 300.0
+    ):
+        super().__init__()
+        self.database_path = database_path
+        self.max_checkpoints_per_thread = max(max_checkpoints_per_thread, 2)
+        self.thread_ttl_seconds = thread_ttl_seconds
+        self.max_threads = max_threads
+        self.prune_interval_seconds = prune_interval_seconds
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS threads_last_used ON threads (last_used);
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT,
+                checkpoint_type TEXT NOT NULL,
+                checkpoint BLOB NOT NULL,
+                metadata_type TEXT NOT NULL,
+                metadata BLOB NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+            );
+            CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                value_type TEXT NOT NULL,
+                value BLOB NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+            """
+        )
+        self._connection.commit()
+
+    def _writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[Tuple[str, str, str, bytes]]:
+        return self._connection.execute(
+            """
+            SELECT task_id, channel, value_type, value FROM writes
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+            ORDER BY task_id, idx
+            """,
+            (thread_id, checkpoint_ns, checkpoint_id)
+        ).fetchall()
+
+    def _to_tuple(self, row: Tuple[Any, ...]) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, \
+            metadata = row
+
+        # The sends of the parent's tasks are delivered to this checkpoint
+        sends = []
+        if parent_checkpoint_id:
+            sends = [
+                self.serde.loads_typed((value_type, value))
+                for _, channel, value_type, value in self._writes(thread_id, checkpoint_ns, parent_checkpoint_id)
+                if channel == TASKS
+            ]
+
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id
+                }
+            },
+            checkpoint={**self.serde.loads_typed((checkpoint_type, checkpoint)), "pending_sends": sends},
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": parent_checkpoint_id
+                }
+            } if parent_checkpoint_id else None,
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((value_type, value)))
+                for task_id, channel, value_type, value in self._writes(thread_id, checkpoint_ns, checkpoint_id)
+            ]
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        query = "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+        parameters: Tuple[Any, ...] = (thread_id, checkpoint_ns)
+        if checkpoint_id := get_checkpoint_id(config):
+            query += " AND checkpoint_id = ?"
+            parameters += (checkpoint_id,)
+
+        with self._lock:
+            # Checkpoint IDs are time-ordered, so the greatest one is the latest checkpoint
+            row = self._connection.execute(query + " ORDER BY checkpoint_id DESC LIMIT 1", parameters).fetchone()
+            return self._to_tuple(row) if row else None
+
+    def list(
+            self,
+            config: Optional[RunnableConfig],
+            *,
+            filter: Optional[Dict[str, Any]] = None,
+            before: Optional[RunnableConfig] = None,
+            limit: Optional[int] = None
+    ) -> Iterator[CheckpointTuple]:
+        conditions, parameters = [], []
+        if config:
+            conditions.append("thread_id = ?")
+            parameters.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                conditions.append("checkpoint_ns = ?")
+                parameters.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                parameters.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            conditions.append("checkpoint_id < ?")
+            parameters.append(before_checkpoint_id)
+
+        query = "SELECT * FROM checkpoints"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY checkpoint_id DESC", parameters).fetchall()
+            checkpoints = []
+            for row in rows:
+                if limit is not None and len(checkpoints) >= limit:
+                    break
+
+                checkpoint = self._to_tuple(row)
+                if filter and not all(checkpoint.metadata.get(key) == value for key, value in filter.items()):
+                    continue
+                checkpoints.append(checkpoint)
+
+        yield from checkpoints
+
+    def put(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        stored_checkpoint = {key: value for key, value in checkpoint.items() if key != "pending_sends"}
+        checkpoint_type, checkpoint_blob = self.serde.dumps_typed(stored_checkpoint)
+        metadata_type, metadata_blob = self.serde.dumps_typed(metadata)
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                    checkpoint_type, checkpoint_blob, metadata_type, metadata_blob
+                )
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO threads (thread_id, last_used) VALUES (?, ?)",
+                (thread_id, time.time())
+            )
+
+            # Older checkpoints and their writes are never resumed from, only the history needs them
+            self._connection.execute(
+                """
+                DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                    SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+                    ORDER BY checkpoint_id DESC LIMIT ?
+                )
+                """,
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.max_checkpoints_per_thread)
+            )
+            self._connection.execute(
+                """
+                DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                    SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+                )
+                """,
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns)
+            )
+
+        if time.time() - self._last_prune >= self.prune_interval_seconds:
+            self.prune()
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"]
+            }
+        }
+
+    def put_writes(
+            self,
+            config: RunnableConfig,
+            writes: Sequence[Tuple[str, Any]],
+            task_id: str
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = [
+            (thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel,
+             *self.serde.dumps_typed(value))
+            for idx, (channel, value) in enumerate(writes)
+        ]
+
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def prune(self) -> int:
+        with self._lock, self._connection:
+            self._last_prune = time.time()
+            expired = self._connection.execute(
+                """
+                SELECT thread_id FROM threads WHERE last_used < ?
+                UNION
+                SELECT thread_id FROM (SELECT thread_id FROM threads ORDER BY last_used DESC LIMIT -1 OFFSET ?)
+                """,
+                (self._last_prune - self.thread_ttl_seconds, self.max_threads)
+            ).fetchall()
+
+            for table in ("writes", "checkpoints", "threads"):
+                self._connection.executemany(f"DELETE FROM {table} WHERE thread_id = ?", expired)
+
+        metrics.increment("checkpointer.pruned_threads", len(expired))
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            threads = self._connection.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+            checkpoints = self._connection.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+
+        return {
+            "threads": threads,
+            "max_threads": self.max_threads,
+            "checkpoints": checkpoints,
+            "pruned_threads": metrics.snapshot()["counters"].get("checkpointer.pruned_threads", 0),
+            "database_bytes": os.path.getsize(self.database_path) if os.path.exists(self.database_path) else 0
+        }
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+            self,
+            config: Optional[RunnableConfig],
+            *,
+            filter: Optional[Dict[str, Any]] = None,
+            before: Optional[RunnableConfig] = None,
+            limit: Optional[int] = None
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoints = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint in checkpoints:
+            yield checkpoint
+
+    async def aput(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+            self,
+            config: RunnableConfig,
+            writes: Sequence[Tuple[str, Any]],
+            task_id: str
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id)
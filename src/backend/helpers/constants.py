@@ -2,9 +2,15 @@ from selenium import webdriver
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_openai import OpenAIEmbeddings
+from helpers.embedding_cache import CachedQueryEmbeddings
+from helpers.answer_cache import SemanticAnswerCache
+from helpers.single_flight import SingleFlight
+from helpers.checkpointer import SqliteCheckpointSaver
+from helpers.chat_models import load_chat_model, chat_model_profile
+from helpers.model_router import ModelRouter
 from dotenv import load_dotenv
+from typing import Union, Optional, Any
 import os
 import yaml
 
@@ -21,6 +27,35 @@ def load_sys_prompt(
     return decoded_prompt["sys_prompt"]
 
 
+def load_embedding_model(
+        model_name: str,
+        dimensions: Optional[int] = None
+) -> Union[OpenAIEmbeddings, Any]:
+    if model_name not in EMBEDDING_MODEL_REGISTRY:
+        raise ValueError(
+            f"Unknown embedding model '{model_name}', choose one of {sorted(EMBEDDING_MODEL_REGISTRY)}"
+        )
+
+    if dimensions is not None and not EMBEDDING_MODEL_REGISTRY[model_name].get("shortenable", False):
+        raise ValueError(f"Embedding model '{model_name}' does not support requesting {dimensions} dimensions")
+
+    if EMBEDDING_MODEL_REGISTRY[model_name]["backend"] == "local":
+        # sentence-transformers is only needed when a local model is selected
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": "cpu"},
+            encode_kwargs={"normalize_embeddings": True}
+        )
+
+    return OpenAIEmbeddings(
+        openai_api_key=os.environ.get("OPENAI_API_KEY"),
+        model=model_name,
+        dimensions=dimensions
+    )
+
+
 # SELENIUM
 service = Service(ChromeDriverManager().install())
 options = Options()
@@ -34,31 +69,174 @@ options.add_argument(
 driver = webdriver.Chrome(service=service, options=options)
 
 # MODELS
-gpt_4o_mini = ChatOpenAI(
-    openai_api_key=os.environ.get("OPENAI_API_KEY"),
-    temperature=1e-10,
-    max_tokens=1000,
-    model_name="gpt-4o-mini"
+CHAT_MODEL_BACKEND = os.environ.get("CHAT_MODEL_BACKEND", "openai")
+CHAT_MODEL_NAME = os.environ.get("CHAT_MODEL", "gpt-4o-mini")
+LOCAL_LLM_BASE_URL = os.environ.get("LOCAL_LLM_BASE_URL", "http://localhost:8080/v1")
+LOCAL_LLM_MODEL_PATH = os.environ.get("LOCAL_LLM_MODEL_PATH")
+LOCAL_LLM_THREADS = int(os.environ["LOCAL_LLM_THREADS"]) if os.environ.get("LOCAL_LLM_THREADS") else None
+LOCAL_LLM_CONTEXT = int(os.environ.get("LOCAL_LLM_CONTEXT", 8192))
+
+# The chat model classifying requests, answering questions and summarizing conversations
+chat_model = load_chat_model(
+    CHAT_MODEL_BACKEND,
+    CHAT_MODEL_NAME,
+    base_url=LOCAL_LLM_BASE_URL,
+    model_path=LOCAL_LLM_MODEL_PATH,
+    threads=LOCAL_LLM_THREADS,
+    context_size=LOCAL_LLM_CONTEXT
 )
 
-gpt_3_5 = ChatOpenAI(
-    openai_api_key=os.environ.get("OPENAI_API_KEY"),
-    temperature=1e-10,
-    max_tokens=1000,
-    model_name="gpt-3.5-turbo"
+# MODEL ROUTING (each call goes to the healthy, fitting and cheapest model and fails over along the ranking)
+ROUTER_FALLBACK_MODELS = [
+    name for name in os.environ.get("ROUTER_FALLBACK_MODELS", "gpt-4o-mini,gpt-3.5-turbo").split(",") if name
+]
+LOCAL_LLM_QUALITY = os.environ.get("LOCAL_LLM_QUALITY", "standard")
+ROUTER_LATENCY_SLO_MS = {
+    "classification": float(os.environ.get("ROUTER_CLASSIFICATION_SLO_MS", 2000)),
+    "summary": float(os.environ.get("ROUTER_SUMMARY_SLO_MS", 8000)),
+    "generation": float(os.environ.get("ROUTER_GENERATION_SLO_MS", 10000))
+}
+ROUTER_MAX_ERROR_RATE = float(os.environ.get("ROUTER_MAX_ERROR_RATE", 0.2))
+ROUTER_WINDOW_SECONDS = float(os.environ.get("ROUTER_WINDOW_SECONDS", 300))
+ROUTER_MIN_CALLS = int(os.environ.get("ROUTER_MIN_CALLS", 5))
+ROUTER_LONG_CONTEXT_TOKENS = int(os.environ.get("ROUTER_LONG_CONTEXT_TOKENS", 2000))
+ROUTER_LONG_QUESTION_CHARACTERS = int(os.environ.get("ROUTER_LONG_QUESTION_CHARACTERS", 300))
+ROUTER_DECISION_LOG_PATH = os.environ.get("ROUTER_DECISION_LOG_PATH", "./routing_decisions.jsonl")
+
+model_profiles = {
+    f"{CHAT_MODEL_BACKEND}/{CHAT_MODEL_NAME}": chat_model_profile(
+        CHAT_MODEL_BACKEND, CHAT_MODEL_NAME, chat_model, context_size=LOCAL_LLM_CONTEXT, quality=LOCAL_LLM_QUALITY
+    )
+}
+for fallback_model in ROUTER_FALLBACK_MODELS:
+    if f"openai/{fallback_model}" not in model_profiles:
+        model_profiles[f"openai/{fallback_model}"] = chat_model_profile(
+            "openai", fallback_model, load_chat_model("openai", fallback_model)
+        )
+
+model_router = ModelRouter(
+    profiles=model_profiles,
+    latency_slo_ms=ROUTER_LATENCY_SLO_MS,
+    max_error_rate=ROUTER_MAX_ERROR_RATE,
+    window_seconds=ROUTER_WINDOW_SECONDS,
+    min_calls=ROUTER_MIN_CALLS,
+    long_context_tokens=ROUTER_LONG_CONTEXT_TOKENS,
+    long_question_characters=ROUTER_LONG_QUESTION_CHARACTERS,
+    decision_log_path=ROUTER_DECISION_LOG_PATH
 )
 
-text_embedding_v3_small = OpenAIEmbeddings(
-    openai_api_key=os.environ.get("OPENAI_API_KEY"),
-    model="text-embedding-3-small"
+# EMBEDDINGS
+# Output dimensions are registered here so that indexes can be created without probing the model
+EMBEDDING_MODEL_REGISTRY = {
+    "text-embedding-3-small": {"backend": "openai", "dimensions": 1536, "shortenable": True},
+    "text-embedding-3-large": {"backend": "openai", "dimensions": 3072, "shortenable": True},
+    "text-embedding-ada-002": {"backend": "openai", "dimensions": 1536},
+    "sentence-transformers/all-MiniLM-L6-v2": {"backend": "local", "dimensions": 384},
+    "sentence-transformers/all-mpnet-base-v2": {"backend": "local", "dimensions": 768},
+    "BAAI/bge-small-en-v1.5": {"backend": "local", "dimensions": 384},
+}
+EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
+# text-embedding-3 models can return shortened vectors, which lose little recall at a fraction of the memory
+EMBEDDING_DIMENSIONS = int(os.environ["EMBEDDING_DIMENSIONS"]) if os.environ.get("EMBEDDING_DIMENSIONS") else None
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 4096))
+
+embedding_model = CachedQueryEmbeddings(
+    load_embedding_model(EMBEDDING_MODEL_NAME, dimensions=EMBEDDING_DIMENSIONS),
+    model=EMBEDDING_MODEL_NAME,
+    max_entries=QUERY_EMBEDDING_CACHE_SIZE,
+    dimensions=EMBEDDING_DIMENSIONS
 )
 
-# LANGGRAPH MEMORY
-memory = MemorySaver()
+# DATA (index folders and databases written by the backend)
+DATA_DIR = os.environ.get("DATA_DIR", ".")
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# VECTORSTORES
+VECTORSTORE_PATH = os.path.join(DATA_DIR, "faiss_vectorstore")
+METADATA_PATH = os.path.join(DATA_DIR, "faiss_metadata")
+VECTORSTORE_CACHE_MAX_BYTES = int(os.environ.get("VECTORSTORE_CACHE_MAX_MB", 1024)) * 1024 * 1024
+USAGE_CATALOG_PATH = os.path.join(DATA_DIR, "video_usage.sqlite")
+WARMUP_MAX_VIDEOS = int(os.environ.get("WARMUP_MAX_VIDEOS", 20))
+WARMUP_MAX_BYTES = int(os.environ.get("WARMUP_MAX_MB", 256)) * 1024 * 1024
+COMPACTION_TOMBSTONE_RATIO = float(os.environ.get("COMPACTION_TOMBSTONE_RATIO", 0.2))
+INDEX_MAX_SHARDS = int(os.environ.get("INDEX_MAX_SHARDS", 8))
+
+# INDEX SELECTION (defaults chosen from benchmarks/ann_index_report.py)
+FLAT_INDEX_MAX_VECTORS = int(os.environ.get("FLAT_INDEX_MAX_VECTORS", 50_000))
+HNSW_INDEX_MAX_VECTORS = int(os.environ.get("HNSW_INDEX_MAX_VECTORS", 2_000_000))
+HNSW_M = int(os.environ.get("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 80))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 64))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 32))
+# float32 keeps vectors exact, float16 halves their memory and int8 quarters it
+VECTOR_ENCODING = os.environ.get("VECTOR_ENCODING", "float32")
+
+# HYBRID RETRIEVAL (BM25 and vector hits fused by reciprocal rank)
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", 20))
+RRF_K = int(os.environ.get("RRF_K", 60))
+
+# RAG CONTEXT (candidate segments packed into a token budget)
+RAG_CANDIDATES = int(os.environ.get("RAG_CANDIDATES", 8))
+RAG_CONTEXT_TOKENS = int(os.environ.get("RAG_CONTEXT_TOKENS", 3000))
+TRANSCRIPT_CHUNK_CHARACTERS = int(os.environ.get("TRANSCRIPT_CHUNK_CHARACTERS", 1000))
+TRANSCRIPT_CHUNK_OVERLAP_CHARACTERS = int(os.environ.get("TRANSCRIPT_CHUNK_OVERLAP_CHARACTERS", 100))
 
-# LANGGRAPH THREAD
-selected_thread = {"configurable": {"thread_id": "1"}}
+# BATCH QUESTION ANSWERING (questions answered together, with this many generations in flight at once)
+RAG_BATCH_MAX_QUESTIONS = int(os.environ.get("RAG_BATCH_MAX_QUESTIONS", 100))
+RAG_BATCH_CONCURRENCY = int(os.environ.get("RAG_BATCH_CONCURRENCY", 8))
+
+# TIMESTAMP SEARCH
+TIMESTAMP_WINDOW_SECONDS = float(os.environ.get("TIMESTAMP_WINDOW_SECONDS", 20))
+TIMESTAMP_CANDIDATES = int(os.environ.get("TIMESTAMP_CANDIDATES", 3))
+
+# ANSWER CACHE (answers reused for near-identical questions about the same video)
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 1024))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 24 * 3600))
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0.95))
+
+answer_cache = SemanticAnswerCache(
+    max_entries=ANSWER_CACHE_SIZE,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY
+)
+
+# SPECULATIVE RETRIEVAL (the chat graph retrieves context while it classifies the request)
+SPECULATIVE_RETRIEVAL = os.environ.get("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+
+# VIDEO DIGEST (summaries per time window, section and video, built after ingestion and used for summary questions)
+VIDEO_DIGEST = os.environ.get("VIDEO_DIGEST", "true").lower() == "true"
+DIGEST_WINDOW_SECONDS = float(os.environ.get("DIGEST_WINDOW_SECONDS", 120))
+DIGEST_WINDOWS_PER_SECTION = int(os.environ.get("DIGEST_WINDOWS_PER_SECTION", 5))
+DIGEST_SUMMARY_TOKENS = int(os.environ.get("DIGEST_SUMMARY_TOKENS", 200))
+
+# REQUEST COALESCING (concurrent identical ingestions, classifications and answers share one computation)
+SINGLE_FLIGHT = os.environ.get("SINGLE_FLIGHT", "true").lower() == "true"
+
+request_flights = SingleFlight(enabled=SINGLE_FLIGHT)
+
+# INTENT CLASSIFICATION (messages below this local confidence are classified by the LLM)
+INTENT_CONFIDENCE_THRESHOLD = float(os.environ.get("INTENT_CONFIDENCE_THRESHOLD", 0.75))
+
+# CONVERSATION MEMORY (recent turns kept verbatim, older turns folded into a bounded summary)
+MEMORY_RECENT_TOKENS = int(os.environ.get("MEMORY_RECENT_TOKENS", 1000))
+MEMORY_SUMMARY_TOKENS = int(os.environ.get("MEMORY_SUMMARY_TOKENS", 300))
+
+# LANGGRAPH MEMORY (one conversation thread per session and video, persisted with bounded history)
+CHECKPOINT_DATABASE_PATH = os.environ.get("CHECKPOINT_DATABASE_PATH", os.path.join(DATA_DIR, "conversations.sqlite"))
+CHECKPOINTS_PER_THREAD = int(os.environ.get("CHECKPOINTS_PER_THREAD", 20))
+CHECKPOINT_THREAD_TTL_SECONDS = float(os.environ.get("CHECKPOINT_THREAD_TTL_SECONDS", 7 * 24 * 3600))
+CHECKPOINT_MAX_THREADS = int(os.environ.get("CHECKPOINT_MAX_THREADS", 10_000))
+
+memory = SqliteCheckpointSaver(
+    database_path=CHECKPOINT_DATABASE_PATH,
+    max_checkpoints_per_thread=CHECKPOINTS_PER_THREAD,
+    thread_ttl_seconds=CHECKPOINT_THREAD_TTL_SECONDS,
+    max_threads=CHECKPOINT_MAX_THREADS
+)
 
 # PROMPTS
 request_identification_prompt_template = load_sys_prompt("request_identification")
 rag_prompt_template = load_sys_prompt("rag_tool")
+conversation_summary_prompt_template = load_sys_prompt("conversation_summary")
+video_digest_prompt_template = load_sys_prompt("video_digest")
+digest_answer_prompt_template = load_sys_prompt("digest_answer")
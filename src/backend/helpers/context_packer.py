@@ -0,0 +1,204 @@
+from langchain_core.documents import Document
+from helpers.tokenizer import count_tokens, truncate_tokens
+from helpers.metrics import metrics
+from typing import Optional, List, Dict, Any
+
+# Chunk overlaps shorter than this are treated as coincidence rather than a shared window
+MIN_OVERLAP_CHARACTERS = 20
+
+
+def _format_time(seconds: Optional[float]) -> str:
+    seconds = int(seconds or 0)
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+def _overlap(left: str, right: str) -> int:
+    # Longest suffix of `left` that is a prefix of `right`, found from the occurrences of the start of `right`
+    anchor = right[:MIN_OVERLAP_CHARACTERS]
+    position = left.find(anchor, max(len(left) - len(right), 0))
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(anchor, position + 1)
+
+    return 0
+
+
+def _adjacent(left: Dict[str, Any], right: Dict[str, Any], max_gap_seconds: float) -> bool:
+    if left["last_id"] is not None and right["first_id"] is not None and right["first_id"] == left["last_id"] + 1:
+        return True
+
+    if left["end"] is not None and right["start"] is not None:
+        return right["start"] - left["end"] <= max_gap_seconds
+
+    return _overlap(left["text"], right["text"]) >= MIN_OVERLAP_CHARACTERS
+
+
+def merge_segments(
+        documents: List[Document],
+        max_gap_seconds: float = 1.0
+) -> List[Dict[str, Any]]:
+    """
+    Merges retrieved segments that repeat or continue each other.
+
+    Description:
+    ------------
+    Transcript chunks share an overlapping window with their neighbours, and caption segments of one moment are often
+    retrieved together. Segments whose text is contained in another segment of the same video are dropped. Segments of
+    the same video that are consecutive in the index, that follow each other within `max_gap_seconds`, or whose texts
+    overlap are merged into one span, and the overlapping text is kept once. A merged span takes the best rank of its
+    segments.
+
+    Args:
+    ------------
+    documents (List[Document]): The retrieved segments, best first.
+    max_gap_seconds (float): The largest gap between two segments' timestamps for them to be merged.
+
+    Returns:
+    ------------
+    List[Dict[str, Any]]: The merged spans in timeline order, each with the "video_id", "start", "end", "first_id",
+                          "last_id", "text" and "rank" of its segments.
+    """
+    spans = []
+    for rank, document in enumerate(documents):
+        text = document.page_content.strip()
+        if not text:
+            continue
+
+        metadata = document.metadata
+        spans.append({
+            "video_id": metadata.get("video_id"),
+            "start": metadata.get("start"),
+            "end": metadata.get("end"),
+            "first_id": metadata.get("segment_id"),
+            "last_id": metadata.get("segment_id"),
+            "text": text,
+            "rank": rank
+        })
+
+    # Contained duplicates are dropped before merging, so the span keeps the better ranked copy
+    unique_spans = []
+    for span in sorted(spans, key=lambda span: -len(span["text"])):
+        container = next(
+            (kept for kept in unique_spans if kept["video_id"] == span["video_id"] and span["text"] in kept["text"]),
+            None
+        )
+        if container is None:
+            unique_spans.append(span)
+        else:
+            container["rank"] = min(container["rank"], span["rank"])
+
+    timeline = sorted(
+        unique_spans,
+        key=lambda span: (
+            str(span["video_id"]),
+            span["first_id"] if span["first_id"] is not None else -1,
+            span["start"] if span["start"] is not None else -1.0,
+            span["rank"]
+        )
+    )
+
+    merged: List[Dict[str, Any]] = []
+    for span in timeline:
+        previous = merged[-1] if merged else None
+        if previous is None or previous["video_id"] != span["video_id"] or not _adjacent(previous, span, max_gap_seconds):
+            merged.append(dict(span))
+            continue
+
+        overlap = _overlap(previous["text"], span["text"])
+        previous["text"] = previous["text"] + ("" if overlap else " ") + span["text"][overlap:]
+        previous["end"] = span["end"] if span["end"] is not None else previous["end"]
+        previous["last_id"] = span["last_id"] if span["last_id"] is not None else previous["last_id"]
+        previous["rank"] = min(previous["rank"], span["rank"])
+        metrics.increment("context_packer.merged_segments")
+
+    return merged
+
+
+class ContextPacker:
+    """
+    Assembles the retrieved segments of a question into a prompt context within a token budget.
+
+    Description:
+    ------------
+    Retrieved segments are merged by `merge_segments`, so overlapping windows and neighbouring captions are sent once.
+    The merged spans are then taken in order of their best retrieval rank until `token_budget` is used up. Spans that do
+    not fit are skipped in favour of smaller, lower ranked ones, and a best span larger than the whole budget is cut to
+    it. The chosen spans are rendered in timeline order with their timestamps, which reads more naturally than rank
+    order. Tokens are counted with the chat model's cached tokenizer, and the context size of every answer is recorded in
+    `metrics`.
+
+    Attributes:
+    -----------
+    model_name : str
+        The name of the chat model whose tokenizer measures the budget.
+    token_budget : int
+        The maximum number of context tokens.
+
+    Methods:
+    --------
+    pack(documents: List[Document]) -> str:
+        Returns the context built from the retrieved segments.
+
+    count_prompt(prompt: str) -> int:
+        Counts and records the tokens of a complete prompt.
+
+    stats() -> Dict[str, Any]:
+        Returns the mean context and prompt tokens per answer and the number of merged and skipped segments.
+    """
+
+    def __init__(self, model_name: str, token_budget: int):
+        self.model_name = model_name
+        self.token_budget = token_budget
+
+    @staticmethod
+    def _render(span: Dict[str, Any], with_video_id: bool) -> str:
+        labels = []
+        if with_video_id:
+            labels.append(f"video {span['video_id']}")
+        if span["start"] is not None:
+            end = f" - {_format_time(span['end'])}" if span["end"] is not None else ""
+            labels.append(f"{_format_time(span['start'])}{end}")
+
+        return f"[{', '.join(labels)}] {span['text']}" if labels else span["text"]
+
+    def pack(self, documents: List[Document]) -> str:
+        spans = merge_segments(documents)
+        with_video_id = len({span["video_id"] for span in spans}) > 1
+
+        chosen, used_tokens = [], 0
+        for position, span in sorted(enumerate(spans), key=lambda item: item[1]["rank"]):
+            rendered = self._render(span, with_video_id)
+            tokens = count_tokens(rendered, self.model_name)
+            if used_tokens + tokens > self.token_budget:
+                if chosen:
+                    metrics.increment("context_packer.skipped_segments")
+                    continue
+                rendered = truncate_tokens(rendered, self.token_budget, self.model_name)
+                tokens = count_tokens(rendered, self.model_name)
+
+            chosen.append((position, rendered))
+            used_tokens += tokens
+
+        chosen.sort()
+        metrics.increment("context_packer.answers")
+        metrics.increment("context_packer.context_tokens", used_tokens)
+        return "\n\n".join(rendered for _, rendered in chosen)
+
+    def count_prompt(self, prompt: str) -> int:
+        tokens = count_tokens(prompt, self.model_name)
+        metrics.increment("context_packer.prompt_tokens", tokens)
+        return tokens
+
+    def stats(self) -> Dict[str, Any]:
+        counters = metrics.snapshot()["counters"]
+        answers = counters.get("context_packer.answers", 0)
+
+        return {
+            "answers": answers,
+            "token_budget": self.token_budget,
+            "context_tokens_mean": counters.get("context_packer.context_tokens", 0) / answers if answers else 0.0,
+            "prompt_tokens_mean": counters.get("context_packer.prompt_tokens", 0) / answers if answers else 0.0,
+            "merged_segments": counters.get("context_packer.merged_segments", 0),
+            "skipped_segments": counters.get("context_packer.skipped_segments", 0)
+        }
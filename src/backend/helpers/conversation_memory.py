@@ -0,0 +1,145 @@
+from langchain_core.runnables import Runnable
+from helpers.tokenizer import count_tokens, truncate_tokens
+from helpers.executors import summary_executor
+from helpers.metrics import metrics
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Any
+import threading
+
+
+class ConversationMemory:
+    """
+    A token-budgeted memory of a conversation, with recent turns kept verbatim and older turns folded into a summary.
+
+    Description:
+    ------------
+    The turns and the summary of a conversation live in its graph state, so they are persisted with the conversation
+    thread. Before each answer, `prepare` keeps the latest turns that fit `recent_token_budget` verbatim. The older turns
+    are summarized, together with the previous summary, on the summary worker while the answer is generated. The finished
+    summary is folded into the state at the next turn, so the answer never waits for the summarizer. The summary is cut
+    to `summary_token_budget`, which keeps the prompt size constant however long the conversation grows. Turns waiting
+    for their summary are left out of the prompt. If summarizing fails, they are dropped and the previous summary is
+    kept.
+
+    Attributes:
+    -----------
+    summarizer : Runnable
+        The chain turning a previous summary and older turns into a new summary.
+    model_name : str
+        The name of the chat model whose tokenizer measures the budgets.
+    recent_token_budget : int
+        The maximum number of tokens of the turns kept verbatim.
+    summary_token_budget : int
+        The maximum number of tokens of the summary.
+    max_pending : int
+        The maximum number of summaries kept waiting for their conversation's next turn.
+
+    Methods:
+    --------
+    prepare(thread_id: str, summary: str, turns: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, str]], str]:
+        Folds a finished summary into the conversation, schedules the next one, and renders the prompt history.
+
+    stats() -> Dict[str, Any]:
+        Returns the number of pending and finished summaries.
+    """
+
+    def __init__(
+            self,
+            summarizer: Runnable,
+            model_name: str,
+            recent_token_budget: int,
+            summary_token_budget: int,
+            max_pending: int = 1024
+    ):
+        self.summarizer = summarizer
+        self.model_name = model_name
+        self.recent_token_budget = recent_token_budget
+        self.summary_token_budget = summary_token_budget
+        self.max_pending = max_pending
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def render_turn(turn: Dict[str, str]) -> str:
+        return f"User: {turn['question']}\nAssistant: {turn['answer']}"
+
+    def _summarize(self, summary: str, turns: List[Dict[str, str]]) -> str:
+        try:
+            with metrics.timer("conversation_memory.summarize"):
+                new_summary = self.summarizer.invoke({
+                    "summary": summary or "None",
+                    "conversation": "\n".join(self.render_turn(turn) for turn in turns),
+                    "max_tokens": self.summary_token_budget
+                })
+
+            metrics.increment("conversation_memory.summaries")
+            return truncate_tokens(new_summary.strip(), self.summary_token_budget, self.model_name)
+
+        except Exception as err:
+            print(f"---WARNING: CONVERSATION SUMMARY FAILED -> {err}---")
+            metrics.increment("conversation_memory.summary_failures")
+            return summary
+
+    def _fold_finished_summary(
+            self,
+            thread_id: str,
+            summary: str,
+            turns: List[Dict[str, str]]
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        job = self._jobs.get(thread_id)
+        if job is None or not job["future"].done():
+            return summary, turns
+
+        del self._jobs[thread_id]
+        # A summary started from another state of the conversation, for instance a concurrent request, is discarded
+        if job["summary"] != summary or len(turns) < job["folded"]:
+            return summary, turns
+
+        return job["future"].result(), turns[job["folded"]:]
+
+    def prepare(
+            self,
+            thread_id: str,
+            summary: str,
+            turns: List[Dict[str, str]]
+    ) -> Tuple[str, List[Dict[str, str]], str]:
+        with self._lock:
+            summary, turns = self._fold_finished_summary(thread_id, summary, turns)
+
+            recent_turns, used_tokens = [], 0
+            for turn in reversed(turns):
+                turn_tokens = count_tokens(self.render_turn(turn), self.model_name)
+                if used_tokens + turn_tokens > self.recent_token_budget:
+                    break
+                recent_turns.insert(0, turn)
+                used_tokens += turn_tokens
+
+            older_turns = turns[:len(turns) - len(recent_turns)]
+            if older_turns and thread_id not in self._jobs:
+                self._jobs[thread_id] = {
+                    "summary": summary,
+                    "folded": len(older_turns),
+                    "future": summary_executor.submit(self._summarize, summary, older_turns)
+                }
+                while len(self._jobs) > self.max_pending:
+                    self._jobs.popitem(last=False)
+
+        sections = []
+        if summary:
+            sections.append(f"Summary of the earlier conversation:\n{summary}")
+        if recent_turns:
+            sections.append("Recent conversation:\n" + "\n".join(self.render_turn(turn) for turn in recent_turns))
+
+        return summary, turns, "\n\n".join(sections)
+
+    def stats(self) -> Dict[str, Any]:
+        counters = metrics.snapshot()["counters"]
+        with self._lock:
+            pending = sum(not job["future"].done() for job in self._jobs.values())
+
+        return {
+            "pending_summaries": pending,
+            "summaries": counters.get("conversation_memory.summaries", 0),
+            "summary_failures": counters.get("conversation_memory.summary_failures", 0),
+            "summarize_mean_ms": metrics.mean("conversation_memory.summarize")
+        }
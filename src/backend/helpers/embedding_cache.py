@@ -0,0 +1,172 @@
+from langchain_core.embeddings import Embeddings
+from helpers.metrics import metrics
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Tuple
+import threading
+import re
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a bounded LRU cache of query embeddings.
+
+    Description:
+    ------------
+    A chat message is embedded by the RAG retriever and again by the timestamp search, and users often repeat the same
+    question. Query embeddings are therefore cached under the model name and the normalized text, lower-cased with
+    collapsed whitespace, so every retrieval path of every request shares them. The normalized text is only the cache
+    key, the wrapped model always embeds the text as it was asked. Document embeddings are never cached,
+    since ingested segments are embedded only once. Hits, misses and the latency of real embedding requests are recorded
+    in `metrics`, from which `stats` derives the hit rate and the time saved.
+
+    Attributes:
+    -----------
+    embeddings : Embeddings
+        The wrapped embedding model.
+    model : str
+        The name of the wrapped model, used in cache keys and to look up its dimensions.
+    max_entries : int
+        The maximum number of cached query embeddings.
+    dimensions : Optional[int]
+        The shortened output size requested from the wrapped model, None for its native size.
+
+    Methods:
+    --------
+    embed_query(text: str) -> List[float]:
+        Returns the cached embedding of the text, embedding it on a miss.
+
+    embed_queries(texts: List[str]) -> List[List[float]]:
+        Returns the cached embeddings of the texts, embedding all misses in one request.
+
+    embed_documents(texts: List[str]) -> List[List[float]]:
+        Embeds documents with the wrapped model.
+
+    aembed_query(text: str) -> List[float]:
+        Returns the cached embedding of the text, embedding it with the wrapped model's async client on a miss.
+
+    aembed_queries(texts: List[str]) -> List[List[float]]:
+        Returns the cached embeddings of the texts, embedding all misses in one request with the async client.
+
+    aembed_documents(texts: List[str]) -> List[List[float]]:
+        Embeds documents with the wrapped model's async client.
+
+    stats() -> Dict[str, Any]:
+        Returns the size, hit rate and saved latency of the cache.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, max_entries: int, dimensions: Optional[int] = None):
+        self.embeddings = embeddings
+        self.model = model
+        self.max_entries = max_entries
+        self.dimensions = dimensions
+        self._entries: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", text).strip().lower()
+
+    def _cache_key(self, text: str) -> Tuple[str, str]:
+        return f"{self.model}:{self.dimensions}", self.normalize(text)
+
+    def _get(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+
+        metrics.increment("query_embedding_cache.hits" if embedding is not None else "query_embedding_cache.misses")
+        return embedding
+
+    def _put(self, key: Tuple[str, str], embedding: List[float]) -> None:
+        with self._lock:
+            self._entries[key] = embedding
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._cache_key(text)
+        embedding = self._get(key)
+        if embedding is None:
+            with metrics.timer("query_embedding.request"):
+                embedding = self.embeddings.embed_query(text)
+            self._put(key, embedding)
+
+        return embedding
+
+    def _cached_queries(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], Dict[Tuple[str, str], str]]:
+        embeddings = [self._get(self._cache_key(text)) for text in texts]
+        # Repeated misses are requested once, as the first of their texts, the wrapped models embed queries and
+        # documents alike
+        missing_texts: Dict[Tuple[str, str], str] = {}
+        for text, embedding in zip(texts, embeddings):
+            if embedding is None:
+                missing_texts.setdefault(self._cache_key(text), text)
+        return embeddings, missing_texts
+
+    def _fill_queries(
+            self,
+            texts: List[str],
+            embeddings: List[Optional[List[float]]],
+            missing_texts: Dict[Tuple[str, str], str],
+            missing_embeddings: List[List[float]]
+    ) -> List[List[float]]:
+        fetched = dict(zip(missing_texts, missing_embeddings))
+        for key, embedding in fetched.items():
+            self._put(key, embedding)
+
+        return [embedding if embedding is not None else fetched[self._cache_key(text)]
+                for text, embedding in zip(texts, embeddings)]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        embeddings, missing_texts = self._cached_queries(texts)
+        missing_embeddings = []
+        if missing_texts:
+            with metrics.timer("query_embedding.batch_request"):
+                missing_embeddings = self.embeddings.embed_documents(list(missing_texts.values()))
+
+        return self._fill_queries(texts, embeddings, missing_texts, missing_embeddings)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with metrics.timer("document_embedding.request"):
+            return self.embeddings.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._cache_key(text)
+        embedding = self._get(key)
+        if embedding is None:
+            with metrics.timer("query_embedding.request"):
+                embedding = await self.embeddings.aembed_query(text)
+            self._put(key, embedding)
+
+        return embedding
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        embeddings, missing_texts = self._cached_queries(texts)
+        missing_embeddings = []
+        if missing_texts:
+            with metrics.timer("query_embedding.batch_request"):
+                missing_embeddings = await self.embeddings.aembed_documents(list(missing_texts.values()))
+
+        return self._fill_queries(texts, embeddings, missing_texts, missing_embeddings)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        with metrics.timer("document_embedding.request"):
+            return await self.embeddings.aembed_documents(texts)
+
+    def stats(self) -> Dict[str, Any]:
+        counters = metrics.snapshot()["counters"]
+        hits = counters.get("query_embedding_cache.hits", 0)
+        misses = counters.get("query_embedding_cache.misses", 0)
+
+        with self._lock:
+            entries = len(self._entries)
+
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "saved_ms": hits * metrics.mean("query_embedding.request")
+        }
@@ -0,0 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar, Any
+import functools
+import asyncio
+
+T = TypeVar("T")
+
+# The Selenium driver is a single browser shared by all requests, so its page loads and waits run one at a time
+selenium_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="selenium")
+# Audio downloads and Whisper transcriptions hold a CPU-bound model, one at a time keeps them from starving chat requests
+transcription_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transcription")
+# Conversation summaries are generated after the answer, in the background
+summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+
+
+async def run_blocking(
+        executor: ThreadPoolExecutor,
+        function: Callable[..., T],
+        *args: Any,
+        **kwargs: Any
+) -> T:
+    """
+    Runs blocking work on an executor and waits for it without blocking the event loop.
+
+    Args:
+    ------------
+    executor (ThreadPoolExecutor): The executor dedicated to this kind of work.
+    function (Callable[..., T]): The blocking function.
+    *args (Any): The positional arguments of the function.
+    **kwargs (Any): The keyword arguments of the function.
+
+    Returns:
+    ------------
+    T: The result of the function.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
@@ -10,12 +10,25 @@ from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.common.exceptions import TimeoutException
-from helpers.constants import (service, options, driver, text_embedding_v3_small)
+from helpers.constants import (
+    service,
+    options,
+    driver,
+    embedding_model,
+    VECTORSTORE_PATH,
+    METADATA_PATH,
+    TIMESTAMP_WINDOW_SECONDS,
+    TIMESTAMP_CANDIDATES,
+    RAG_BATCH_MAX_QUESTIONS,
+    TRANSCRIPT_CHUNK_CHARACTERS,
+    TRANSCRIPT_CHUNK_OVERLAP_CHARACTERS
+)
+from helpers.vectorstore import load_vectorstore, load_video_timeline, add_documents_to_corpus, quoted_phrase
+from helpers.segment_store import parse_timestamp
 from typing import Optional, Dict, Tuple, Union, Any, List, AnyStr
-from pydantic import BaseModel, Field
-from langchain_community.docstore.in_memory import InMemoryDocstore
+from pydantic import BaseModel, Field, conlist, constr
 from sklearn.metrics.pairwise import cosine_similarity
-from faiss import IndexFlatL2
+from urllib.parse import urlparse, parse_qs
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import time
@@ -71,12 +84,14 @@ class RagToolModel(BaseModel):
     Attributes:
     ------------
     chat_message (str): The user's chat message. It must be between 5 and 250 characters long.
+    video_id (Optional[str]): The YouTube video ID the answer is restricted to. If not provided, the whole corpus is searched.
 
     Example:
     ------------
     An example of the request payload:
     {
-        "chat_message": "Would you tell me which version of the software was supposed to be installed?"
+        "chat_message": "Would you tell me which version of the software was supposed to be installed?",
+        "video_id": "bG4VYwFnU8k"
     }
     """
     chat_message: str = Field(
@@ -84,11 +99,16 @@ class RagToolModel(BaseModel):
         min_length=5,
         max_length=250,
     )
+    video_id: Optional[str] = Field(
+        default=None,
+        description="YouTube video ID the answer is restricted to",
+    )
 
     class Config:
         schema_extra = {
             "example": {
                 "chat_message": "Would you tell me which version of the software was supposed to be installed?",
+                "video_id": "bG4VYwFnU8k",
             }
         }
 
@@ -181,6 +201,46 @@ class ScrapeTranscriptions(BaseModel):
     )
 
 
+class BatchQuestionsModel(BaseModel):
+    """
+    Model for asking many questions about one video at once.
+
+    Description:
+    ------------
+    This model represents the request payload of the batch question answering endpoint. It includes the URL of an
+    ingested video and the list of questions to answer about it.
+
+    Attributes:
+    ------------
+    video_url (str): The URL of the ingested video the answers are restricted to.
+    questions (List[str]): The questions, each between 5 and 250 characters long, at most `RAG_BATCH_MAX_QUESTIONS`.
+
+    Example:
+    ------------
+    An example of the request payload:
+    {
+        "video_url": "https://www.youtube.com/watch?v=bG4VYwFnU8k",
+        "questions": ["Which version of the software is installed?", "Which operating system is used?"]
+    }
+    """
+    video_url: str = Field(
+        description="URL of the ingested YT video the answers are restricted to",
+        min_length=10,
+        max_length=100,
+    )
+    questions: conlist(constr(min_length=5, max_length=250), min_items=1, max_items=RAG_BATCH_MAX_QUESTIONS) = Field(
+        description="Questions about the video, answered in the same order",
+    )
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "video_url": "https://www.youtube.com/watch?v=bG4VYwFnU8k",
+                "questions": ["Which version of the software is installed?", "Which operating system is used?"],
+            }
+        }
+
+
 class FetchTranscriptionModel(BaseModel):
     """
     Model for fetching the transcription of a video from its URL.
@@ -514,121 +574,259 @@ def chunk_up_text(
     return chunked_text
 
 
-def create_empty_vectorstore(
-        embedding_model: Optional[Union[OpenAIEmbeddings, Any]] = text_embedding_v3_small
-) -> FAISS:
+def extract_video_id(
+        video_url: str
+) -> str:
     """
-    Creates an empty FAISS vectorstore instance with the specified embedding model.
+    Extracts the YouTube video ID from a video URL.
 
     Description:
     ------------
-    This function initializes an empty FAISS vectorstore with the given embedding model. The vectorstore is created with
-    an index that uses the L2 distance metric and an in-memory document store. The dimensions of the index are based on
-    the embedding model's query embedding size.
+    The video ID identifies a video's vectors in the shared corpus. It is read from the `v` query parameter of watch
+    URLs, or from the path of short (youtu.be), shorts and embed URLs. Timestamps and other parameters are ignored.
 
     Args:
     ------------
-    embedding_model (Optional[Union[OpenAIEmbeddings, Any]]): An optional embedding model used to determine the dimensions
-                                                               of the vectorstore. If not provided, `text_embedding_v3_small`
-                                                               is used by default.
+    video_url (str): The URL of the YouTube video.
 
     Returns:
     ------------
-    FAISS: An empty FAISS vectorstore instance with the specified embedding model, ready to have documents added.
+    str: The video ID, for instance "bG4VYwFnU8k".
+
+    Raises:
+    ------------
+    ValueError: If the URL does not contain a video ID.
     """
-    dimensions: int = len(embedding_model.embed_query("dummy"))
-    empty_faiss_vs = FAISS(
-        embedding_function=text_embedding_v3_small,
-        index=IndexFlatL2(dimensions),
-        docstore=InMemoryDocstore(),
-        index_to_docstore_id={},
-        normalize_L2=False
-    )
+    parsed_url = urlparse(video_url)
+    query_video_id = parse_qs(parsed_url.query).get("v")
+    if query_video_id:
+        return query_video_id[0]
+
+    path_parts = [part for part in parsed_url.path.split("/") if part]
+    if "youtu.be" in parsed_url.netloc and path_parts:
+        return path_parts[0]
 
-    return empty_faiss_vs
+    if len(path_parts) >= 2 and path_parts[0] in ("shorts", "embed", "live", "v"):
+        return path_parts[1]
+
+    raise ValueError(f"Could not find a YouTube video ID in {video_url}")
+
+
+def chunk_up_transcription(
+        full_transcription: Dict[Any, str],
+        chunk_size: int = TRANSCRIPT_CHUNK_CHARACTERS,
+        chunk_overlap: int = TRANSCRIPT_CHUNK_OVERLAP_CHARACTERS
+) -> List[Document]:
+    """
+    Splits a timed transcription into overlapping chunks of whole caption lines.
+
+    Description:
+    ------------
+    Consecutive caption lines are joined until a chunk holds `chunk_size` characters. Each next chunk starts with the
+    last lines of the previous one, at least `chunk_overlap` characters of them, so a passage cut at a chunk boundary
+    is still found whole in one of the two chunks. Every chunk carries the "start" of its first line and the "end" of
+    its last line in seconds, which lets the context packer merge the overlapping chunks of a passage back together.
+
+    Args:
+    ------------
+    full_transcription (Dict[Any, str]): The caption lines of the video keyed by their timestamp, in timeline order.
+    chunk_size (int): The number of characters after which a chunk is closed.
+    chunk_overlap (int): The minimum number of characters a chunk repeats from the end of the previous one.
+
+    Returns:
+    ------------
+    List[Document]: The chunks in timeline order, with "start" and "end" metadata.
+    """
+    lines = [
+        (parse_timestamp(timestamp), text.strip())
+        for timestamp, text in full_transcription.items()
+        if text and text.strip()
+    ]
+    ends = [start for start, _ in lines[1:]] + [None]
+
+    chunks = []
+    first = 0
+    while first < len(lines):
+        last = first
+        size = len(lines[first][1])
+        while last + 1 < len(lines) and size < chunk_size:
+            last += 1
+            size += len(lines[last][1]) + 2
+
+        chunks.append(Document(
+            page_content=". ".join(text for _, text in lines[first:last + 1]),
+            metadata={"start": lines[first][0], "end": ends[last]}
+        ))
+        if last + 1 == len(lines):
+            break
+
+        # Step back over the trailing lines to repeat, keeping at least one new line per chunk
+        next_first = last + 1
+        overlap = 0
+        while next_first - 1 > first + 1 and overlap < chunk_overlap:
+            next_first -= 1
+            overlap += len(lines[next_first][1]) + 2
+        first = next_first
+
+    return chunks
 
 
 def create_vectorstore_index(
         documents: Union[str, List[str], Any],
-        vectorstore: FAISS,
-) -> FAISS:
+        video_id: str,
+        full_transcription: Optional[Dict[Any, str]] = None
+) -> List[int]:
     """
-    Creates or updates a vectorstore index with the provided documents.
+    Adds the transcription of a video to the shared transcription corpus.
 
     Description:
     ------------
-    This function takes a list of documents or a single document string and adds them to the provided FAISS vectorstore index.
-    The documents are converted into embeddings and added to the vectorstore. The updated vectorstore is then returned.
+    This function splits the transcription of a video into overlapping chunks and adds them to the corpus at
+    `VECTORSTORE_PATH` under the given video ID. With the timed caption lines of the video, the chunks are made of
+    whole lines and carry their start and end times. Otherwise each document string is split on its own. The chunks are
+    converted into embeddings, added to the corpus index, and the corpus is saved. They replace the segments the video
+    already has, so indexing a video twice never duplicates its segments.
 
     Args:
     ------------
     documents (Union[str, List[str]]): A single document string or a list of document strings to be indexed.
-    vectorstore (FAISS): An instance of the FAISS vectorstore to which the documents will be added.
+    video_id (str): The YouTube video ID the documents belong to.
+    full_transcription (Optional[Dict[Any, str]]): The caption lines of the video keyed by their timestamp. If provided,
+                                                   they are indexed instead of the document strings.
 
     Returns:
     ------------
-    FAISS: The updated FAISS vectorstore instance with the newly added documents.
+    List[int]: The vector ids of the newly added chunks.
     """
+    if full_transcription:
+        document_list = chunk_up_transcription(full_transcription)
 
-    document_list = Document(page_content=documents)
-    _ = vectorstore.add_documents([document_list])  # returns a list of embedding ids
+    else:
+        if isinstance(documents, str):
+            documents = [documents]
 
-    return vectorstore
+        text_splitter = RecursiveCharacterTextSplitter(
+            separators=[". ", " ", ""],
+            chunk_size=TRANSCRIPT_CHUNK_CHARACTERS,
+            chunk_overlap=TRANSCRIPT_CHUNK_OVERLAP_CHARACTERS
+        )
+        document_list = [
+            Document(page_content=chunk)
+            for document in documents
+            for chunk in text_splitter.split_text(document)
+        ]
+
+    return add_documents_to_corpus(VECTORSTORE_PATH, document_list, video_id, replace=True)
 
 
 def create_metadata(
         full_transcription: Dict[any, str],
-        vectorstore: FAISS
+        video_id: str
 ) -> None:
+    starts = [parse_timestamp(timestamp) for timestamp in full_transcription.keys()]
+    ends = starts[1:] + [None]
+
     metadata_content = []
-    for timestamp, transcript in full_transcription.items():
-        metadata_content.append(Document(page_content=transcript, metadata={"timestamp": timestamp}))
+    for transcript, start, end in zip(full_transcription.values(), starts, ends):
+        metadata_content.append(Document(page_content=transcript, metadata={"start": start, "end": end}))
+
+    _ = add_documents_to_corpus(METADATA_PATH, metadata_content, video_id, replace=True)
 
-    _ = vectorstore.add_documents(metadata_content)
-    vectorstore.save_local("faiss_metadata")
+
+def search_moments(
+        chat_message: str,
+        video_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Searches for the moments of a video that best match a chat message.
+
+    Description:
+    ------------
+    If the chat message quotes a phrase that occurs in the captions, the caption lines containing it are returned
+    without an embedding request. Otherwise the chat message is embedded once and scored against every caption line of
+    the video with a single matrix product over the video's cached timeline, the scores are averaged over a sliding
+    window of `TIMESTAMP_WINDOW_SECONDS`, and the best windows at least that far apart are returned. Without a video ID,
+    the caption lines of the whole corpus are ranked by hybrid search instead.
+
+    Args:
+    ------------
+    chat_message (str): The chat message describing the moment.
+    video_id (Optional[str]): The YouTube video ID the search is restricted to. If not provided, the whole corpus is
+                              searched.
+
+    Returns:
+    ------------
+    List[Dict[str, Any]]: Up to `TIMESTAMP_CANDIDATES` moments, best first, each with the "start" and "end" time in seconds,
+                          a "score" and the "text" of the caption line the moment starts with. Empty if no caption line
+                          of the video is ingested.
+    """
+    retriever = load_vectorstore(METADATA_PATH)
+    phrase = quoted_phrase(chat_message)
+
+    if phrase is not None:
+        phrase_hits = retriever.docstore.lexical_search(phrase, TIMESTAMP_CANDIDATES, video_id=video_id, phrase=True)
+        moments = [{"id": vector_id, "score": -score} for vector_id, score in phrase_hits]
+
+    if phrase is None or not moments:
+        if video_id is None:
+            documents = retriever.hybrid_search(chat_message, k=TIMESTAMP_CANDIDATES)
+            return [
+                {"start": document.metadata["start"], "end": document.metadata["end"], "score": None,
+                 "text": document.page_content}
+                for document in documents
+            ]
+
+        timeline = load_video_timeline(METADATA_PATH, video_id)
+        moments = timeline.score(
+            embedding_model.embed_query(chat_message),
+            window_seconds=TIMESTAMP_WINDOW_SECONDS,
+            candidate_count=TIMESTAMP_CANDIDATES
+        )
+
+    results = []
+    for moment in moments:
+        document = retriever.docstore.search(str(moment["id"]))
+        results.append({
+            "start": document.metadata["start"],
+            "end": document.metadata["end"],
+            "score": moment["score"],
+            "text": document.page_content
+        })
+
+    return results
 
 
 def search_timestamp(
         full_transcription: Dict[any, str],
-        chat_message: str
-) -> int:
+        chat_message: str,
+        video_id: Optional[str] = None
+) -> Optional[int]:
     """
-    Searches for the timestamp in a transcription that is most similar to a given chat message based on cosine similarity.
+    Searches for the timestamp in a transcription that best matches a given chat message.
 
     Description:
     ------------
-    This function calculates the similarity between the chat message and each transcript segment in the full transcription
-    dictionary. It then identifies the timestamp of the segment that has the highest similarity score.
+    This function returns the start of the best moment found by `search_moments`, which scores every caption line of the
+    video at once and favors stretches of several relevant lines over a single matching line.
 
     Args:
     ------------
     full_transcription (Dict[any, str]): A dictionary where the keys are timestamps in "minutes:seconds" format and the values
                                          are the transcript segments associated with those timestamps.
     chat_message (str): The chat message whose similarity with the transcript segments is to be evaluated.
+    video_id (Optional[str]): The YouTube video ID the search is restricted to. If not provided, the whole corpus is
+                              searched.
 
     Returns:
     ------------
-    int: The timestamp (in seconds) of the transcript segment with the highest similarity score, rounded to the nearest second.
+    Optional[int]: The timestamp (in seconds) of the best matching moment, rounded to the nearest second, or None if no
+                   moment was found.
     """
-    retriever = FAISS.load_local(
-        folder_path="./faiss_metadata",
-        embeddings=text_embedding_v3_small,
-        allow_dangerous_deserialization=True
-    )
-    relevant_document = retriever.similarity_search(chat_message, k=1)
-    found_timestamp = relevant_document[0].metadata["timestamp"]
-
-    if found_timestamp.count(":") == 1:
-        minutes, seconds = map(int, found_timestamp.split(":"))
-        total_seconds = minutes * 60 + seconds
-        return round(total_seconds)
-
-    elif found_timestamp.count(":") > 1:
-        hours, minutes, seconds = map(int, found_timestamp.split(":"))
-        total_seconds = hours * 3600 + minutes * 60 + seconds
-        return round(total_seconds)
-    else:
-        return found_timestamp
+    moments = search_moments(chat_message, video_id=video_id)
+    if not moments:
+        return None
+
+    return round(moments[0]["start"])
 
 
 def take_screenshot(
@@ -0,0 +1,274 @@
+from typing import Optional, Tuple
+import numpy as np
+import faiss
+import math
+
+# The factory component storing the vectors of each encoding
+VECTOR_ENCODINGS = {
+    "float32": "Flat",
+    "float16": "SQfp16",
+    "int8": "SQ8"
+}
+
+
+def choose_index_factory(
+        vector_count: int,
+        flat_max_vectors: int,
+        hnsw_max_vectors: int,
+        hnsw_m: int,
+        encoding: str = "float32"
+) -> str:
+    """
+    Chooses a FAISS index factory string for the given corpus size.
+
+    Description:
+    ------------
+    Small corpora are searched exactly with a flat index, since brute force over a few thousand caption lines is already
+    faster than any approximate structure. Medium corpora use an HNSW graph, which gives the best recall per millisecond
+    but keeps every vector plus its graph links in memory. Large corpora use an IVF index, whose inverted lists can be
+    memory-mapped and whose number of lists grows with the square root of the corpus size. Every index type stores its
+    vectors with the given encoding, float16 and int8 scalar quantization cut their memory to a half and a quarter.
+
+    Args:
+    ------------
+    vector_count (int): The number of vectors the index will hold.
+    flat_max_vectors (int): The largest corpus that is still searched with a flat index.
+    hnsw_max_vectors (int): The largest corpus that is searched with an HNSW index.
+    hnsw_m (int): The number of graph neighbors per vector of HNSW indexes.
+    encoding (str): The vector encoding, one of "float32", "float16" or "int8".
+
+    Returns:
+    ------------
+    str: A factory string accepted by `faiss.index_factory`, such as "Flat", "HNSW32,SQfp16" or "IVF4096,SQ8".
+
+    Raises:
+    ------------
+    ValueError: If the encoding is unknown.
+    """
+    if encoding not in VECTOR_ENCODINGS:
+        raise ValueError(f"Unknown vector encoding '{encoding}', choose one of {sorted(VECTOR_ENCODINGS)}")
+    storage = VECTOR_ENCODINGS[encoding]
+
+    if vector_count <= flat_max_vectors:
+        return storage
+
+    if vector_count <= hnsw_max_vectors:
+        return f"HNSW{hnsw_m}" if storage == "Flat" else f"HNSW{hnsw_m},{storage}"
+
+    nlist = 2 ** round(math.log2(4 * math.sqrt(vector_count)))
+    return f"IVF{nlist},{storage}"
+
+
+def build_index(
+        vectors: np.ndarray,
+        factory: str,
+        hnsw_ef_construction: int = 80,
+        max_training_vectors: int = 256,
+        ids: Optional[np.ndarray] = None
+) -> faiss.Index:
+    """
+    Builds and fills a FAISS index from the given vectors.
+
+    Description:
+    ------------
+    IVF indexes are trained on a random sample of at most `max_training_vectors` vectors per inverted list before the
+    vectors are added, and int8 indexes learn their per-dimension value ranges from the same sample. All indexes use the L2 metric, like the flat indexes they replace. When ids are given, the index
+    is wrapped in an `IndexIDMap2`, so searches return the given ids instead of insertion positions.
+
+    Args:
+    ------------
+    vectors (np.ndarray): A float32 array of shape (count, dimensions).
+    factory (str): The factory string, usually chosen by `choose_index_factory`.
+    hnsw_ef_construction (int): The candidate list size used while building HNSW graphs.
+    max_training_vectors (int): The training sample size per inverted list of IVF indexes.
+    ids (Optional[np.ndarray]): Optional int64 ids of the vectors.
+
+    Returns:
+    ------------
+    faiss.Index: The filled index.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(
+        vectors.shape[1],
+        factory if ids is None else f"IDMap2,{factory}",
+        faiss.METRIC_L2
+    )
+
+    hnsw_index = _find_hnsw(index)
+    if hnsw_index is not None:
+        hnsw_index.hnsw.efConstruction = hnsw_ef_construction
+
+    if not index.is_trained:
+        ivf_index = faiss.try_extract_index_ivf(index)
+        sample_size = len(vectors)
+        if ivf_index is not None:
+            sample_size = min(sample_size, ivf_index.nlist * max_training_vectors)
+
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), size=sample_size, replace=False)]
+        index.train(sample)
+
+    if ids is None:
+        index.add(vectors)
+    else:
+        index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype=np.int64))
+
+    return index
+
+
+def set_search_parameters(
+        index: faiss.Index,
+        hnsw_ef_search: int,
+        ivf_nprobe: int
+) -> None:
+    """
+    Applies the search-time parameters matching the index type.
+
+    Args:
+    ------------
+    index (faiss.Index): The index to tune, possibly wrapped.
+    hnsw_ef_search (int): The candidate list size of HNSW searches. Higher values trade latency for recall.
+    ivf_nprobe (int): The number of inverted lists visited by IVF searches. Higher values trade latency for recall.
+
+    Returns:
+    ------------
+    None
+    """
+    hnsw_index = _find_hnsw(index)
+    if hnsw_index is not None:
+        hnsw_index.hnsw.efSearch = hnsw_ef_search
+
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        ivf_index.nprobe = ivf_nprobe
+
+
+def search_parameters(
+        index: faiss.Index,
+        selector: faiss.IDSelector,
+        hnsw_ef_search: int,
+        ivf_nprobe: int
+) -> faiss.SearchParameters:
+    """
+    Creates search parameters that restrict a search to the ids accepted by the selector.
+
+    Description:
+    ------------
+    FAISS only accepts the parameter class matching the index type, so HNSW and IVF indexes get their own parameter
+    classes, carrying the configured efSearch or nprobe along with the selector.
+
+    Args:
+    ------------
+    index (faiss.Index): The index that will be searched, possibly wrapped in an `IndexIDMap2`.
+    selector (faiss.IDSelector): The selector of the ids that may be returned.
+    hnsw_ef_search (int): The candidate list size of HNSW searches.
+    ivf_nprobe (int): The number of inverted lists visited by IVF searches.
+
+    Returns:
+    ------------
+    faiss.SearchParameters: The parameters to pass to `index.search`.
+    """
+    if _find_hnsw(index) is not None:
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=hnsw_ef_search)
+
+    if faiss.try_extract_index_ivf(index) is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf_nprobe)
+
+    return faiss.SearchParameters(sel=selector)
+
+
+def extract_vectors(
+        index: faiss.Index
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Reconstructs all vectors stored in an index, in insertion order.
+
+    Args:
+    ------------
+    index (faiss.Index): The index to read the vectors from, possibly wrapped in an `IndexIDMap2`.
+
+    Returns:
+    ------------
+    Tuple[np.ndarray, Optional[np.ndarray]]: A float32 array of shape (index.ntotal, index.d), and the ids of the vectors
+                                             if the index is an `IndexIDMap2`, otherwise None.
+    """
+    # The wrapper owns the wrapped index, so it is kept referenced while the wrapped index is read
+    outer_index = faiss.downcast_index(index)
+    inner_index = outer_index
+    ids = None
+    if isinstance(outer_index, faiss.IndexIDMap2):
+        ids = faiss.vector_to_array(outer_index.id_map)
+        inner_index = faiss.downcast_index(outer_index.index)
+
+    ivf_index = faiss.try_extract_index_ivf(inner_index)
+    if ivf_index is not None:
+        ivf_index.make_direct_map()
+
+    return inner_index.reconstruct_n(0, inner_index.ntotal), ids
+
+
+def reconstruct_vectors(
+        index: faiss.Index,
+        ids: np.ndarray
+) -> np.ndarray:
+    """
+    Reconstructs the vectors stored under the given ids.
+
+    Args:
+    ------------
+    index (faiss.Index): The index to read the vectors from, usually an `IndexIDMap2`. For other indexes the ids are
+                         insertion positions.
+    ids (np.ndarray): The ids of the vectors.
+
+    Returns:
+    ------------
+    np.ndarray: A float32 array of shape (len(ids), index.d), in the order of the ids.
+    """
+    # The wrapper owns the wrapped index, so it is kept referenced while the wrapped index is prepared
+    outer_index = faiss.downcast_index(index)
+    inner_index = faiss.downcast_index(outer_index.index) if isinstance(outer_index, faiss.IndexIDMap2) else outer_index
+
+    ivf_index = faiss.try_extract_index_ivf(inner_index)
+    if ivf_index is not None and ivf_index.direct_map.type == faiss.DirectMap.NoMap:
+        ivf_index.make_direct_map()
+
+    if len(ids) == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+
+    return outer_index.reconstruct_batch(np.ascontiguousarray(ids, dtype=np.int64))
+
+
+def bytes_per_vector(
+        index: faiss.Index
+) -> int:
+    """
+    Returns the approximate memory taken by one vector of an index, including ids and graph links.
+    """
+    outer_index = faiss.downcast_index(index)
+    inner_index = outer_index
+    overhead = 0
+    if isinstance(outer_index, faiss.IndexIDMap2):
+        inner_index = faiss.downcast_index(outer_index.index)
+        overhead += 16  # the id and its reverse map entry
+
+    hnsw_index = _find_hnsw(inner_index)
+    if hnsw_index is not None:
+        overhead += hnsw_index.hnsw.nb_neighbors(0) * 4  # the 2 * M links of level 0 dominate the graph
+        inner_index = faiss.downcast_index(hnsw_index.storage)
+
+    ivf_index = faiss.try_extract_index_ivf(inner_index)
+    if ivf_index is not None:
+        return ivf_index.code_size + 8 + overhead  # inverted lists store an id next to each code
+
+    code_size = getattr(inner_index, "code_size", inner_index.d * 4)
+    return code_size + overhead
+
+
+def _find_hnsw(
+        index: faiss.Index
+):
+    index = faiss.downcast_index(index)
+    while not hasattr(index, "hnsw"):
+        if not hasattr(index, "index"):
+            return None
+        index = faiss.downcast_index(index.index)
+    return index
@@ -0,0 +1,184 @@
+from langchain_core.embeddings import Embeddings
+from helpers.metrics import metrics
+from typing import Optional, Dict, Any, Tuple
+import numpy as np
+import threading
+import asyncio
+import math
+import re
+
+# Phrases hinting at each request category, with their weights. Asking for something visual is a strong hint of an
+# image request, while question words only weakly hint at an information request, since both kinds are phrased as
+# questions
+INTENT_CUES = {
+    "image": [
+        (r"\bscreen ?shots?\b|\bsnap ?shots?\b|\bscreen ?caps?\b", 3.0),
+        (r"\b(picture|image|photo|frame|thumbnail)s?\b", 2.5),
+        (r"\bshow me\b|\blet me see\b|\bcapture\b|\b(moment|part|scene) (where|when)\b", 2.0),
+        (r"\blooks? like\b|\bappearance\b|\bvisual(ly)?\b|\bshown\b|\b(slide|diagram|chart|whiteboard)s?\b", 1.5),
+        (r"\b(show|display|see)\b", 1.0)
+    ],
+    "information": [
+        (r"\b(summari[sz]e|summary|explain|explanation|describe|define|definition)\b", 2.0),
+        (r"\b(why|how come|meaning|mean|difference|compare|reason|recommend|opinion)\b", 1.5),
+        (r"\b(what|who|which|how|tell me|list)\b", 1.0)
+    ]
+}
+
+# Example requests of each category, their embedding centroids decide messages without clear cues
+INTENT_PROTOTYPES = {
+    "image": [
+        "Take a screenshot of the moment where the chef adds the butter",
+        "Show me the part of the video with the finished cake",
+        "Can I see the slide with the architecture diagram?",
+        "What does the car look like after the repair?",
+        "Give me a picture of the whiteboard when he draws the graph",
+        "Capture the scene where they arrive at the beach"
+    ],
+    "information": [
+        "What is the main point of this video?",
+        "Could you tell me more about the recipe?",
+        "Summarize what the speaker says about inflation",
+        "Why does he recommend this approach?",
+        "Which tools are mentioned in the tutorial?",
+        "How long should the dough rest according to the video?"
+    ]
+}
+
+
+class IntentClassifier:
+    """
+    A local classifier of chat messages into "information" and "image" requests.
+
+    Description:
+    ------------
+    Messages are first scored against weighted keyword cues, which decides most messages in microseconds. Messages whose
+    cues are missing or contradicting are compared to the embedding centroids of a few example requests per category.
+    The query embedding comes from the shared query embedding cache, so the retrieval that follows reuses it. Only when
+    neither step is confident enough is the message escalated to the LLM classifier. Every decision is counted in
+    `metrics` under the step that made it, from which `stats` derives the escalation rate.
+
+    Attributes:
+    -----------
+    embeddings : Optional[Embeddings]
+        The embedding model of the prototype step, None to skip that step.
+    confidence_threshold : float
+        The confidence between 0.5 and 1 a local decision needs before it is trusted.
+    prototype_temperature : float
+        The scale turning the similarity margin between the two centroids into a confidence.
+
+    Methods:
+    --------
+    keyword_confidence(message: str) -> Tuple[str, float]:
+        Returns the category favored by the keyword cues and its confidence.
+
+    prototype_confidence(message: str) -> Tuple[str, float]:
+        Returns the category of the closest embedding centroid and its confidence.
+
+    classify(message: str) -> Optional[str]:
+        Returns the category of the message, or None if it has to be escalated.
+
+    aclassify(message: str) -> Optional[str]:
+        Classifies like `classify`, requesting the embedding of the prototype step asynchronously.
+
+    stats() -> Dict[str, Any]:
+        Returns the number of decisions per step and the escalation rate.
+    """
+
+    def __init__(
+            self,
+            embeddings: Optional[Embeddings],
+            confidence_threshold: float,
+            prototype_temperature: float = 20.0
+    ):
+        self.embeddings = embeddings
+        self.confidence_threshold = confidence_threshold
+        self.prototype_temperature = prototype_temperature
+        self._cues = [
+            (re.compile(pattern), category, weight)
+            for category, cues in INTENT_CUES.items()
+            for pattern, weight in cues
+        ]
+        self._centroids: Optional[Dict[str, np.ndarray]] = None
+        self._lock = threading.Lock()
+
+    def keyword_confidence(self, message: str) -> Tuple[str, float]:
+        scores = {"image": 0.0, "information": 0.0}
+        text = message.lower()
+        for pattern, category, weight in self._cues:
+            if pattern.search(text):
+                scores[category] += weight
+
+        # Additive smoothing keeps a single weak cue from being trusted on its own
+        image_probability = (scores["image"] + 0.5) / (scores["image"] + scores["information"] + 1.0)
+        if image_probability > 0.5:
+            return "image", image_probability
+
+        return "information", 1.0 - image_probability
+
+    def _prototype_centroids(self) -> Dict[str, np.ndarray]:
+        with self._lock:
+            if self._centroids is None:
+                centroids = {}
+                for category, examples in INTENT_PROTOTYPES.items():
+                    vectors = np.asarray(self.embeddings.embed_documents(examples), dtype=np.float32)
+                    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                    centroid = vectors.mean(axis=0)
+                    centroids[category] = centroid / max(float(np.linalg.norm(centroid)), 1e-12)
+                self._centroids = centroids
+
+            return self._centroids
+
+    def prototype_confidence(self, message: str) -> Tuple[str, float]:
+        query = np.asarray(self.embeddings.embed_query(message), dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        centroids = self._prototype_centroids()
+        margin = float(query @ centroids["image"] - query @ centroids["information"])
+        image_probability = 1.0 / (1.0 + math.exp(-self.prototype_temperature * margin))
+        if image_probability > 0.5:
+            return "image", image_probability
+
+        return "information", 1.0 - image_probability
+
+    def _decide(self, step: str, category: str, confidence: float) -> Optional[str]:
+        if confidence < self.confidence_threshold:
+            return None
+
+        metrics.increment(f"intent_classifier.{step}")
+        return category
+
+    def classify(self, message: str) -> Optional[str]:
+        with metrics.timer("intent_classifier.local"):
+            category = self._decide("keyword", *self.keyword_confidence(message))
+            if category is None and self.embeddings is not None:
+                category = self._decide("prototype", *self.prototype_confidence(message))
+
+        if category is None:
+            metrics.increment("intent_classifier.escalated")
+        return category
+
+    async def aclassify(self, message: str) -> Optional[str]:
+        with metrics.timer("intent_classifier.local"):
+            category = self._decide("keyword", *self.keyword_confidence(message))
+            if category is None and self.embeddings is not None:
+                # Both embeddings are fetched off the event loop first, the query's lands in the query embedding cache
+                await self.embeddings.aembed_query(message)
+                await asyncio.to_thread(self._prototype_centroids)
+                category = self._decide("prototype", *self.prototype_confidence(message))
+
+        if category is None:
+            metrics.increment("intent_classifier.escalated")
+        return category
+
+    def stats(self) -> Dict[str, Any]:
+        counters = metrics.snapshot()["counters"]
+        decisions = {
+            step: counters.get(f"intent_classifier.{step}", 0)
+            for step in ("keyword", "prototype", "escalated")
+        }
+        total = sum(decisions.values())
+
+        return {
+            **decisions,
+            "escalation_rate": decisions["escalated"] / total if total else 0.0
+        }
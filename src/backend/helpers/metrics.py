@@ -0,0 +1,81 @@
+from typing import Dict, Any
+import threading
+import time
+
+
+class Metrics:
+    """
+    A thread-safe, process-level registry of counters and timings.
+
+    Description:
+    ------------
+    Counters hold running totals, such as cache hits, and timings hold the count, total and maximum of observed
+    durations in milliseconds. The registry is exposed as a whole by the `/metrics` endpoint.
+
+    Methods:
+    --------
+    increment(name: str, value: int = 1):
+        Adds a value to a counter.
+
+    observe(name: str, milliseconds: float):
+        Records a duration under a timing.
+
+    timer(name: str):
+        Returns a context manager recording the duration of its block under a timing.
+
+    mean(name: str) -> float:
+        Returns the mean duration of a timing in milliseconds, 0 if nothing was observed.
+
+    snapshot() -> Dict[str, Any]:
+        Returns all counters and timings.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, milliseconds: float) -> None:
+        with self._lock:
+            timing = self._timings.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            timing["count"] += 1
+            timing["total_ms"] += milliseconds
+            timing["max_ms"] = max(timing["max_ms"], milliseconds)
+
+    def timer(self, name: str) -> "_Timer":
+        return _Timer(self, name)
+
+    def mean(self, name: str) -> float:
+        with self._lock:
+            timing = self._timings.get(name)
+            return timing["total_ms"] / timing["count"] if timing else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "timings": {
+                    name: {**timing, "mean_ms": timing["total_ms"] / timing["count"]}
+                    for name, timing in self._timings.items()
+                }
+            }
+
+
+class _Timer:
+    def __init__(self, registry: Metrics, name: str):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.registry.observe(self.name, (time.perf_counter() - self.start) * 1000)
+
+
+metrics = Metrics()
@@ -0,0 +1,269 @@
+from langchain_core.messages import BaseMessage
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableLambda, RunnableConfig
+from helpers.tokenizer import count_tokens
+from helpers.metrics import metrics
+from collections import deque
+from datetime import datetime
+from typing import Optional, Union, List, Dict, Any, Tuple
+import numpy as np
+import threading
+import json
+import time
+import os
+
+# Typical answer sizes in tokens, used to estimate the cost of a call before it is made
+EXPECTED_OUTPUT_TOKENS = {"classification": 20, "summary": 300, "generation": 400}
+
+
+class ModelRouter:
+    """
+    Picks the chat model of every call from the kind of request, its size and the observed health of each model.
+
+    Description:
+    ------------
+    Every model has a profile with its price per million input and output tokens, its context window and a quality tier
+    of "high" or "standard". For each call, the router ranks the models whose context window holds the prompt:
+
+    1. Healthy models come first. A model is unhealthy for a task when its 95th percentile latency over the last
+       `window_seconds` exceeds the task's latency objective, or when its error rate exceeds `max_error_rate`. Judging
+       needs at least `min_calls` observations. Observations expire, so a degraded model gets traffic again once the
+       window has passed.
+    2. Generations with more than `long_context_tokens` prompt tokens, or with questions longer than
+       `long_question_characters`, prefer "high" quality models. Classifications and summaries take any model.
+    3. Among the remaining models, the cheapest estimated call wins, then the lowest median latency.
+
+    The call goes to the first model. If that call fails, it fails over to the next model in the ranking. A model that
+    fails while streaming leaves its partial tokens in the stream. Each decision is appended to a JSON Lines log with the
+    request features, the health of every candidate, the chosen model, the failovers, the latency and the cost. The log
+    rotates beyond `decision_log_max_bytes`.
+
+    Attributes:
+    -----------
+    profiles : Dict[str, Dict[str, Any]]
+        The "model", "input_cost", "output_cost", "context_window" and "quality" of each model by name.
+    latency_slo_ms : Dict[str, float]
+        The 95th percentile latency objective per task, "classification", "summary" or "generation".
+    max_error_rate : float
+        The share of failed calls beyond which a model is unhealthy.
+    window_seconds : float
+        The time observations are kept for.
+    min_calls : int
+        The number of observations needed before a model can be judged unhealthy.
+    long_context_tokens : int
+        The prompt size beyond which generations prefer high quality models.
+    long_question_characters : int
+        The question length beyond which generations prefer high quality models.
+    decision_log_path : Optional[str]
+        The path of the decision log, None to disable it.
+    decision_log_max_bytes : int
+        The size at which the decision log is rotated.
+    tokenizer_model : str
+        The name of the model whose tokenizer measures prompts.
+
+    Methods:
+    --------
+    health(name: str, task: str) -> Dict[str, Any]:
+        Returns the calls, latency percentiles, error rate and health of a model for a task.
+
+    rank(task: str, prompt_tokens: int, question_characters: int) -> List[Dict[str, Any]]:
+        Returns the candidate models of a call, best first, with the facts they were ranked by.
+
+    runnable(task: str) -> Runnable:
+        Returns a runnable taking a prompt, or a dict of a "prompt" and a "question", and returning the routed answer.
+
+    stats() -> Dict[str, Any]:
+        Returns the health, calls and spend of every model.
+    """
+
+    def __init__(
+            self,
+            profiles: Dict[str, Dict[str, Any]],
+            latency_slo_ms: Dict[str, float],
+            max_error_rate: float,
+            window_seconds: float,
+            min_calls: int,
+            long_context_tokens: int,
+            long_question_characters: int,
+            decision_log_path: Optional[str],
+            decision_log_max_bytes: int = 10 * 1024 * 1024,
+            tokenizer_model: str = "gpt-4o-mini"
+    ):
+        self.profiles = profiles
+        self.latency_slo_ms = latency_slo_ms
+        self.max_error_rate = max_error_rate
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.long_context_tokens = long_context_tokens
+        self.long_question_characters = long_question_characters
+        self.decision_log_path = decision_log_path
+        self.decision_log_max_bytes = decision_log_max_bytes
+        self.tokenizer_model = tokenizer_model
+        # (time, task, latency in milliseconds, success) of the recent calls of each model
+        self._observations: Dict[str, deque] = {name: deque() for name in profiles}
+        self._spend: Dict[str, float] = {name: 0.0 for name in profiles}
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+
+    def _recent(self, name: str) -> List[Tuple[float, str, float, bool]]:
+        observations = self._observations[name]
+        expiry = time.time() - self.window_seconds
+        while observations and observations[0][0] < expiry:
+            observations.popleft()
+
+        return list(observations)
+
+    def health(self, name: str, task: str) -> Dict[str, Any]:
+        with self._lock:
+            observations = self._recent(name)
+
+        latencies = [latency for _, observed_task, latency, success in observations if observed_task == task and success]
+        errors = sum(not success for _, _, _, success in observations)
+        p95_ms = float(np.percentile(latencies, 95)) if latencies else None
+        error_rate = errors / len(observations) if observations else 0.0
+
+        slow = len(latencies) >= self.min_calls and p95_ms > self.latency_slo_ms[task]
+        failing = len(observations) >= self.min_calls and error_rate > self.max_error_rate
+        return {
+            "calls": len(observations),
+            "p50_ms": float(np.percentile(latencies, 50)) if latencies else None,
+            "p95_ms": p95_ms,
+            "error_rate": error_rate,
+            "healthy": not (slow or failing)
+        }
+
+    def _estimated_cost(self, name: str, task: str, prompt_tokens: int) -> float:
+        profile = self.profiles[name]
+        return (prompt_tokens * profile["input_cost"] + EXPECTED_OUTPUT_TOKENS[task] * profile["output_cost"]) / 1e6
+
+    def rank(self, task: str, prompt_tokens: int, question_characters: int) -> List[Dict[str, Any]]:
+        needs_high_quality = task == "generation" and (
+            prompt_tokens > self.long_context_tokens or question_characters > self.long_question_characters
+        )
+
+        candidates = []
+        for name, profile in self.profiles.items():
+            if prompt_tokens + EXPECTED_OUTPUT_TOKENS[task] > profile["context_window"]:
+                continue
+
+            candidates.append({
+                "model": name,
+                **self.health(name, task),
+                "quality_match": not needs_high_quality or profile["quality"] == "high",
+                "estimated_cost": self._estimated_cost(name, task, prompt_tokens)
+            })
+
+        return sorted(
+            candidates,
+            key=lambda candidate: (
+                not candidate["healthy"],
+                not candidate["quality_match"],
+                candidate["estimated_cost"],
+                candidate["p50_ms"] if candidate["p50_ms"] is not None else 0.0
+            )
+        )
+
+    def _record(self, name: str, task: str, latency_ms: float, success: bool, cost: float = 0.0) -> None:
+        with self._lock:
+            self._observations[name].append((time.time(), task, latency_ms, success))
+            self._spend[name] += cost
+
+        metrics.increment(f"model_router.{name}.{'calls' if success else 'errors'}")
+
+    def _log(self, decision: Dict[str, Any]) -> None:
+        if not self.decision_log_path:
+            return
+
+        with self._log_lock:
+            if os.path.exists(self.decision_log_path) and \
+                    os.path.getsize(self.decision_log_path) > self.decision_log_max_bytes:
+                os.replace(self.decision_log_path, f"{self.decision_log_path}.1")
+
+            with open(self.decision_log_path, "a", encoding="utf-8") as decision_log:
+                decision_log.write(json.dumps(decision) + "\n")
+
+    def _prepare(self, task: str, inputs: Union[PromptValue, Dict[str, Any]]) -> Tuple[PromptValue, Dict[str, Any]]:
+        prompt, question = (inputs["prompt"], inputs.get("question") or "") if isinstance(inputs, dict) else (inputs, "")
+        prompt_tokens = count_tokens(prompt.to_string(), self.tokenizer_model)
+        ranking = self.rank(task, prompt_tokens, len(question))
+        if not ranking:
+            raise ValueError(f"No chat model has a context window for a {task} prompt of {prompt_tokens} tokens")
+
+        decision = {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "task": task,
+            "prompt_tokens": prompt_tokens,
+            "question_characters": len(question),
+            "candidates": ranking,
+            "attempts": []
+        }
+        return prompt, decision
+
+    def _succeeded(self, decision: Dict[str, Any], name: str, message: BaseMessage, latency_ms: float) -> BaseMessage:
+        usage = getattr(message, "usage_metadata", None) or {}
+        output_tokens = usage.get("output_tokens") or count_tokens(str(message.content), self.tokenizer_model)
+        profile = self.profiles[name]
+        cost = (decision["prompt_tokens"] * profile["input_cost"] + output_tokens * profile["output_cost"]) / 1e6
+
+        self._record(name, decision["task"], latency_ms, True, cost)
+        decision["attempts"].append({"model": name, "latency_ms": round(latency_ms, 1)})
+        self._log({**decision, "chosen": name, "cost_usd": cost})
+        return message
+
+    def _failed(self, decision: Dict[str, Any], name: str, err: Exception, latency_ms: float) -> None:
+        print(f"---WARNING: MODEL {name} FAILED, FAILING OVER -> {err}---")
+        self._record(name, decision["task"], latency_ms, False)
+        decision["attempts"].append({"model": name, "latency_ms": round(latency_ms, 1), "error": str(err)})
+
+    def _invoke(self, inputs: Union[PromptValue, Dict[str, Any]], config: RunnableConfig, task: str) -> BaseMessage:
+        prompt, decision = self._prepare(task, inputs)
+        for candidate in decision["candidates"]:
+            start = time.perf_counter()
+            try:
+                message = self.profiles[candidate["model"]]["model"].invoke(prompt, config=config)
+            except Exception as err:
+                self._failed(decision, candidate["model"], err, (time.perf_counter() - start) * 1000)
+                continue
+
+            return self._succeeded(decision, candidate["model"], message, (time.perf_counter() - start) * 1000)
+
+        self._log({**decision, "chosen": None})
+        raise RuntimeError(f"All chat models failed for the {task} request: {decision['attempts']}")
+
+    async def _ainvoke(self, inputs: Union[PromptValue, Dict[str, Any]], config: RunnableConfig, task: str) -> BaseMessage:
+        prompt, decision = self._prepare(task, inputs)
+        for candidate in decision["candidates"]:
+            start = time.perf_counter()
+            try:
+                message = await self.profiles[candidate["model"]]["model"].ainvoke(prompt, config=config)
+            except Exception as err:
+                self._failed(decision, candidate["model"], err, (time.perf_counter() - start) * 1000)
+                continue
+
+            return self._succeeded(decision, candidate["model"], message, (time.perf_counter() - start) * 1000)
+
+        self._log({**decision, "chosen": None})
+        raise RuntimeError(f"All chat models failed for the {task} request: {decision['attempts']}")
+
+    def runnable(self, task: str) -> Runnable:
+        def invoke(inputs, config):
+            return self._invoke(inputs, config, task)
+
+        async def ainvoke(inputs, config):
+            return await self._ainvoke(inputs, config, task)
+
+        # The chosen model runs as a child of this runnable, so its tokens still reach `astream_events`
+        return RunnableLambda(invoke, afunc=ainvoke, name=f"route_{task}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            spend = dict(self._spend)
+
+        return {
+            name: {
+                "quality": profile["quality"],
+                "spend_usd": spend[name],
+                **{task: self.health(name, task) for task in self.latency_slo_ms}
+            }
+            for name, profile in self.profiles.items()
+        }
@@ -0,0 +1,302 @@
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from typing import Optional, Dict, Any, List, Union, Tuple
+import numpy as np
+import threading
+import sqlite3
+import re
+import mmap
+import os
+
+SEGMENTS_DATABASE_FILE = "segments.sqlite"
+SEGMENTS_TEXT_FILE = "segments.txt"
+
+# Segment statuses, tombstoned segments are still in the index until the next compaction removes their vectors
+LIVE = 0
+TOMBSTONED = 1
+COMPACTED = 2
+
+
+def parse_timestamp(
+        timestamp: Union[str, int, float]
+) -> float:
+    """
+    Converts a caption timestamp into seconds.
+
+    Args:
+    ------------
+    timestamp (Union[str, int, float]): A timestamp in "seconds", "minutes:seconds" or "hours:minutes:seconds" format.
+
+    Returns:
+    ------------
+    float: The timestamp in seconds.
+    """
+    seconds = 0.0
+    for part in str(timestamp).split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+class SegmentStore(Docstore):
+    """
+    A compact docstore of transcript segments backed by SQLite and a memory-mapped text file.
+
+    Description:
+    ------------
+    Every segment is one row of the `segments` table holding its vector id, video ID, start and end time in seconds, its
+    status, and the byte offset and length of its text in `segments.txt`. The texts are also indexed by the contentless
+    FTS5 table `segments_fts`, a BM25 inverted index sharing the vector ids, which serves keyword and exact phrase queries
+    without an embedding request. Deleting a video only tombstones its rows, and rows are kept after compaction, so
+    vector ids are never reused and always map to the same segment. Opening the store only connects to the database and
+    maps the text file, nothing is deserialized up front. Rows are fetched by id when a query returns them, and the text pages are
+    shared between all worker processes through the page cache.
+
+    Attributes:
+    -----------
+    folder_path : str
+        The folder containing the segment files.
+
+    Methods:
+    --------
+    search(search: str) -> Optional[Document]:
+        Returns the segment stored under the given vector id as a document, None if no segment has the id.
+
+    insert(ids: List[int], documents: List[Document]):
+        Stores documents under the given vector ids, reading video ID, start and end from their metadata.
+
+    next_id() -> int:
+        Returns the smallest vector id that has never been used.
+
+    video_ids(video_id: str) -> np.ndarray:
+        Returns the vector ids of a video's segments.
+
+    video_times(video_id: str) -> List[Tuple[int, Optional[float], Optional[float]]]:
+        Returns the vector id, start and end of each live segment of a video.
+
+    live_ids() -> np.ndarray:
+        Returns the vector ids of all segments that are not deleted.
+
+    has_video(video_id: str) -> bool:
+        Checks whether the store holds live segments of a video.
+
+    tombstone(video_id: str, before_id: Optional[int] = None) -> int:
+        Marks the live segments of a video as deleted.
+
+    tombstoned_ids() -> np.ndarray:
+        Returns the vector ids of deleted segments that are still in the index.
+
+    mark_compacted(ids: np.ndarray):
+        Records that the vectors of tombstoned segments were removed from the index.
+
+    lexical_search(query: str, k: int, video_id: Optional[str] = None, phrase: bool = False) -> List[Tuple[int, float]]:
+        Returns the vector ids and BM25 scores of the live segments best matching the query's words or exact phrase.
+    """
+
+    def __init__(self, folder_path: str):
+        self.folder_path = folder_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            os.path.join(folder_path, SEGMENTS_DATABASE_FILE),
+            check_same_thread=False
+        )
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS segments (
+                id INTEGER PRIMARY KEY,
+                video_id TEXT NOT NULL,
+                start REAL,
+                end REAL,
+                text_offset INTEGER NOT NULL,
+                text_length INTEGER NOT NULL,
+                status INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS segments_video_id ON segments (video_id, id);
+            """
+        )
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(segments)")]
+        if "status" not in columns:
+            # Stores written before deletion existed only hold live segments
+            self._connection.execute(f"ALTER TABLE segments ADD COLUMN status INTEGER NOT NULL DEFAULT {LIVE}")
+        self._connection.execute(
+            f"CREATE INDEX IF NOT EXISTS segments_tombstoned ON segments (id) WHERE status = {TOMBSTONED}"
+        )
+        self._connection.commit()
+        self._text_path = os.path.join(folder_path, SEGMENTS_TEXT_FILE)
+        self._texts: Optional[mmap.mmap] = None
+
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            has_lexical_index = self._connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'segments_fts'"
+            ).fetchone() is not None
+            if not has_lexical_index:
+                self._connection.execute(
+                    "CREATE VIRTUAL TABLE segments_fts USING fts5(text, content='', tokenize='porter unicode61')"
+                )
+                # Stores written before lexical search existed are indexed once
+                rows = self._connection.execute("SELECT id, text_offset, text_length FROM segments").fetchall()
+                self._connection.executemany(
+                    "INSERT INTO segments_fts (rowid, text) VALUES (?, ?)",
+                    [(vector_id, self._read_text(offset, length)) for vector_id, offset, length in rows]
+                )
+
+    def __len__(self) -> int:
+        return self.next_id()
+
+    def _read_text(self, offset: int, length: int) -> str:
+        if self._texts is None or offset + length > len(self._texts):
+            # Texts appended after the file was mapped require a new, larger mapping
+            with open(self._text_path, "rb") as text_file:
+                self._texts = mmap.mmap(text_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._texts[offset:offset + length].decode("utf-8")
+
+    @staticmethod
+    def _to_document(row: tuple, text: str) -> Document:
+        segment_id, video_id, start, end, _, _ = row
+        return Document(
+            page_content=text,
+            metadata={"video_id": video_id, "start": start, "end": end, "segment_id": segment_id}
+        )
+
+    def search(self, search: str) -> Optional[Document]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, video_id, start, end, text_offset, text_length FROM segments WHERE id = ?",
+                (int(search),)
+            ).fetchone()
+
+            # Vectors are written before their segments, so an index can hold ids the store does not know yet
+            if row is None:
+                return None
+
+            return self._to_document(row, self._read_text(row[4], row[5]))
+
+    def insert(self, ids: List[int], documents: List[Document]) -> None:
+        rows = []
+        with self._lock, open(self._text_path, "ab") as text_file:
+            for vector_id, document in zip(ids, documents):
+                encoded_text = document.page_content.encode("utf-8")
+                rows.append((
+                    int(vector_id),
+                    document.metadata["video_id"],
+                    document.metadata.get("start"),
+                    document.metadata.get("end"),
+                    text_file.tell(),
+                    len(encoded_text)
+                ))
+                text_file.write(encoded_text)
+
+            # Texts are flushed before their rows are committed, so readers never see a row without its text
+            text_file.flush()
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT INTO segments (id, video_id, start, end, text_offset, text_length) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._connection.executemany(
+                    "INSERT INTO segments_fts (rowid, text) VALUES (?, ?)",
+                    [(int(vector_id), document.page_content) for vector_id, document in zip(ids, documents)]
+                )
+
+    def next_id(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM segments").fetchone()[0]
+
+    def video_ids(self, video_id: str) -> np.ndarray:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id FROM segments WHERE video_id = ? AND status = ? ORDER BY id",
+                (video_id, LIVE)
+            ).fetchall()
+
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+    def video_times(self, video_id: str) -> List[Tuple[int, Optional[float], Optional[float]]]:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT id, start, end FROM segments WHERE video_id = ? AND status = ? ORDER BY id",
+                (video_id, LIVE)
+            ).fetchall()
+
+    def live_ids(self) -> np.ndarray:
+        with self._lock:
+            rows = self._connection.execute("SELECT id FROM segments WHERE status = ? ORDER BY id", (LIVE,)).fetchall()
+
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+    def has_video(self, video_id: str) -> bool:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT 1 FROM segments WHERE video_id = ? AND status = ? LIMIT 1",
+                (video_id, LIVE)
+            ).fetchone() is not None
+
+    def tombstone(self, video_id: str, before_id: Optional[int] = None) -> int:
+        if before_id is None:
+            before_id = self.next_id()
+
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "UPDATE segments SET status = ? WHERE video_id = ? AND status = ? AND id < ?",
+                (TOMBSTONED, video_id, LIVE, before_id)
+            )
+            return cursor.rowcount
+
+    def tombstoned_ids(self) -> np.ndarray:
+        with self._lock:
+            rows = self._connection.execute("SELECT id FROM segments WHERE status = ?", (TOMBSTONED,)).fetchall()
+
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+    def mark_compacted(self, ids: np.ndarray) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE segments SET status = ? WHERE id = ? AND status = ?",
+                [(COMPACTED, int(vector_id), TOMBSTONED) for vector_id in ids]
+            )
+
+    def lexical_search(
+            self,
+            query: str,
+            k: int,
+            video_id: Optional[str] = None,
+            phrase: bool = False
+    ) -> List[Tuple[int, float]]:
+        words = re.findall(r"\w+", query.lower())
+        if not words:
+            return []
+
+        if phrase:
+            # A single quoted string only matches its words adjacent and in order
+            match_expression = '"' + " ".join(words) + '"'
+        else:
+            # Every word is quoted, so words such as "and" or "not" are never read as FTS5 operators
+            match_expression = " OR ".join(f'"{word}"' for word in words)
+
+        video_condition = "AND segments.video_id = ?" if video_id is not None else ""
+        parameters = (match_expression, LIVE) + ((video_id,) if video_id is not None else ()) + (k,)
+
+        with self._lock:
+            rows = self._connection.execute(
+                f"""
+                SELECT segments.id, bm25(segments_fts) AS score
+                FROM segments_fts JOIN segments ON segments.id = segments_fts.rowid
+                WHERE segments_fts MATCH ? AND segments.status = ? {video_condition}
+                ORDER BY score
+                LIMIT ?
+                """,
+                parameters
+            ).fetchall()
+
+        return [(vector_id, float(score)) for vector_id, score in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            live_count, tombstoned_count, video_count = self._connection.execute(
+                "SELECT COALESCE(SUM(status = ?), 0), COALESCE(SUM(status = ?), 0), "
+                "COUNT(DISTINCT CASE WHEN status = ? THEN video_id END) FROM segments",
+                (LIVE, TOMBSTONED, LIVE)
+            ).fetchone()
+
+        return {"segments": live_count, "tombstoned": tombstoned_count, "videos": video_count}
@@ -0,0 +1,99 @@
+from helpers.metrics import metrics
+from typing import Callable, Awaitable, Optional, Dict, Tuple, Any, TypeVar
+import functools
+import asyncio
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Shares one in-flight computation between concurrent identical requests.
+
+    Description:
+    ------------
+    When a video link is shared with a class, many users send the same URL and the same first questions at the same
+    moment. Every computation is keyed by its video ID, its operation and its normalized message, which is lowercased
+    and has its whitespace collapsed. The first request of a key starts the computation, and the requests arriving
+    while it runs wait for it and receive its result, or its exception. The key is released as soon as the computation
+    ends, so later requests compute again and see fresh state. A waiting request that is cancelled, such as a closed
+    stream, detaches without cancelling the computation for the others. Leaders and followers are counted per
+    operation in `metrics`.
+
+    Computations are asyncio tasks of the running event loop, so a flight is shared by the requests of one process.
+
+    Attributes:
+    -----------
+    enabled : bool
+        Whether identical requests are coalesced, when False every request computes on its own.
+
+    Methods:
+    --------
+    run(video_id: Optional[str], operation: str, message: Optional[str], function: Callable[[], Awaitable[T]]) -> T:
+        Returns the result of the in-flight computation of the key, starting it if there is none.
+
+    coalesce(operation: str, message_field: Optional[str] = None) -> Callable:
+        Decorates a graph node so that concurrent runs with the same video ID and message share one node run.
+
+    stats() -> Dict[str, Any]:
+        Returns the number of computations in flight and the leaders and followers per operation.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights: Dict[Tuple[str, str, str], asyncio.Future] = {}
+
+    @staticmethod
+    def _key(video_id: Optional[str], operation: str, message: Optional[str]) -> Tuple[str, str, str]:
+        return video_id or "", operation, " ".join((message or "").lower().split())
+
+    def _land(self, key: Tuple[str, str, str], flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+        # Retrieves the exception when every waiter has detached, so it is not reported as never retrieved
+        if not flight.cancelled():
+            flight.exception()
+
+    async def run(
+            self,
+            video_id: Optional[str],
+            operation: str,
+            message: Optional[str],
+            function: Callable[[], Awaitable[T]]
+    ) -> T:
+        if not self.enabled:
+            return await function()
+
+        key = self._key(video_id, operation, message)
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(function())
+            self._flights[key] = flight
+            flight.add_done_callback(functools.partial(self._land, key))
+            metrics.increment(f"single_flight.{operation}.leaders")
+        else:
+            metrics.increment(f"single_flight.{operation}.followers")
+
+        return await asyncio.shield(flight)
+
+    def coalesce(self, operation: str, message_field: Optional[str] = None) -> Callable:
+        def decorator(node: Callable[[Dict[str, Any]], Awaitable[T]]) -> Callable[[Dict[str, Any]], Awaitable[T]]:
+            @functools.wraps(node)
+            async def coalesced_node(state: Dict[str, Any]) -> T:
+                message = state.get(message_field) if message_field else None
+                return await self.run(state.get("video_id"), operation, message, lambda: node(state))
+
+            return coalesced_node
+
+        return decorator
+
+    def stats(self) -> Dict[str, Any]:
+        counters = metrics.snapshot()["counters"]
+        operations = {}
+        for name, value in counters.items():
+            if name.startswith("single_flight."):
+                _, operation, role = name.split(".")
+                operations.setdefault(operation, {"leaders": 0, "followers": 0})[role] = value
+
+        return {"enabled": self.enabled, "in_flight": len(self._flights), "operations": operations}
@@ -0,0 +1,97 @@
+from langgraph.graph.state import CompiledStateGraph
+from langchain_core.tracers.context import tracing_v2_enabled
+from helpers.metrics import metrics
+from typing import AsyncIterator, Dict, Any
+import json
+import time
+
+# The graph node whose chat model tokens form the answer, tokens of other nodes are internal
+ANSWER_NODE = "continue_rag"
+
+
+def sse_event(
+        event: str,
+        data: Any
+) -> str:
+    """
+    Formats one Server-Sent Event.
+
+    Args:
+    ------------
+    event (str): The event type, such as "node", "token", "done" or "error".
+    data (Any): The JSON-serializable payload of the event.
+
+    Returns:
+    ------------
+    str: The event in `text/event-stream` format, terminated by a blank line.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream_agent_events(
+        graph: CompiledStateGraph,
+        payload: Dict[str, Any],
+        config: Dict[str, Any]
+) -> AsyncIterator[str]:
+    """
+    Runs the agent graph and yields its progress and answer tokens as Server-Sent Events.
+
+    Description:
+    ------------
+    The graph runs through `astream_events`, so its synchronous nodes execute in worker threads while the event loop
+    forwards their events. Every graph node yields a "node" event when it starts and finishes, and every token the chat
+    model generates for the answer yields a "token" event as soon as it arrives. Answers that are not generated token by
+    token, such as cached answers, are sent as a single "token" event. The final graph state follows as a "done" event,
+    holding the same fields `/process/converse_with_agent` returns, and failures end the stream with an "error" event.
+    The time to the first answer token and to the end of the stream are recorded in `metrics`.
+
+    Args:
+    ------------
+    graph (CompiledStateGraph): The compiled agent graph.
+    payload (Dict[str, Any]): The graph input, holding the video URL and the chat message.
+    config (Dict[str, Any]): The graph config selecting the conversation thread.
+
+    Returns:
+    ------------
+    AsyncIterator[str]: The events in `text/event-stream` format.
+    """
+    start = time.perf_counter()
+    streamed_tokens = 0
+
+    try:
+        with tracing_v2_enabled(project_name="TalkYou"):
+            async for event in graph.astream_events(payload, config=config, version="v2"):
+                node = event["metadata"].get("langgraph_node")
+
+                # Node runs are children of the graph run, routing functions named like their node are nested deeper
+                is_node_run = event["name"] == node and len(event.get("parent_ids", [])) == 1
+                if is_node_run and not node.startswith("__") and event["event"] in ("on_chain_start", "on_chain_end"):
+                    status = "started" if event["event"] == "on_chain_start" else "finished"
+                    yield sse_event("node", {"node": node, "status": status})
+
+                elif event["event"] == "on_chat_model_stream" and node == ANSWER_NODE:
+                    token = event["data"]["chunk"].content
+                    if not token:
+                        continue
+
+                    if streamed_tokens == 0:
+                        metrics.observe("stream_agent.first_token", (time.perf_counter() - start) * 1000)
+                    streamed_tokens += 1
+                    yield sse_event("token", {"token": token})
+
+        state = (await graph.aget_state(config)).values
+        # Image requests whose moment was not found are answered with text as well
+        answered_with_text = payload.get("chat_message") and (
+            state.get("identified_request") == "information" or not state.get("screenshot_base64")
+        )
+        if streamed_tokens == 0 and answered_with_text and state.get("response"):
+            metrics.observe("stream_agent.first_token", (time.perf_counter() - start) * 1000)
+            yield sse_event("token", {"token": state["response"]})
+
+        yield sse_event("done", state)
+
+    except Exception as err:
+        yield sse_event("error", {"detail": str(err)})
+
+    finally:
+        metrics.observe("stream_agent.total", (time.perf_counter() - start) * 1000)
@@ -0,0 +1,171 @@
+from typing import Optional, List, Dict, Any
+import numpy as np
+
+
+class VideoTimeline:
+    """
+    The caption embeddings of one video, stored as a contiguous array in time order.
+
+    Description:
+    ------------
+    The rows are L2-normalized once when the timeline is built, so scoring a question against every caption line of the
+    video is a single matrix-vector product of cosine similarities. Scores are then smoothed over a sliding time window,
+    since a relevant moment usually spans several consecutive caption lines, and the best windows are returned as
+    candidate moments, each pointing to the best matching line of its window.
+
+    Attributes:
+    -----------
+    ids : np.ndarray
+        The vector ids of the caption lines, in time order.
+    starts : np.ndarray
+        The start time of each caption line in seconds.
+    ends : np.ndarray
+        The end time of each caption line in seconds, NaN where unknown.
+    vectors : np.ndarray
+        The L2-normalized float32 embeddings, one row per caption line.
+
+    Methods:
+    --------
+    score(query_vector: List[float], window_seconds: float, candidate_count: int) -> List[Dict[str, Any]]:
+        Returns the best moments of the video for the query vector, best first.
+    """
+
+    def __init__(self, ids: np.ndarray, starts: np.ndarray, ends: np.ndarray, vectors: np.ndarray):
+        self.ids = ids
+        self.starts = starts
+        self.ends = ends
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = np.ascontiguousarray(vectors / np.maximum(norms, 1e-12), dtype=np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.starts.nbytes + self.ends.nbytes + self.vectors.nbytes
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def smooth(self, scores: np.ndarray, window_seconds: float) -> np.ndarray:
+        """
+        Averages the scores of the caption lines starting within `window_seconds` after each line.
+
+        Description:
+        ------------
+        Because the starts are sorted, the window of every line ends at the position found by one `searchsorted`, and
+        all window sums come from a single cumulative sum, so smoothing is linear in the number of lines.
+
+        Args:
+        ------------
+        scores (np.ndarray): The score of each caption line.
+        window_seconds (float): The length of the window following each line's start.
+
+        Returns:
+        ------------
+        np.ndarray: The mean score of each line's window, which always contains at least the line itself.
+        """
+        cumulative_scores = np.concatenate([[0.0], np.cumsum(scores, dtype=np.float64)])
+        positions = np.arange(len(scores))
+        window_ends = self.window_ends(window_seconds)
+        return (cumulative_scores[window_ends] - cumulative_scores[positions]) / (window_ends - positions)
+
+    def window_ends(self, window_seconds: float) -> np.ndarray:
+        """
+        Returns the position after the last caption line starting within `window_seconds` after each line.
+        """
+        return np.maximum(
+            np.searchsorted(self.starts, self.starts + window_seconds, side="left"),
+            np.arange(len(self.starts)) + 1
+        )
+
+    def score(
+            self,
+            query_vector: List[float],
+            window_seconds: float,
+            candidate_count: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Scores every caption line of the video against a query and returns the best moments.
+
+        Description:
+        ------------
+        After smoothing, the best window is taken as the first moment, and runner-ups are taken in order of their
+        smoothed score while skipping windows whose best line is within `window_seconds` of an already chosen moment,
+        so the candidates point to distinct parts of the video. A moment starts at the best scoring line of its window
+        rather than at the window's first line, which may precede the match by up to `window_seconds`.
+
+        Args:
+        ------------
+        query_vector (List[float]): The embedding of the question.
+        window_seconds (float): The length of the smoothing window in seconds.
+        candidate_count (int): The maximum number of moments to return.
+
+        Returns:
+        ------------
+        List[Dict[str, Any]]: The moments, best first, each with the "id", "start" and "end" of the best caption line of
+                              its window and the smoothed "score" of the window. Empty if the timeline has no lines.
+        """
+        if len(self) == 0:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.vectors @ query
+        smoothed_scores = self.smooth(scores, window_seconds)
+        window_ends = self.window_ends(window_seconds)
+
+        moments = []
+        for position in np.argsort(-smoothed_scores, kind="stable"):
+            best_position = position + int(np.argmax(scores[position:window_ends[position]]))
+            start = float(self.starts[best_position])
+            if any(abs(start - moment["start"]) < window_seconds for moment in moments):
+                continue
+
+            end = float(self.ends[best_position])
+            moments.append({
+                "id": int(self.ids[best_position]),
+                "start": start,
+                "end": None if np.isnan(end) else end,
+                "score": float(smoothed_scores[position])
+            })
+            if len(moments) == candidate_count:
+                break
+
+        return moments
+
+
+def build_timeline(
+        ids: np.ndarray,
+        starts: List[Optional[float]],
+        ends: List[Optional[float]],
+        vectors: np.ndarray
+) -> VideoTimeline:
+    """
+    Builds a timeline from caption lines, ordering them by start time.
+
+    Args:
+    ------------
+    ids (np.ndarray): The vector ids of the caption lines.
+    starts (List[Optional[float]]): The start time of each line in seconds. Lines without a start keep their position.
+    ends (List[Optional[float]]): The end time of each line in seconds, None where unknown.
+    vectors (np.ndarray): The embeddings of the lines, one row per line.
+
+    Returns:
+    ------------
+    VideoTimeline: The timeline of the video, empty if there are no lines.
+    """
+    start_array = np.array(
+        [start if start is not None else float(position) for position, start in enumerate(starts)],
+        dtype=np.float64
+    )
+    end_array = np.array([end if end is not None else np.nan for end in ends], dtype=np.float64)
+    order = np.argsort(start_array, kind="stable")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    # A video without live caption lines, for instance after its deletion, has an empty timeline
+    dimensions = vectors.shape[-1] if vectors.ndim == 2 else 0
+    vectors = vectors.reshape(len(start_array), -1) if len(start_array) else vectors.reshape(0, dimensions)
+
+    return VideoTimeline(
+        ids=np.asarray(ids, dtype=np.int64)[order],
+        starts=start_array[order],
+        ends=end_array[order],
+        vectors=vectors[order]
+    )
@@ -0,0 +1,90 @@
+from typing import Optional, Any
+import functools
+import tiktoken
+
+# Rough size of a token in English text, used when the model's encoding cannot be loaded
+CHARACTERS_PER_TOKEN = 4
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(
+        model_name: str
+) -> Optional[Any]:
+    """
+    Loads the tokenizer of a model once per process.
+
+    Description:
+    ------------
+    Loading an encoding reads its BPE ranks from disk, or downloads them on first use, which is far too slow to repeat
+    per prompt, so encodings are cached per model. When the encoding cannot be loaded, for instance offline, token
+    counts fall back to an estimate from the text length.
+
+    Args:
+    ------------
+    model_name (str): The name of the model, for instance "gpt-4o-mini".
+
+    Returns:
+    ------------
+    Optional[Any]: The tiktoken encoding of the model, or None if it cannot be loaded.
+    """
+    try:
+        return tiktoken.encoding_for_model(model_name)
+
+    except Exception as err:
+        print(f"---WARNING: TOKENIZER OF {model_name} UNAVAILABLE, ESTIMATING TOKENS -> {err}---")
+        return None
+
+
+@functools.lru_cache(maxsize=16384)
+def count_tokens(
+        text: str,
+        model_name: str
+) -> int:
+    """
+    Counts the tokens of a text for a model.
+
+    Description:
+    ------------
+    Counts are cached per text, since the same segments of popular videos and the same conversation turns are measured
+    again for every answer.
+
+    Args:
+    ------------
+    text (str): The text.
+    model_name (str): The name of the model whose tokenizer is used.
+
+    Returns:
+    ------------
+    int: The number of tokens.
+    """
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return -(-len(text) // CHARACTERS_PER_TOKEN)
+
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(
+        text: str,
+        max_tokens: int,
+        model_name: str
+) -> str:
+    """
+    Cuts a text down to its first tokens.
+
+    Args:
+    ------------
+    text (str): The text.
+    max_tokens (int): The maximum number of tokens kept.
+    model_name (str): The name of the model whose tokenizer is used.
+
+    Returns:
+    ------------
+    str: The text, cut after `max_tokens` tokens.
+    """
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return text[:max_tokens * CHARACTERS_PER_TOKEN]
+
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
@@ -15,13 +15,29 @@ from helpers.constants import (
     driver,
     request_identification_prompt_template,
     rag_prompt_template,
-    gpt_4o_mini,
-    gpt_3_5,
-    text_embedding_v3_small
+    conversation_summary_prompt_template,
+    video_digest_prompt_template,
+    digest_answer_prompt_template,
+    model_router,
+    CHAT_MODEL_NAME,
+    embedding_model,
+    VECTORSTORE_PATH,
+    METADATA_PATH,
+    INTENT_CONFIDENCE_THRESHOLD,
+    MEMORY_RECENT_TOKENS,
+    MEMORY_SUMMARY_TOKENS,
+    RAG_CANDIDATES,
+    RAG_CONTEXT_TOKENS,
+    RAG_BATCH_CONCURRENCY,
+    VIDEO_DIGEST,
+    DIGEST_WINDOW_SECONDS,
+    DIGEST_WINDOWS_PER_SECTION,
+    DIGEST_SUMMARY_TOKENS,
+    answer_cache
 )
 from helpers.helper_functions import (
-    create_empty_vectorstore,
     create_metadata,
+    extract_video_id,
     FetchTranscriptionModel,
     FetchVideoLengthModel,
     ScrapeTranscriptions,
@@ -30,6 +46,14 @@ from helpers.helper_functions import (
     RagToolModel,
     ScreenshotModel
 )
+from helpers.vectorstore import load_vectorstore, quoted_phrase, HybridRetriever
+from helpers.intent_classifier import IntentClassifier
+from helpers.conversation_memory import ConversationMemory
+from helpers.context_packer import ContextPacker
+from helpers.video_digest import VideoDigester, DigestStore
+from helpers.metrics import metrics
+from helpers.tokenizer import count_tokens
+from helpers.executors import selenium_executor, run_blocking
 
 from langchain.memory import (
     ConversationBufferMemory,
@@ -40,6 +64,7 @@ from langchain_core.prompts import (
     PromptTemplate
 )
 from langchain_core.messages import AIMessage
+from langchain_core.documents import Document
 from langchain_core.output_parsers import (
     JsonOutputParser,
     StrOutputParser,
@@ -47,7 +72,6 @@ from langchain_core.output_parsers import (
 )
 from langchain_core.runnables import (
     Runnable,
-    RunnableMap,
     RunnableLambda,
     RunnablePassthrough
 )
@@ -75,6 +99,100 @@ import os
 
 load_dotenv()
 
+intent_classifier = IntentClassifier(embedding_model, confidence_threshold=INTENT_CONFIDENCE_THRESHOLD)
+conversation_memory = ConversationMemory(
+    summarizer=(
+        PromptTemplate.from_template(conversation_summary_prompt_template)
+        | model_router.runnable("summary")
+        | StrOutputParser()
+    ),
+    model_name=CHAT_MODEL_NAME,
+    recent_token_budget=MEMORY_RECENT_TOKENS,
+    summary_token_budget=MEMORY_SUMMARY_TOKENS
+)
+context_packer = ContextPacker(model_name=CHAT_MODEL_NAME, token_budget=RAG_CONTEXT_TOKENS)
+video_digester = VideoDigester(
+    summarizer=(
+        PromptTemplate.from_template(video_digest_prompt_template)
+        | model_router.runnable("summary")
+        | StrOutputParser()
+    ),
+    store=DigestStore(VECTORSTORE_PATH),
+    captions_path=METADATA_PATH,
+    window_seconds=DIGEST_WINDOW_SECONDS,
+    windows_per_section=DIGEST_WINDOWS_PER_SECTION,
+    summary_tokens=DIGEST_SUMMARY_TOKENS
+)
+
+
+def count_prompt_tokens(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    # The question length and prompt size let the router pick the model of the answer
+    prompt_tokens = context_packer.count_prompt(inputs["prompt"].to_string())
+    if inputs.get("usage") is not None:
+        inputs["usage"]["prompt_tokens"] = prompt_tokens
+    return {"prompt": inputs["prompt"], "question": inputs["question"]}
+
+
+# The answer chains are built once, every call passes its documents, digest, history and usage record as inputs
+request_parser = PydanticOutputParser(pydantic_object=RequestParser)
+identification_prompt = PromptTemplate(
+    template=request_identification_prompt_template,
+    input_variables=["request"],
+    partial_variables={"format_instructions": request_parser.get_format_instructions()}
+)
+identification_chain = identification_prompt | model_router.runnable("classification") | request_parser
+
+rag_prompt = PromptTemplate.from_template(rag_prompt_template)
+rag_answer_chain = (
+        {
+            "prompt": {
+                "question": itemgetter("question"),
+                "chat_history": lambda inputs: inputs.get("chat_history") or "None",
+                # Overlapping and neighbouring segments are merged and the best ones packed into the token budget
+                "context": itemgetter("documents") | RunnableLambda(context_packer.pack)
+            } | rag_prompt,
+            "question": itemgetter("question"),
+            "usage": lambda inputs: inputs.get("usage")
+        }
+        | RunnableLambda(count_prompt_tokens)
+        | model_router.runnable("generation")
+        | StrOutputParser()
+)
+
+digest_prompt = PromptTemplate.from_template(digest_answer_prompt_template)
+digest_answer_chain = (
+        {
+            "prompt": {
+                "question": itemgetter("question"),
+                "chat_history": lambda inputs: inputs.get("chat_history") or "None",
+                "digest": itemgetter("digest")
+            } | digest_prompt,
+            "question": itemgetter("question"),
+            "usage": lambda inputs: inputs.get("usage")
+        }
+        | RunnableLambda(count_prompt_tokens)
+        | model_router.runnable("generation")
+        | StrOutputParser()
+)
+
+
+def warm_up_chains() -> None:
+    """
+    Renders the prompt of every answer chain once, which loads the tokenizer the prompts are counted with.
+
+    Description:
+    ------------
+    The chains themselves are built at import. Rendering their prompts with empty inputs and counting the tokens loads
+    the chat model's encoding, so the first answer does not pay for it. No chat model is called.
+    """
+    rendered_prompts = [
+        identification_prompt.format(request=""),
+        rag_prompt.format(question="", chat_history="None", context=context_packer.pack([])),
+        digest_prompt.format(question="", chat_history="None", digest="")
+    ]
+    for rendered_prompt in rendered_prompts:
+        count_tokens(rendered_prompt, CHAT_MODEL_NAME)
+
 
 class TranscriptionTool(BaseTool):
     name: str = "CheckTranscriptionElement"
@@ -121,6 +239,13 @@ class TranscriptionTool(BaseTool):
             print(f"TimeoutException: {e}")
             return False
 
+    async def _arun(
+            self,
+            video_url: str,
+            run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> bool:
+        return await run_blocking(selenium_executor, self._run, video_url)
+
 
 class VideoLengthTool(BaseTool):
     name: str = "CheckVideoLength"
@@ -156,6 +281,13 @@ class VideoLengthTool(BaseTool):
             print(f"TimeoutException: {e}")
             return 19
 
+    async def _arun(
+            self,
+            video_url: str,
+            run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> Union[float, int]:
+        return await run_blocking(selenium_executor, self._run, video_url)
+
 
 class TranscriptionScrapperTool(BaseTool):
     name: str = "TranscriptionScrapper"
@@ -211,14 +343,20 @@ class TranscriptionScrapperTool(BaseTool):
                 time_value = timestamp.text
                 full_transcription[time_value] = transcription.text
 
-            empty_faiss_vectorstore = create_empty_vectorstore()
-            create_metadata(full_transcription, empty_faiss_vectorstore)
+            create_metadata(full_transcription, extract_video_id(video_url))
 
             return full_transcription
 
         except TimeoutException as err:
             print(f"TimeoutException: {err}")
 
+    async def _arun(
+            self,
+            video_url: str,
+            run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> Dict[str, str]:
+        return await run_blocking(selenium_executor, self._run, video_url)
+
 
 class RequestIdentifierTool(BaseTool):
     name: str = "IdentifyRequests"
@@ -229,25 +367,30 @@ class RequestIdentifierTool(BaseTool):
             self,
             chat_message: str,
             run_manager: Optional[CallbackManagerForToolRun] = None
-    ) -> str:
-        output_parser = PydanticOutputParser(pydantic_object=RequestParser)
-        identification_prompt = PromptTemplate(
-            template=request_identification_prompt_template,
-            input_variables=["request"],
-            partial_variables={"format_instructions": output_parser.get_format_instructions()}
-        )
-
-        identification_chain = (
-                identification_prompt
-                | gpt_4o_mini
-                | output_parser
-        )
+    ) -> RequestParser:
+        category = intent_classifier.classify(chat_message)
+        if category is not None:
+            return RequestParser(request_category=category)
 
-        with tracing_v2_enabled(project_name="TalkYou"):
+        with tracing_v2_enabled(project_name="TalkYou"), metrics.timer("intent_classifier.llm"):
             response = identification_chain.invoke({"request": chat_message})
 
         return response
 
+    async def _arun(
+            self,
+            chat_message: str,
+            run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> RequestParser:
+        category = await intent_classifier.aclassify(chat_message)
+        if category is not None:
+            return RequestParser(request_category=category)
+
+        with tracing_v2_enabled(project_name="TalkYou"), metrics.timer("intent_classifier.llm"):
+            response = await identification_chain.ainvoke({"request": chat_message})
+
+        return response
+
 
 class ScreenshotTool(BaseTool):
     name: str = "ScreenshotTool"
@@ -277,39 +420,227 @@ class ScreenshotTool(BaseTool):
         except TimeoutException as err:
             print(f"TimeoutException: {err}")
 
+    async def _arun(
+            self,
+            video_url: str,
+            run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> Union[str, bytes, AnyStr, Any]:
+        return await run_blocking(selenium_executor, self._run, video_url)
+
 
 class RagTool(BaseTool):
     name: str = "RagTool"
     description: str = "RAG tool for Q&A with Youtube video's"
     args_schema: Type[BaseModel] = RagToolModel
 
+    @staticmethod
+    def _retriever(
+            vectorstore: FAISS,
+            video_id: Optional[str]
+    ) -> Runnable:
+        return itemgetter("question") | HybridRetriever(vectorstore=vectorstore, k=RAG_CANDIDATES, video_id=video_id)
+
+    @staticmethod
+    def _phrase_documents(
+            chat_message: str,
+            video_id: Optional[str]
+    ) -> Optional[List[Document]]:
+        # Questions quoting a phrase of the video are answered from its exact matches, without an embedding request
+        if quoted_phrase(chat_message) is None:
+            return None
+
+        return load_vectorstore(VECTORSTORE_PATH).phrase_search(chat_message, RAG_CANDIDATES, video_id=video_id)
+
+    async def aretrieve(
+            self,
+            chat_message: str,
+            video_id: Optional[str] = None
+    ) -> List[Document]:
+        # Retrieval on its own, so the context can be computed ahead of `_arun` and passed to it
+        if quoted_phrase(chat_message) is not None:
+            phrase_documents = await asyncio.to_thread(self._phrase_documents, chat_message, video_id)
+            if phrase_documents is not None:
+                return phrase_documents
+
+        # The embedding is requested asynchronously and cached, so the retriever's worker thread never waits on the API
+        await embedding_model.aembed_query(chat_message)
+        vectorstore = await asyncio.to_thread(load_vectorstore, VECTORSTORE_PATH)
+        return await self._retriever(vectorstore, video_id).ainvoke({"question": chat_message})
+
     def _run(
             self,
             chat_message: str,
+            video_id: Optional[str] = None,
+            chat_history: Optional[str] = None,
+            usage: Optional[Dict[str, int]] = None,
             run_manager: Optional[CallbackManagerForToolRun] = None
     ) -> str:
-        retriever = FAISS.load_local(
-            folder_path="./faiss_vectorstore",
-            embeddings=text_embedding_v3_small,
-            allow_dangerous_deserialization=True
-        )
-        # TODO-> Add memory
-        rag_prompt = PromptTemplate.from_template(rag_prompt_template)
-        rag_chain = (
-                {
-                    "question": itemgetter("question"),
-                    "context": itemgetter("question") | retriever.as_retriever()
-                }
-                | rag_prompt
-                | gpt_4o_mini
-                | StrOutputParser()
-        )
+        # Summary questions are answered from the precomputed digest of the video, without retrieval
+        digest = video_digester.context(video_id, chat_message) if VIDEO_DIGEST and video_id is not None else None
+        if digest is not None:
+            with tracing_v2_enabled(project_name="TalkYou"):
+                return digest_answer_chain.invoke(
+                    {"question": chat_message, "chat_history": chat_history, "digest": digest, "usage": usage}
+                )
 
+        phrase_documents = self._phrase_documents(chat_message, video_id)
+        if phrase_documents is not None:
+            with tracing_v2_enabled(project_name="TalkYou"):
+                return rag_answer_chain.invoke({
+                    "question": chat_message,
+                    "chat_history": chat_history,
+                    "documents": phrase_documents,
+                    "usage": usage
+                })
+
+        # Answers to follow-up questions depend on the conversation, so only standalone questions use the answer cache
+        use_answer_cache = video_id is not None and not chat_history
+        if use_answer_cache:
+            # The question's embedding is cached, so the retriever below reuses it on a miss
+            query_vector = embedding_model.embed_query(chat_message)
+            cached_answer = answer_cache.lookup(video_id, query_vector)
+            if cached_answer is not None:
+                return cached_answer
+
+        retriever = self._retriever(load_vectorstore(VECTORSTORE_PATH), video_id)
         with tracing_v2_enabled(project_name="TalkYou"):
-            response = rag_chain.invoke({"question": chat_message})
+            documents = retriever.invoke({"question": chat_message})
+            response = rag_answer_chain.invoke(
+                {"question": chat_message, "chat_history": chat_history, "documents": documents, "usage": usage}
+            )
+
+        if use_answer_cache:
+            answer_cache.store(video_id, chat_message, query_vector, response)
 
         return response
 
+    async def _arun(
+            self,
+            chat_message: str,
+            video_id: Optional[str] = None,
+            documents: Optional[List[Document]] = None,
+            chat_history: Optional[str] = None,
+            usage: Optional[Dict[str, int]] = None,
+            run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> str:
+        # Summary questions are answered from the precomputed digest of the video, without retrieval
+        digest = None
+        if VIDEO_DIGEST and video_id is not None:
+            # The digest is read from SQLite, off the event loop
+            digest = await asyncio.to_thread(video_digester.context, video_id, chat_message)
+        if digest is not None:
+            with tracing_v2_enabled(project_name="TalkYou"):
+                return await digest_answer_chain.ainvoke(
+                    {"question": chat_message, "chat_history": chat_history, "digest": digest, "usage": usage}
+                )
+
+        phrase_documents = None
+        if quoted_phrase(chat_message) is not None:
+            phrase_documents = await asyncio.to_thread(self._phrase_documents, chat_message, video_id)
+
+        if phrase_documents is None:
+            # The embedding is requested asynchronously and cached, so the retriever's worker thread never waits on the API
+            query_vector = await embedding_model.aembed_query(chat_message)
+
+        # Answers to follow-up questions depend on the conversation, so only standalone questions use the answer cache
+        # Exact phrase matches are answered without the embedding the answer cache is looked up by
+        use_answer_cache = video_id is not None and not chat_history and phrase_documents is None
+        if use_answer_cache:
+            cached_answer = answer_cache.lookup(video_id, query_vector)
+            if cached_answer is not None:
+                return cached_answer
+
+        if documents is None and phrase_documents is not None:
+            documents = phrase_documents
+
+        with tracing_v2_enabled(project_name="TalkYou"):
+            # Documents passed in were retrieved speculatively while the request was classified
+            if documents is None:
+                retriever = self._retriever(await asyncio.to_thread(load_vectorstore, VECTORSTORE_PATH), video_id)
+                documents = await retriever.ainvoke({"question": chat_message})
+            response = await rag_answer_chain.ainvoke(
+                {"question": chat_message, "chat_history": chat_history, "documents": documents, "usage": usage}
+            )
+
+        if use_answer_cache:
+            answer_cache.store(video_id, chat_message, query_vector, response)
+
+        return response
+
+    async def abatch_answer(
+            self,
+            questions: List[str],
+            video_id: Optional[str] = None,
+            max_concurrency: int = RAG_BATCH_CONCURRENCY
+    ) -> List[str]:
+        """
+        Answers many standalone questions about a video with shared embedding, retrieval and chain runs.
+
+        Description:
+        ------------
+        Questions quoting a phrase of the video are answered from its exact matches, without embedding. The other
+        questions are embedded in one request and looked up in the answer cache. The remaining ones are retrieved for
+        with one hybrid search over the video, whose vector part is a single FAISS search. All answers come from one
+        batch run of the RAG chain with at most `max_concurrency` generations in flight. New answers are cached like
+        the answers of `_arun`.
+
+        Args:
+        ------------
+        questions (List[str]): The questions.
+        video_id (Optional[str]): The YouTube video ID the answers are restricted to. If not provided, the whole corpus
+                                  is searched.
+        max_concurrency (int): The maximum number of answers generated at once.
+
+        Returns:
+        ------------
+        List[str]: The answers, in the order of the questions.
+        """
+        documents: List[Optional[List[Document]]] = await asyncio.to_thread(
+            lambda: [self._phrase_documents(question, video_id) for question in questions]
+        )
+        embedded_positions = [position for position, phrase_documents in enumerate(documents) if phrase_documents is None]
+        query_vectors = dict(zip(
+            embedded_positions,
+            await embedding_model.aembed_queries([questions[position] for position in embedded_positions])
+        ))
+
+        answers: List[Optional[str]] = [None] * len(questions)
+        if video_id is not None:
+            for position, query_vector in query_vectors.items():
+                answers[position] = answer_cache.lookup(video_id, query_vector)
+
+        retrieved_positions = [position for position in embedded_positions if answers[position] is None]
+        if retrieved_positions:
+            vectorstore = await asyncio.to_thread(load_vectorstore, VECTORSTORE_PATH)
+            batch_documents = await asyncio.to_thread(
+                vectorstore.batch_hybrid_search,
+                [questions[position] for position in retrieved_positions],
+                RAG_CANDIDATES,
+                video_id
+            )
+            for position, retrieved_documents in zip(retrieved_positions, batch_documents):
+                documents[position] = retrieved_documents
+
+        positions = [position for position, answer in enumerate(answers) if answer is None]
+        if not positions:
+            return answers
+
+        with tracing_v2_enabled(project_name="TalkYou"):
+            responses = await rag_answer_chain.abatch(
+                [
+                    {"question": questions[position], "chat_history": None, "documents": documents[position]}
+                    for position in positions
+                ],
+                config={"max_concurrency": max_concurrency}
+            )
+
+        for position, response in zip(positions, responses):
+            answers[position] = response
+            if video_id is not None and position in query_vectors:
+                answer_cache.store(video_id, questions[position], query_vectors[position], response)
+
+        return answers
+
 
 transcription_checker = TranscriptionTool()
 video_length_checker = VideoLengthTool()
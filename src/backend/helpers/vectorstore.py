@@ -0,0 +1,1283 @@
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_community.vectorstores import FAISS
+from helpers.constants import (
+    embedding_model,
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_MODEL_REGISTRY,
+    VECTORSTORE_CACHE_MAX_BYTES,
+    COMPACTION_TOMBSTONE_RATIO,
+    INDEX_MAX_SHARDS,
+    FLAT_INDEX_MAX_VECTORS,
+    HNSW_INDEX_MAX_VECTORS,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    IVF_NPROBE,
+    VECTOR_ENCODING,
+    answer_cache,
+    HYBRID_CANDIDATES,
+    RRF_K
+)
+from helpers.index_factory import (
+    choose_index_factory,
+    build_index,
+    set_search_parameters,
+    search_parameters,
+    extract_vectors,
+    reconstruct_vectors,
+    bytes_per_vector
+)
+from helpers.segment_store import SegmentStore, parse_timestamp
+from helpers.timeline import VideoTimeline, build_timeline
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Optional, Dict, Any, Iterator, Iterable, Union, Tuple, List
+import numpy as np
+import threading
+import fcntl
+import faiss
+import json
+import re
+import os
+
+INDEX_FILE = "index.faiss"
+MANIFEST_FILE = "index.json"
+WRITE_LOCK_FILE = "write.lock"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+LEGACY_JSONL_DOCSTORE_FILE = "docstore.jsonl"
+LEGACY_JSONL_OFFSETS_FILE = "docstore.offsets.npy"
+LEGACY_CATALOG_FILE = "videos.json"
+
+
+class VectorstoreCache:
+    """
+    A process-level LRU cache of loaded FAISS vectorstores and video timelines.
+
+    Description:
+    ------------
+    Opening a vectorstore maps the index file and its docstore, which is too slow to repeat on every chat message. The cache keeps loaded vectorstores in memory under an approximate memory budget and evicts the least
+    recently used entries once the budget is exceeded. Entries are replaced whenever an index is rebuilt.
+
+    Attributes:
+    -----------
+    max_bytes : int
+        The memory budget of the cache in bytes.
+
+    Methods:
+    --------
+    get(key: str) -> Optional[FAISS]:
+        Returns the cached vectorstore for the key and marks it as recently used.
+
+    put(key: str, vectorstore: FAISS):
+        Adds or replaces a vectorstore and evicts old entries if the budget is exceeded.
+
+    invalidate(key: str):
+        Drops the cached vectorstore for the key.
+
+    invalidate_prefix(prefix: str):
+        Drops every cached entry whose key starts with the prefix.
+
+    stats() -> Dict[str, Any]:
+        Returns the current size, hit and miss counts of the cache.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def estimate_size(vectorstore: Any) -> int:
+        """
+        Estimates the resident memory of a vectorstore from its vectors and stored texts, or of any value with `nbytes`.
+
+        Parameters:
+        -----------
+        vectorstore : Any
+            The vectorstore whose size is estimated.
+
+        Returns:
+        --------
+        int
+            The approximate size in bytes.
+        """
+        if hasattr(vectorstore, "nbytes"):
+            return vectorstore.nbytes
+
+        index = getattr(vectorstore, "index", None)
+        indexes = ([index] if index is not None else []) + list(getattr(vectorstore, "shards", []))
+        index_bytes = sum(index.ntotal * bytes_per_vector(index) for index in indexes)
+        documents = getattr(getattr(vectorstore, "docstore", None), "_dict", {})
+        text_bytes = sum(len(document.page_content) for document in documents.values())
+        return index_bytes + text_bytes
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: str, vectorstore: Any) -> None:
+        size = self.estimate_size(vectorstore)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = vectorstore
+            self._sizes[key] = size
+
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while sum(self._sizes.values()) > self.max_bytes and len(self._entries) > 1:
+                evicted_key, _ = self._entries.popitem(last=False)
+                del self._sizes[evicted_key]
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            self._sizes.pop(key, None)
+
+    def invalidate_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+                del self._sizes[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(self._sizes.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+class IdentityIds(Mapping):
+    """
+    Maps vector ids to the docstore ids used by `SegmentStore`, which are the same ids, without materializing a dictionary.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def __getitem__(self, vector_id: int) -> str:
+        if not 0 <= vector_id < self.size:
+            raise KeyError(vector_id)
+        return str(vector_id)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.size))
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class CorpusFAISS(FAISS):
+    """
+    A FAISS vectorstore over the shared corpus of all ingested videos.
+
+    Description:
+    ------------
+    Every vector carries an id, and the segment store records the video ID of each id. Passing `video_id` to any
+    similarity search, for instance through `as_retriever(search_kwargs={"video_id": ...})`, restricts the FAISS search
+    itself to the video's ids with an `IDSelector`, instead of searching the whole corpus and filtering afterwards.
+    Searches over the whole corpus exclude the ids of deleted videos until compaction removes their vectors, and skip
+    vectors whose segments are not stored.
+
+    Videos ingested since the last compaction are held in small flat shard indexes next to the main index. Every search
+    runs on the main index and on each shard, and their hits are merged by distance.
+    """
+
+    shards: List[faiss.Index] = []
+    shard_ids: List[np.ndarray] = []
+
+    def video_selector(self, video_id: str) -> Optional[faiss.IDSelector]:
+        video_ids = self.docstore.video_ids(video_id)
+        if len(video_ids) == 0:
+            return None
+
+        if video_ids[-1] - video_ids[0] + 1 == len(video_ids):
+            return faiss.IDSelectorRange(int(video_ids[0]), int(video_ids[-1]) + 1)
+
+        return faiss.IDSelectorBatch(video_ids)
+
+    def vector_search_ids(
+            self,
+            embedding: List[float],
+            k: int,
+            video_id: Optional[str] = None
+    ) -> List[Tuple[int, float]]:
+        return self.batch_vector_search_ids([embedding], k, video_id)[0]
+
+    def batch_vector_search_ids(
+            self,
+            embeddings: List[List[float]],
+            k: int,
+            video_id: Optional[str] = None
+    ) -> List[List[Tuple[int, float]]]:
+        # All queries share the selector and go through one FAISS search over the matrix of their embeddings
+        if video_id is not None:
+            selector = self.video_selector(video_id)
+            if selector is None:
+                return [[] for _ in embeddings]
+        else:
+            tombstoned_ids = self.docstore.tombstoned_ids()
+            if len(tombstoned_ids) == 0:
+                selector = None
+            else:
+                # The batch selector must outlive the search, since `IDSelectorNot` does not own it
+                tombstoned_selector = faiss.IDSelectorBatch(tombstoned_ids)
+                selector = faiss.IDSelectorNot(tombstoned_selector)
+
+        queries = np.array(embeddings, dtype=np.float32)
+        if not self.shards:
+            return self._search_index(self.index, queries, k, selector)
+
+        # A vector merged into the main index while an older shard list was read is kept once, with its best score
+        merged_hits: List[Dict[int, float]] = [{} for _ in embeddings]
+        for index in [self.index] + self.shards:
+            for query_hits, index_hits in zip(merged_hits, self._search_index(index, queries, k, selector)):
+                for vector_id, score in index_hits:
+                    query_hits[vector_id] = min(score, query_hits.get(vector_id, score))
+
+        return [sorted(query_hits.items(), key=lambda hit: hit[1])[:k] for query_hits in merged_hits]
+
+    @staticmethod
+    def _search_index(
+            index: faiss.Index,
+            queries: np.ndarray,
+            k: int,
+            selector: Optional[faiss.IDSelector]
+    ) -> List[List[Tuple[int, float]]]:
+        params = None
+        if selector is not None:
+            params = search_parameters(index, selector, hnsw_ef_search=HNSW_EF_SEARCH, ivf_nprobe=IVF_NPROBE)
+        scores, vector_ids = index.search(queries, k, params=params)
+
+        return [
+            [
+                (int(vector_id), float(score))
+                for score, vector_id in zip(query_scores, query_ids)
+                if vector_id != -1
+            ]
+            for query_scores, query_ids in zip(scores, vector_ids)
+        ]
+
+    def reconstruct(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Reconstructs the vectors stored under the given ids, from the shards holding them or from the main index.
+        """
+        vectors = np.zeros((len(ids), self.index.d), dtype=np.float32)
+        in_main_index = np.ones(len(ids), dtype=bool)
+        for shard, shard_ids in zip(self.shards, self.shard_ids):
+            in_shard = in_main_index & np.isin(ids, shard_ids)
+            if in_shard.any():
+                vectors[in_shard] = reconstruct_vectors(shard, ids[in_shard])
+                in_main_index &= ~in_shard
+
+        vectors[in_main_index] = reconstruct_vectors(self.index, ids[in_main_index])
+        return vectors
+
+    def similarity_search_with_score_by_vector(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Optional[Any] = None,
+            fetch_k: int = 20,
+            video_id: Optional[str] = None,
+            **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        if filter is not None:
+            return super().similarity_search_with_score_by_vector(embedding, k, filter, fetch_k, **kwargs)
+
+        hits = [
+            (self.docstore.search(self.index_to_docstore_id[vector_id]), score)
+            for vector_id, score in self.vector_search_ids(embedding, k, video_id)
+        ]
+        return [(document, score) for document, score in hits if document is not None]
+
+    def documents(
+            self,
+            vector_ids: Iterable[int],
+            k: Optional[int] = None
+    ) -> List[Document]:
+        """
+        Returns the segments of the given vector ids in order, at most `k` of them.
+
+        Description:
+        ------------
+        Vectors are written before their segments are stored, so a search over the whole corpus can return ids whose
+        segments are not stored yet, or never will be after an ingestion stopped in between. Such ids are skipped.
+        """
+        documents = []
+        for vector_id in vector_ids:
+            document = self.docstore.search(str(vector_id))
+            if document is None:
+                continue
+
+            documents.append(document)
+            if len(documents) == k:
+                break
+
+        return documents
+
+    def phrase_search(
+            self,
+            query: str,
+            k: int = 4,
+            video_id: Optional[str] = None
+    ) -> Optional[List[Document]]:
+        """
+        Returns the segments containing the phrase quoted in the query, or None if it quotes none or no segment has it.
+        """
+        phrase = quoted_phrase(query)
+        if phrase is None:
+            return None
+
+        phrase_hits = self.docstore.lexical_search(phrase, k, video_id=video_id, phrase=True)
+        if not phrase_hits:
+            return None
+
+        return self.documents(vector_id for vector_id, _ in phrase_hits)
+
+    def hybrid_search(
+            self,
+            query: str,
+            k: int = 4,
+            video_id: Optional[str] = None
+    ) -> List[Document]:
+        """
+        Retrieves segments by fusing BM25 and vector search, or by exact phrase match alone.
+
+        Description:
+        ------------
+        If the query quotes a phrase, for instance `what does he mean by "gradient checkpointing"`, the segments
+        containing that exact phrase are returned straight from the lexical index, without an embedding request. Otherwise,
+        or if no segment contains the phrase, the best `HYBRID_CANDIDATES` hits of the BM25 index and of the vector index
+        are fused by reciprocal rank, so segments ranked well by either method, and best by both, come first.
+
+        Args:
+        ------------
+        query (str): The user's question.
+        k (int): The number of segments to return.
+        video_id (Optional[str]): The YouTube video ID the search is restricted to. If not provided, the whole corpus is
+                                  searched.
+
+        Returns:
+        ------------
+        List[Document]: The retrieved segments, best first.
+        """
+        phrase_documents = self.phrase_search(query, k, video_id=video_id)
+        if phrase_documents is not None:
+            return phrase_documents
+
+        lexical_hits = self.docstore.lexical_search(query, HYBRID_CANDIDATES, video_id=video_id)
+        vector_hits = self.vector_search_ids(self._embed_query(query), HYBRID_CANDIDATES, video_id=video_id)
+        fused_ids = reciprocal_rank_fusion([lexical_hits, vector_hits], rrf_k=RRF_K)
+
+        return self.documents(fused_ids, k)
+
+    def batch_hybrid_search(
+            self,
+            queries: List[str],
+            k: int = 4,
+            video_id: Optional[str] = None
+    ) -> List[List[Document]]:
+        """
+        Runs `hybrid_search` for many queries with one embedding request and one vector search.
+
+        Description:
+        ------------
+        Queries quoting a phrase that occurs in the segments are answered from the lexical index, as in `hybrid_search`.
+        The remaining queries are embedded together, through the query embedding cache, and searched with a single FAISS
+        search over their embedding matrix. Each query's vector hits are then fused with its BM25 hits.
+
+        Args:
+        ------------
+        queries (List[str]): The users' questions.
+        k (int): The number of segments to return per query.
+        video_id (Optional[str]): The YouTube video ID the search is restricted to. If not provided, the whole corpus is
+                                  searched.
+
+        Returns:
+        ------------
+        List[List[Document]]: The retrieved segments of each query, best first, in the order of the queries.
+        """
+        results = [self.phrase_search(query, k, video_id=video_id) for query in queries]
+
+        positions = [position for position, documents in enumerate(results) if documents is None]
+        if not positions:
+            return results
+
+        embeddings = self.embedding_function.embed_queries([queries[position] for position in positions])
+        batch_vector_hits = self.batch_vector_search_ids(embeddings, HYBRID_CANDIDATES, video_id=video_id)
+        for position, vector_hits in zip(positions, batch_vector_hits):
+            lexical_hits = self.docstore.lexical_search(queries[position], HYBRID_CANDIDATES, video_id=video_id)
+            fused_ids = reciprocal_rank_fusion([lexical_hits, vector_hits], rrf_k=RRF_K)
+            results[position] = self.documents(fused_ids, k)
+
+        return results
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    A LangChain retriever running `CorpusFAISS.hybrid_search`, usable wherever `as_retriever()` was used before.
+    """
+
+    vectorstore: CorpusFAISS
+    k: int = 4
+    video_id: Optional[str] = None
+
+    def _get_relevant_documents(
+            self,
+            query: str,
+            *,
+            run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.vectorstore.hybrid_search(query, k=self.k, video_id=self.video_id)
+
+
+def quoted_phrase(
+        query: str
+) -> Optional[str]:
+    """
+    Returns the first phrase quoted in straight or typographic double quotes, or None if the query quotes nothing.
+    """
+    match = re.search(r'["\u201c]([^"\u201d]+)["\u201d]', query)
+    if match is None or not match.group(1).strip():
+        return None
+
+    return match.group(1).strip()
+
+
+def reciprocal_rank_fusion(
+        rankings: List[List[Tuple[int, float]]],
+        rrf_k: int
+) -> List[int]:
+    """
+    Fuses several rankings of vector ids by reciprocal rank.
+
+    Description:
+    ------------
+    Each id scores 1 / (rrf_k + rank) in every ranking it appears in, and the scores are summed. Only ranks are used,
+    so BM25 scores and L2 distances, which are not comparable, never have to be normalized against each other.
+
+    Args:
+    ------------
+    rankings (List[List[Tuple[int, float]]]): The (id, score) hits of each method, best first.
+    rrf_k (int): The rank offset, larger values flatten the advantage of the top ranks.
+
+    Returns:
+    ------------
+    List[int]: All ids of the rankings, ordered by their fused score.
+    """
+    fused_scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (vector_id, _) in enumerate(ranking, start=1):
+            fused_scores[vector_id] = fused_scores.get(vector_id, 0.0) + 1.0 / (rrf_k + rank)
+
+    return sorted(fused_scores, key=fused_scores.get, reverse=True)
+
+
+vectorstore_cache = VectorstoreCache(max_bytes=VECTORSTORE_CACHE_MAX_BYTES)
+compaction_executor = ThreadPoolExecutor(max_workers=1)
+_corpus_thread_lock = threading.Lock()
+
+
+@contextmanager
+def corpus_write_lock(
+        folder_path: str
+) -> Iterator[None]:
+    """
+    Serializes writes to a corpus folder across the threads of this process and across worker processes.
+
+    Description:
+    ------------
+    Threads of one process queue on a process-level lock, and processes on an exclusive `flock` of the folder's lock
+    file, so two workers never read the same next vector id or overwrite each other's index file. The lock is not
+    reentrant.
+
+    Args:
+    ------------
+    folder_path (str): The corpus folder, created on first use.
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    with _corpus_thread_lock, open(os.path.join(folder_path, WRITE_LOCK_FILE), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def manifest_stamp(
+        folder_path: str
+) -> Optional[Tuple[int, int]]:
+    """
+    Returns the inode and modification time of the folder's manifest, which change whenever any process writes the index.
+    """
+    try:
+        stat = os.stat(os.path.join(folder_path, MANIFEST_FILE))
+    except FileNotFoundError:
+        return None
+
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def get_embedding_dimensions(
+        embedding_model: Any
+) -> int:
+    """
+    Returns the vector size produced by the given embedding model.
+
+    Description:
+    ------------
+    Shortened output sizes requested through `EMBEDDING_DIMENSIONS` are returned as they are. Otherwise the size is looked
+    up in `EMBEDDING_MODEL_REGISTRY` by the model's name, which avoids an embedding request just to learn the dimensions.
+    Models missing from the registry are probed once and the result is added to the registry.
+
+    Args:
+    ------------
+    embedding_model (Any): The embedding model, either an OpenAI or a local sentence embedding model.
+
+    Returns:
+    ------------
+    int: The number of dimensions of the model's embedding vectors.
+    """
+    requested_dimensions = getattr(embedding_model, "dimensions", None)
+    if requested_dimensions:
+        return requested_dimensions
+
+    model_name = getattr(embedding_model, "model", None) or getattr(embedding_model, "model_name", None)
+
+    if model_name not in EMBEDDING_MODEL_REGISTRY:
+        EMBEDDING_MODEL_REGISTRY[model_name] = {
+            "backend": "unknown",
+            "dimensions": len(embedding_model.embed_query("dummy"))
+        }
+
+    return EMBEDDING_MODEL_REGISTRY[model_name]["dimensions"]
+
+
+def fit_index_to_corpus(
+        index: faiss.Index,
+        current_factory: str
+) -> Tuple[faiss.Index, str]:
+    """
+    Rebuilds an index with the index type suited to its number of vectors.
+
+    Description:
+    ------------
+    The index type is chosen by `choose_index_factory` from the configured thresholds. If it differs from the type of the
+    given index, the vectors are reconstructed together with their ids and added to a new `IndexIDMap2`, so vector ids,
+    and with them the docstore ids, stay unchanged.
+
+    Args:
+    ------------
+    index (faiss.Index): The index to fit.
+    current_factory (str): The factory string the index was built with.
+
+    Returns:
+    ------------
+    Tuple[faiss.Index, str]: The fitted index and its factory string.
+    """
+    factory = choose_index_factory(
+        vector_count=index.ntotal,
+        flat_max_vectors=FLAT_INDEX_MAX_VECTORS,
+        hnsw_max_vectors=HNSW_INDEX_MAX_VECTORS,
+        hnsw_m=HNSW_M,
+        encoding=VECTOR_ENCODING
+    )
+
+    if factory == current_factory:
+        return index, current_factory
+
+    print(f"---PROCESS: REBUILDING {current_factory or 'POSITIONAL'} INDEX AS {factory}---")
+    vectors, ids = extract_vectors(index)
+    if ids is None:
+        ids = np.arange(len(vectors))
+
+    fitted_index = build_index(vectors, factory, hnsw_ef_construction=HNSW_EF_CONSTRUCTION, ids=ids)
+    return fitted_index, factory
+
+
+def write_index(
+        index: faiss.Index,
+        factory: str,
+        folder_path: str,
+        next_id: int
+) -> None:
+    """
+    Atomically writes an index file and its manifest to the folder.
+
+    Description:
+    ------------
+    The manifest is replaced last, so a reader that sees a new manifest also sees the index it describes. It records
+    the next vector id, since the index is written before the segments of its new vectors are stored. The written
+    index holds every vector of the corpus, so the manifest lists no shards.
+
+    Args:
+    ------------
+    index (faiss.Index): The index to write.
+    factory (str): The factory string the index was built with.
+    folder_path (str): The folder the index is written to.
+    next_id (int): The smallest vector id that is not used by the index nor by the segment store.
+
+    Returns:
+    ------------
+    None
+    """
+    index_path = os.path.join(folder_path, INDEX_FILE)
+    faiss.write_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+
+    manifest = {
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "factory": factory,
+        "dimensions": index.d,
+        "count": index.ntotal,
+        "next_id": next_id,
+        "is_ivf": faiss.try_extract_index_ivf(index) is not None,
+        "shards": []
+    }
+    write_json(manifest, os.path.join(folder_path, MANIFEST_FILE))
+
+
+def write_shard(
+        vectors: np.ndarray,
+        ids: np.ndarray,
+        folder_path: str,
+        manifest: Dict[str, Any]
+) -> None:
+    """
+    Writes the vectors of one ingestion as a flat shard index and adds the shard to the manifest.
+
+    Description:
+    ------------
+    Appending to the corpus only writes the new vectors, instead of reading and rewriting the whole main index. The
+    shards are merged into the main index by the next compaction.
+
+    Args:
+    ------------
+    vectors (np.ndarray): A float32 array of shape (count, dimensions).
+    ids (np.ndarray): The int64 ids of the vectors.
+    folder_path (str): The corpus folder.
+    manifest (Dict[str, Any]): The current manifest of the corpus.
+
+    Returns:
+    ------------
+    None
+    """
+    shard_file = f"shard-{int(ids[0])}.faiss"
+    shard = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+    shard.add_with_ids(vectors, ids)
+
+    shard_path = os.path.join(folder_path, shard_file)
+    faiss.write_index(shard, shard_path + ".tmp")
+    os.replace(shard_path + ".tmp", shard_path)
+
+    write_json(
+        {
+            **manifest,
+            "count": manifest["count"] + len(ids),
+            "next_id": int(ids[-1]) + 1,
+            "shards": manifest.get("shards", []) + [shard_file]
+        },
+        os.path.join(folder_path, MANIFEST_FILE)
+    )
+
+
+def read_corpus_index(
+        folder_path: str
+) -> faiss.Index:
+    """
+    Reads the main index of a corpus into memory, with the vectors of its shards added to it.
+    """
+    index = faiss.read_index(os.path.join(folder_path, INDEX_FILE))
+    for shard_file in read_manifest(folder_path).get("shards", []):
+        vectors, ids = extract_vectors(faiss.read_index(os.path.join(folder_path, shard_file)))
+        index.add_with_ids(vectors, ids)
+
+    return index
+
+
+def remove_shards(
+        folder_path: str,
+        shard_files: List[str]
+) -> None:
+    # Processes still searching a removed shard keep it mapped until they load the merged index
+    for shard_file in shard_files:
+        if os.path.exists(os.path.join(folder_path, shard_file)):
+            os.remove(os.path.join(folder_path, shard_file))
+
+
+def write_json(
+        content: Any,
+        file_path: str
+) -> None:
+    with open(file_path + ".tmp", "w", encoding="utf-8") as json_file:
+        json.dump(content, json_file)
+    os.replace(file_path + ".tmp", file_path)
+
+
+def read_manifest(
+        folder_path: str
+) -> Dict[str, Any]:
+    """
+    Reads the manifest describing the index saved in the folder.
+
+    Args:
+    ------------
+    folder_path (str): The folder the index was written to.
+
+    Returns:
+    ------------
+    Dict[str, Any]: The manifest, including the embedding model, factory string, dimensions and vector count.
+    """
+    with open(os.path.join(folder_path, MANIFEST_FILE), "r", encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+
+    # Manifests written before index selection existed always describe flat indexes
+    manifest.setdefault("factory", "Flat")
+    return manifest
+
+
+def has_legacy_layout(
+        folder_path: str
+) -> bool:
+    return not os.path.exists(os.path.join(folder_path, MANIFEST_FILE)) and os.path.exists(
+        os.path.join(folder_path, LEGACY_DOCSTORE_FILE)
+    )
+
+
+def has_legacy_jsonl_docstore(
+        folder_path: str
+) -> bool:
+    return os.path.exists(os.path.join(folder_path, LEGACY_JSONL_OFFSETS_FILE))
+
+
+def to_segment(
+        document: Document
+) -> Document:
+    """
+    Moves the metadata of a document written by a former layout into the columns of the segment store.
+
+    Args:
+    ------------
+    document (Document): A document whose metadata may hold a "video_id" and a caption "timestamp".
+
+    Returns:
+    ------------
+    Document: The document with "video_id", "start" and "end" metadata. Documents ingested before the shared corpus
+              existed carry an empty video ID.
+    """
+    timestamp = document.metadata.get("timestamp")
+    return Document(
+        page_content=document.page_content,
+        metadata={
+            "video_id": document.metadata.get("video_id", ""),
+            "start": parse_timestamp(timestamp) if timestamp is not None else None,
+            "end": None
+        }
+    )
+
+
+def convert_legacy_vectorstore(
+        folder_path: str
+) -> None:
+    """
+    Converts a folder written by the former pickled `save_local` layout into the corpus layout.
+
+    Args:
+    ------------
+    folder_path (str): The folder holding `index.faiss` and `index.pkl`.
+
+    Returns:
+    ------------
+    None
+    """
+    legacy_vectorstore = FAISS.load_local(
+        folder_path=folder_path,
+        embeddings=embedding_model,
+        allow_dangerous_deserialization=True
+    )
+    documents = [
+        to_segment(legacy_vectorstore.docstore.search(legacy_vectorstore.index_to_docstore_id[position]))
+        for position in range(legacy_vectorstore.index.ntotal)
+    ]
+    SegmentStore(folder_path).insert(list(range(len(documents))), documents)
+
+    # An empty current factory forces a rebuild, which wraps the positional index in an `IndexIDMap2`
+    index, factory = fit_index_to_corpus(legacy_vectorstore.index, current_factory="")
+    write_index(index, factory, folder_path, next_id=len(documents))
+    os.remove(os.path.join(folder_path, LEGACY_DOCSTORE_FILE))
+
+
+def convert_legacy_jsonl_docstore(
+        folder_path: str
+) -> None:
+    """
+    Moves the documents of the former JSON lines docstore into the segment store and removes its files.
+
+    Args:
+    ------------
+    folder_path (str): The corpus folder holding `docstore.jsonl` and `docstore.offsets.npy`.
+
+    Returns:
+    ------------
+    None
+    """
+    offsets_path = os.path.join(folder_path, LEGACY_JSONL_OFFSETS_FILE)
+    docstore_path = os.path.join(folder_path, LEGACY_JSONL_DOCSTORE_FILE)
+
+    with open(docstore_path, "r", encoding="utf-8") as docstore_file:
+        records = [json.loads(line) for line in docstore_file]
+
+    documents = [
+        to_segment(Document(page_content=record["page_content"], metadata=record["metadata"]))
+        for record in records[:len(np.load(offsets_path))]
+    ]
+    SegmentStore(folder_path).insert(list(range(len(documents))), documents)
+
+    for file_name in (LEGACY_JSONL_OFFSETS_FILE, LEGACY_JSONL_DOCSTORE_FILE, LEGACY_CATALOG_FILE):
+        if os.path.exists(os.path.join(folder_path, file_name)):
+            os.remove(os.path.join(folder_path, file_name))
+
+
+def convert_legacy_layouts(
+        folder_path: str
+) -> None:
+    if has_legacy_layout(folder_path):
+        convert_legacy_vectorstore(folder_path)
+
+    if has_legacy_jsonl_docstore(folder_path):
+        convert_legacy_jsonl_docstore(folder_path)
+
+
+def read_vectorstore(
+        folder_path: str
+) -> CorpusFAISS:
+    """
+    Opens a corpus vectorstore memory-mapped and read-only.
+
+    Description:
+    ------------
+    The vectors are mapped from the index file instead of being read into process memory, so several worker processes
+    serving the same folder share a single copy through the page cache. IVF indexes map their inverted lists, all other
+    indexes map their flat code arrays. The configured HNSW and IVF search parameters are applied to the loaded index.
+    Segments are only read from the segment store when a query returns them. The shards listed in the manifest are
+    mapped as well. The vectorstore remembers the manifest stamp it was read at, so `load_vectorstore` can tell when
+    another process has rewritten the index.
+
+    Args:
+    ------------
+    folder_path (str): The corpus folder.
+
+    Returns:
+    ------------
+    CorpusFAISS: A read-only corpus vectorstore backed by the mapped files.
+    """
+    if has_legacy_layout(folder_path) or has_legacy_jsonl_docstore(folder_path):
+        with corpus_write_lock(folder_path):
+            convert_legacy_layouts(folder_path)
+
+    for attempt in range(2):
+        # The stamp is taken first, so an index written while this one is read is picked up by the next load
+        stamp = manifest_stamp(folder_path)
+        manifest = read_manifest(folder_path)
+        io_flags = faiss.IO_FLAG_MMAP if manifest["is_ivf"] else faiss.IO_FLAG_MMAP_IFC
+        index = faiss.read_index(os.path.join(folder_path, INDEX_FILE), io_flags | faiss.IO_FLAG_READ_ONLY)
+        set_search_parameters(index, hnsw_ef_search=HNSW_EF_SEARCH, ivf_nprobe=IVF_NPROBE)
+        try:
+            shards = [
+                faiss.read_index(os.path.join(folder_path, shard_file), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+                for shard_file in manifest.get("shards", [])
+            ]
+            break
+        except RuntimeError:
+            # A compaction merged and removed the shards after the manifest was read, the new manifest lists none
+            if attempt == 1:
+                raise
+
+    docstore = SegmentStore(folder_path)
+
+    vectorstore = CorpusFAISS(
+        embedding_function=embedding_model,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=IdentityIds(manifest.get("next_id", len(docstore))),
+        normalize_L2=False
+    )
+    vectorstore.manifest_stamp = stamp
+    vectorstore.shards = shards
+    vectorstore.shard_ids = [faiss.vector_to_array(shard.id_map) for shard in shards]
+    return vectorstore
+
+
+def load_vectorstore(
+        folder_path: str
+) -> CorpusFAISS:
+    """
+    Loads a corpus vectorstore, serving it from the process-level cache when possible.
+
+    Description:
+    ------------
+    The first call for a folder maps the index from disk. Later calls return the cached instance after comparing the
+    manifest stamp, a single `stat`. If another worker process has rewritten the index since, the cached vectorstore and
+    the timelines of the folder are dropped and the new index is mapped.
+
+    Args:
+    ------------
+    folder_path (str): The corpus folder, which also serves as its cache key.
+
+    Returns:
+    ------------
+    CorpusFAISS: The loaded corpus vectorstore.
+    """
+    cache_key = os.path.normpath(folder_path)
+    vectorstore = vectorstore_cache.get(cache_key)
+
+    if vectorstore is not None and vectorstore.manifest_stamp != manifest_stamp(folder_path):
+        vectorstore_cache.invalidate_prefix(cache_key + "#")
+        vectorstore_cache.invalidate(cache_key)
+        vectorstore = None
+
+    if vectorstore is None:
+        vectorstore = read_vectorstore(folder_path)
+        vectorstore_cache.put(cache_key, vectorstore)
+
+    return vectorstore
+
+
+def timeline_cache_key(
+        folder_path: str,
+        video_id: str
+) -> str:
+    return f"{os.path.normpath(folder_path)}#timeline#{video_id}"
+
+
+def load_video_timeline(
+        folder_path: str,
+        video_id: str
+) -> VideoTimeline:
+    """
+    Loads the caption embeddings of a video as a contiguous, time-ordered array, serving it from the cache when possible.
+
+    Description:
+    ------------
+    The vectors are reconstructed from the corpus index by the video's ids once, and the timeline is kept in the same
+    LRU cache as the vectorstores, under the same memory budget. Ingesting or deleting the video drops its timeline.
+
+    Args:
+    ------------
+    folder_path (str): The corpus folder of the caption lines.
+    video_id (str): The YouTube video ID.
+
+    Returns:
+    ------------
+    VideoTimeline: The timeline of the video, empty if the corpus holds no segments of it.
+    """
+    # Loading the vectorstore first drops the timelines of an index another process has rewritten
+    vectorstore = load_vectorstore(folder_path)
+    cache_key = timeline_cache_key(folder_path, video_id)
+    timeline = vectorstore_cache.get(cache_key)
+
+    if timeline is None:
+        segment_times = vectorstore.docstore.video_times(video_id)
+        ids = np.array([vector_id for vector_id, _, _ in segment_times], dtype=np.int64)
+        timeline = build_timeline(
+            ids=ids,
+            starts=[start for _, start, _ in segment_times],
+            ends=[end for _, _, end in segment_times],
+            vectors=vectorstore.reconstruct(ids)
+        )
+        vectorstore_cache.put(cache_key, timeline)
+
+    return timeline
+
+
+def corpus_contains(
+        folder_path: str,
+        video_id: str
+) -> bool:
+    """
+    Checks whether a video has already been ingested into the corpus.
+
+    Args:
+    ------------
+    folder_path (str): The corpus folder.
+    video_id (str): The YouTube video ID.
+
+    Returns:
+    ------------
+    bool: `True` if the corpus holds vectors of the video, `False` otherwise.
+    """
+    if not os.path.exists(os.path.join(folder_path, MANIFEST_FILE)):
+        return False
+
+    return load_vectorstore(folder_path).docstore.has_video(video_id)
+
+
+def add_documents_to_corpus(
+        folder_path: str,
+        documents: List[Document],
+        video_id: str,
+        replace: bool = False
+) -> List[int]:
+    """
+    Embeds documents of a video and appends them to the shared corpus.
+
+    Description:
+    ------------
+    The documents are tagged with the video ID, embedded in one batch and added under fresh vector ids. The vectors are
+    written as a new shard of the corpus, so the main index is neither read into memory nor rewritten, and the shards
+    are merged into it by the next compaction. The first ingestion writes the main index itself. Vectors are written
+    before the ids are recorded in the segment store, so any process that sees the new segments also finds their
+    vectors. The cached copy of the corpus is then replaced by the new one.
+    Writes are serialized across threads and worker processes, so concurrent ingestions never lose each other's ids.
+    Appending extends the segments a video already has, for instance with the rest of a partial transcript. Replacing
+    tombstones them once the new segments are searchable, which is how a re-scraped video is updated in place. Either
+    way the cached answers about the video are dropped. Without documents nothing is embedded or written, and replacing
+    only tombstones the video's segments.
+
+    Args:
+    ------------
+    folder_path (str): The corpus folder, created on first use.
+    documents (List[Document]): The documents of the video, optionally carrying "start" and "end" metadata in seconds.
+    video_id (str): The YouTube video ID.
+    replace (bool): Whether the documents replace the segments the video already has in the corpus.
+
+    Returns:
+    ------------
+    List[int]: The vector ids assigned to the documents, empty if there are none.
+    """
+    if not documents:
+        # A video without caption lines or speech has nothing to embed, replacing still removes its old segments
+        if replace:
+            delete_video_from_corpus(folder_path, video_id)
+        return []
+
+    for document in documents:
+        document.metadata["video_id"] = video_id
+
+    vectors = np.array(
+        embedding_model.embed_documents([document.page_content for document in documents]),
+        dtype=np.float32
+    )
+
+    with corpus_write_lock(folder_path):
+        convert_legacy_layouts(folder_path)
+        segment_store = SegmentStore(folder_path)
+        start_id = segment_store.next_id()
+
+        manifest = None
+        if os.path.exists(os.path.join(folder_path, MANIFEST_FILE)):
+            manifest = read_manifest(folder_path)
+            # Ids of vectors written by an ingestion that stopped before storing its segments are not reused
+            start_id = max(start_id, manifest.get("next_id", 0))
+            if manifest["dimensions"] != vectors.shape[1]:
+                raise ValueError(
+                    f"The corpus at {folder_path} holds {manifest['dimensions']}-dimensional vectors, but the embedding "
+                    f"model returns {vectors.shape[1]} dimensions, ingest into a new folder after changing the model or "
+                    f"its dimensions"
+                )
+        ids = np.arange(start_id, start_id + len(documents), dtype=np.int64)
+
+        if manifest is not None and isinstance(load_vectorstore(folder_path).index, faiss.IndexIDMap2):
+            write_shard(vectors, ids, folder_path, manifest)
+        else:
+            if manifest is not None:
+                # Indexes written before the shared corpus existed are positional, an empty factory forces a rewrap
+                index, factory = fit_index_to_corpus(
+                    faiss.read_index(os.path.join(folder_path, INDEX_FILE)), current_factory=""
+                )
+            else:
+                factory = "Flat"
+                index = faiss.IndexIDMap2(faiss.IndexFlatL2(get_embedding_dimensions(embedding_model)))
+
+            index.add_with_ids(vectors, ids)
+            index, factory = fit_index_to_corpus(index, factory)
+            write_index(index, factory, folder_path, next_id=start_id + len(documents))
+
+        segment_store.insert(ids.tolist(), documents)
+
+        vectorstore_cache.put(os.path.normpath(folder_path), read_vectorstore(folder_path))
+        if replace:
+            segment_store.tombstone(video_id, before_id=start_id)
+        vectorstore_cache.invalidate(timeline_cache_key(folder_path, video_id))
+        answer_cache.invalidate(video_id)
+
+    schedule_compaction(folder_path)
+    return ids.tolist()
+
+
+def delete_video_from_corpus(
+        folder_path: str,
+        video_id: str
+) -> int:
+    """
+    Removes a video from the shared corpus.
+
+    Description:
+    ------------
+    The video's segments are tombstoned, which hides them from every search right away without touching the index file.
+    Their vectors are removed by the next compaction, which is scheduled in the background once enough of the corpus is
+    tombstoned. The cached answers about the video are dropped as well.
+
+    Args:
+    ------------
+    folder_path (str): The corpus folder.
+    video_id (str): The YouTube video ID.
+
+    Returns:
+    ------------
+    int: The number of tombstoned segments, 0 if the corpus holds no segments of the video.
+    """
+    if not os.path.exists(os.path.join(folder_path, MANIFEST_FILE)):
+        return 0
+
+    with corpus_write_lock(folder_path):
+        tombstoned_count = load_vectorstore(folder_path).docstore.tombstone(video_id)
+        vectorstore_cache.invalidate(timeline_cache_key(folder_path, video_id))
+        answer_cache.invalidate(video_id)
+
+    if tombstoned_count:
+        schedule_compaction(folder_path)
+
+    return tombstoned_count
+
+
+def compact_corpus(
+        folder_path: str
+) -> int:
+    """
+    Merges the shards of the corpus into its main index and removes the vectors of tombstoned segments.
+
+    Description:
+    ------------
+    Without tombstoned segments, the shard vectors are added to the main index, which is rebuilt only if the corpus has
+    outgrown its index type. Otherwise the remaining vectors are rebuilt into the index type suited to the live corpus
+    size. Either way the vectors keep their ids, so the mapping from vector ids to segments stays valid and nothing else
+    has to be rewritten. The compacted index replaces the cached copy, and readers keep searching the previous one
+    until then.
+
+    Args:
+    ------------
+    folder_path (str): The corpus folder.
+
+    Returns:
+    ------------
+    int: The number of vectors removed from the index.
+    """
+    with corpus_write_lock(folder_path):
+        convert_legacy_layouts(folder_path)
+        if not os.path.exists(os.path.join(folder_path, MANIFEST_FILE)):
+            return 0
+
+        manifest = read_manifest(folder_path)
+        segment_store = SegmentStore(folder_path)
+        tombstoned_ids = segment_store.tombstoned_ids()
+        if len(tombstoned_ids) == 0 and not manifest.get("shards"):
+            return 0
+
+        print(f"---PROCESS: COMPACTING {folder_path}---")
+        index = read_corpus_index(folder_path)
+        removed_count = 0
+        if len(tombstoned_ids) == 0:
+            index, factory = fit_index_to_corpus(index, manifest["factory"])
+        else:
+            vectors, ids = extract_vectors(index)
+            if ids is None:
+                ids = np.arange(len(vectors))
+            keep = ~np.isin(ids, tombstoned_ids)
+            removed_count = int((~keep).sum())
+            factory = choose_index_factory(
+                vector_count=int(keep.sum()),
+                flat_max_vectors=FLAT_INDEX_MAX_VECTORS,
+                hnsw_max_vectors=HNSW_INDEX_MAX_VECTORS,
+                hnsw_m=HNSW_M,
+                encoding=VECTOR_ENCODING
+            )
+
+            if keep.any():
+                index = build_index(vectors[keep], factory, hnsw_ef_construction=HNSW_EF_CONSTRUCTION, ids=ids[keep])
+            else:
+                index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+
+        write_index(index, factory, folder_path, next_id=max(manifest.get("next_id", 0), segment_store.next_id()))
+        vectorstore_cache.put(os.path.normpath(folder_path), read_vectorstore(folder_path))
+        segment_store.mark_compacted(tombstoned_ids)
+        remove_shards(folder_path, manifest.get("shards", []))
+
+    return removed_count
+
+
+def schedule_compaction(
+        folder_path: str
+) -> bool:
+    """
+    Compacts the corpus in the background once the share of tombstoned segments reaches `COMPACTION_TOMBSTONE_RATIO`,
+    or once it has `INDEX_MAX_SHARDS` shards.
+
+    Args:
+    ------------
+    folder_path (str): The corpus folder.
+
+    Returns:
+    ------------
+    bool: `True` if a compaction was scheduled, `False` otherwise.
+    """
+    stats = SegmentStore(folder_path).stats()
+    indexed_count = stats["segments"] + stats["tombstoned"]
+    tombstoned = indexed_count > 0 and stats["tombstoned"] / indexed_count >= COMPACTION_TOMBSTONE_RATIO
+    sharded = len(read_manifest(folder_path).get("shards", [])) >= INDEX_MAX_SHARDS
+    if not (tombstoned or sharded):
+        return False
+
+    compaction_executor.submit(compact_corpus, folder_path)
+    return True
+
+
+def upgrade_vectorstore(
+        folder_path: str
+) -> str:
+    """
+    Migrates a saved corpus to the index type suited to its current size.
+
+    Description:
+    ------------
+    Indexes written before index selection existed, or whose corpus has outgrown their index type, are rebuilt in place.
+    Pending shards are merged into the rebuilt index. The segment store is left untouched, since the rebuilt index keeps
+    every vector id.
+
+    Args:
+    ------------
+    folder_path (str): The corpus folder.
+
+    Returns:
+    ------------
+    str: The factory string of the index after the upgrade.
+    """
+    with corpus_write_lock(folder_path):
+        convert_legacy_layouts(folder_path)
+        manifest = read_manifest(folder_path)
+        index = read_corpus_index(folder_path)
+
+        fitted_index, factory = fit_index_to_corpus(index, manifest["factory"])
+        if factory != manifest["factory"] or manifest.get("shards"):
+            next_id = max(manifest.get("next_id", 0), SegmentStore(folder_path).next_id())
+            write_index(fitted_index, factory, folder_path, next_id=next_id)
+            vectorstore_cache.put(os.path.normpath(folder_path), read_vectorstore(folder_path))
+            remove_shards(folder_path, manifest.get("shards", []))
+
+    return factory
@@ -0,0 +1,338 @@
+from langchain_core.runnables import Runnable
+from helpers.vectorstore import load_vectorstore
+from helpers.metrics import metrics
+from typing import Optional, List, Dict, Any, Tuple, Set
+import threading
+import asyncio
+import sqlite3
+import time
+import os
+import re
+
+DIGEST_DATABASE_FILE = "digests.sqlite"
+
+# Digest levels, the overview summarizes the sections and each section summarizes consecutive windows
+OVERVIEW = 0
+SECTION = 1
+WINDOW = 2
+
+# Questions asking for the gist of the video, or of one of its numbered sections, are answered from the digest
+SUMMARY_PATTERN = re.compile(
+    r"\b(summar\w*|overview|tl;?dr|gist|recap|outline|main (points|ideas|topics)|key (points|takeaways)"
+    r"|what is (this|the) video about|what'?s (this|the) video about|what is it about)\b",
+    re.IGNORECASE
+)
+SECTION_PATTERN = re.compile(r"\b(?:section|part|chapter)\s+(\d+)\b", re.IGNORECASE)
+
+
+def _format_time(seconds: Optional[float]) -> str:
+    seconds = int(seconds or 0)
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+class DigestStore:
+    """
+    The precomputed summaries of every ingested video, kept in SQLite next to the transcription index.
+
+    Description:
+    ------------
+    Every summary is one row of the `digests` table holding its video ID, its level (overview, section or window), its
+    position within the level, its start and end in seconds and its text. Storing a digest replaces the previous digest
+    of the video in one transaction, so readers never see a partial one.
+
+    Attributes:
+    -----------
+    folder_path : str
+        The corpus folder the digest database is stored in.
+
+    Methods:
+    --------
+    replace(video_id: str, entries: List[Dict[str, Any]]):
+        Stores the digest of a video, replacing its previous digest.
+
+    load(video_id: str) -> List[Dict[str, Any]]:
+        Returns the digest entries of a video ordered by level and position, empty if it has none.
+
+    delete(video_id: str) -> int:
+        Drops the digest of a video and returns the number of removed entries.
+    """
+
+    def __init__(self, folder_path: str):
+        self.folder_path = folder_path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # The corpus folder is created by the first ingestion, so the database is opened on first use
+        if self._connection is None:
+            os.makedirs(self.folder_path, exist_ok=True)
+            self._connection = sqlite3.connect(
+                os.path.join(self.folder_path, DIGEST_DATABASE_FILE),
+                check_same_thread=False
+            )
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS digests (
+                    video_id TEXT NOT NULL,
+                    level INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    start REAL,
+                    end REAL,
+                    text TEXT NOT NULL,
+                    PRIMARY KEY (video_id, level, position)
+                )
+                """
+            )
+            self._connection.commit()
+
+        return self._connection
+
+    def replace(self, video_id: str, entries: List[Dict[str, Any]]) -> None:
+        with self._lock, self._connect() as connection:
+            connection.execute("DELETE FROM digests WHERE video_id = ?", (video_id,))
+            connection.executemany(
+                "INSERT INTO digests (video_id, level, position, start, end, text) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (video_id, entry["level"], entry["position"], entry["start"], entry["end"], entry["text"])
+                    for entry in entries
+                ]
+            )
+
+    def load(self, video_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT level, position, start, end, text FROM digests WHERE video_id = ? ORDER BY level, position",
+                (video_id,)
+            ).fetchall()
+
+        return [
+            {"level": level, "position": position, "start": start, "end": end, "text": text}
+            for level, position, start, end, text in rows
+        ]
+
+    def delete(self, video_id: str) -> int:
+        with self._lock, self._connect() as connection:
+            return connection.execute("DELETE FROM digests WHERE video_id = ?", (video_id,)).rowcount
+
+
+class VideoDigester:
+    """
+    Builds a hierarchical summary of every ingested video and answers summary questions from it.
+
+    Description:
+    ------------
+    The timed caption lines of a video are grouped into windows of `window_seconds`, and every window is summarized.
+    Consecutive windows are grouped into sections of `windows_per_section`, each summarized from its window summaries,
+    and the section summaries are summarized into an overview. All summaries are generated with one batch run per
+    level, with at most `max_concurrency` calls in flight, and stored with the video's index in a `DigestStore`.
+
+    After ingestion the digest is built in the background, so indexing is not delayed, and videos ingested earlier can be
+    digested on demand. Questions asking what the video is about, or for a summary, are given the overview and the
+    section summaries. Questions naming a section, such as "summarize section 2", are given that section and its window
+    summaries. In both cases the prompt is a small fraction of a retrieval context. Other questions, and all questions
+    about videos whose digest is not ready, go through retrieval as before.
+
+    Attributes:
+    -----------
+    summarizer : Runnable
+        The chain turning a dict of "text", "start", "end" and "max_tokens" into a summary.
+    store : DigestStore
+        The store of the digests.
+    captions_path : str
+        The corpus folder of the timed caption lines.
+    window_seconds : float
+        The length of a window in seconds.
+    windows_per_section : int
+        The number of windows summarized together into a section.
+    summary_tokens : int
+        The token budget of every summary.
+    max_concurrency : int
+        The maximum number of summaries generated at once.
+
+    Methods:
+    --------
+    abuild(video_id: str) -> List[Dict[str, Any]]:
+        Builds, stores and returns the digest of an ingested video.
+
+    schedule(video_id: str):
+        Builds the digest of a video in the background.
+
+    context(video_id: str, question: str) -> Optional[str]:
+        Returns the digest text answering a summary question, or None if retrieval should answer it.
+
+    stats() -> Dict[str, Any]:
+        Returns the number of digests built, failed and in progress, and the mean build time.
+    """
+
+    def __init__(
+            self,
+            summarizer: Runnable,
+            store: DigestStore,
+            captions_path: str,
+            window_seconds: float = 120.0,
+            windows_per_section: int = 5,
+            summary_tokens: int = 200,
+            max_concurrency: int = 4
+    ):
+        self.summarizer = summarizer
+        self.store = store
+        self.captions_path = captions_path
+        self.window_seconds = window_seconds
+        self.windows_per_section = windows_per_section
+        self.summary_tokens = summary_tokens
+        self.max_concurrency = max_concurrency
+        self._building: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _captions(self, video_id: str) -> List[Tuple[float, Optional[float], str]]:
+        docstore = load_vectorstore(self.captions_path).docstore
+        return [
+            (start or 0.0, end, docstore.search(str(vector_id)).page_content)
+            for vector_id, start, end in sorted(docstore.video_times(video_id), key=lambda row: row[1] or 0.0)
+        ]
+
+    def _windows(self, captions: List[Tuple[float, Optional[float], str]]) -> List[Dict[str, Any]]:
+        windows: Dict[int, Dict[str, Any]] = {}
+        for start, end, text in captions:
+            window = windows.setdefault(
+                int(start // self.window_seconds), {"start": start, "end": end or start, "lines": []}
+            )
+            window["end"] = max(window["end"], end or start)
+            window["lines"].append(text.strip())
+
+        return [
+            {"start": window["start"], "end": window["end"], "text": " ".join(window["lines"])}
+            for _, window in sorted(windows.items())
+        ]
+
+    async def _summarize(self, parts: List[Dict[str, Any]]) -> List[str]:
+        return await self.summarizer.abatch(
+            [
+                {
+                    "text": part["text"],
+                    "start": _format_time(part["start"]),
+                    "end": _format_time(part["end"]),
+                    "max_tokens": self.summary_tokens
+                }
+                for part in parts
+            ],
+            config={"max_concurrency": self.max_concurrency}
+        )
+
+    @staticmethod
+    def _entries(level: int, parts: List[Dict[str, Any]], summaries: List[str]) -> List[Dict[str, Any]]:
+        return [
+            {"level": level, "position": position, "start": part["start"], "end": part["end"], "text": summary}
+            for position, (part, summary) in enumerate(zip(parts, summaries))
+        ]
+
+    async def abuild(self, video_id: str) -> List[Dict[str, Any]]:
+        start = time.perf_counter()
+        captions = await asyncio.to_thread(self._captions, video_id)
+        if not captions:
+            raise ValueError(f"No timed captions of the video {video_id} are ingested")
+
+        windows = self._windows(captions)
+        window_summaries = await self._summarize(windows)
+
+        sections = []
+        for first in range(0, len(windows), self.windows_per_section):
+            grouped = list(range(first, min(first + self.windows_per_section, len(windows))))
+            sections.append({
+                "start": windows[grouped[0]]["start"],
+                "end": windows[grouped[-1]]["end"],
+                "text": "\n".join(
+                    f"[{_format_time(windows[i]['start'])} - {_format_time(windows[i]['end'])}] {window_summaries[i]}"
+                    for i in grouped
+                )
+            })
+        section_summaries = await self._summarize(sections)
+
+        overview = {
+            "start": windows[0]["start"],
+            "end": windows[-1]["end"],
+            "text": "\n".join(
+                f"[{_format_time(section['start'])} - {_format_time(section['end'])}] {summary}"
+                for section, summary in zip(sections, section_summaries)
+            )
+        }
+        # The only section of a short video already is its overview
+        overview_summaries = section_summaries if len(sections) == 1 else await self._summarize([overview])
+
+        entries = (
+            self._entries(OVERVIEW, [overview], overview_summaries)
+            + self._entries(SECTION, sections, section_summaries)
+            + self._entries(WINDOW, windows, window_summaries)
+        )
+        await asyncio.to_thread(self.store.replace, video_id, entries)
+        metrics.observe("video_digest.build", (time.perf_counter() - start) * 1000)
+        metrics.increment("video_digest.built")
+        return entries
+
+    async def _build_in_background(self, video_id: str) -> None:
+        try:
+            entries = await self.abuild(video_id)
+            print(f"---PROCESS: DIGEST OF {video_id} READY WITH {len(entries)} SUMMARIES---")
+
+        except Exception as err:
+            metrics.increment("video_digest.failures")
+            print(f"---WARNING: DIGEST OF {video_id} FAILED -> {err}---")
+
+        finally:
+            self._building.discard(video_id)
+
+    def schedule(self, video_id: str) -> None:
+        if video_id in self._building:
+            return
+
+        self._building.add(video_id)
+        task = asyncio.ensure_future(self._build_in_background(video_id))
+        # The event loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def context(self, video_id: str, question: str) -> Optional[str]:
+        section_match = SECTION_PATTERN.search(question)
+        if section_match is None and SUMMARY_PATTERN.search(question) is None:
+            return None
+
+        entries = self.store.load(video_id)
+        if not entries:
+            return None
+
+        levels = {level: [entry for entry in entries if entry["level"] == level] for level in (OVERVIEW, SECTION, WINDOW)}
+
+        def render(entry: Dict[str, Any], label: str) -> str:
+            return f"{label} [{_format_time(entry['start'])} - {_format_time(entry['end'])}]:\n{entry['text']}"
+
+        if section_match is not None:
+            position = int(section_match.group(1)) - 1
+            if not 0 <= position < len(levels[SECTION]):
+                return None
+
+            section = levels[SECTION][position]
+            windows = [
+                window for window in levels[WINDOW] if section["start"] <= window["start"] and window["end"] <= section["end"]
+            ]
+            metrics.increment("video_digest.section_answers")
+            return "\n\n".join(
+                [render(section, f"Section {position + 1} of {len(levels[SECTION])}")]
+                + [render(window, "Part") for window in windows]
+            )
+
+        metrics.increment("video_digest.overview_answers")
+        return "\n\n".join(
+            [render(levels[OVERVIEW][0], "Whole video")]
+            + [render(section, f"Section {position + 1}") for position, section in enumerate(levels[SECTION])]
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        counters = metrics.snapshot()["counters"]
+        return {
+            "built": counters.get("video_digest.built", 0),
+            "failures": counters.get("video_digest.failures", 0),
+            "building": len(self._building),
+            "overview_answers": counters.get("video_digest.overview_answers", 0),
+            "section_answers": counters.get("video_digest.section_answers", 0),
+            "build_mean_ms": metrics.mean("video_digest.build")
+        }
@@ -0,0 +1,166 @@
+from helpers.constants import (
+    embedding_model,
+    model_router,
+    VECTORSTORE_PATH,
+    METADATA_PATH,
+    USAGE_CATALOG_PATH,
+    WARMUP_MAX_VIDEOS,
+    WARMUP_MAX_BYTES
+)
+from helpers.vectorstore import (
+    load_vectorstore,
+    load_video_timeline,
+    corpus_contains,
+    timeline_cache_key,
+    vectorstore_cache,
+    MANIFEST_FILE
+)
+from helpers.chat_models import warm_up_chat_model
+from helpers.tools import warm_up_chains
+from typing import Dict, Any, List
+import threading
+import sqlite3
+import time
+import os
+
+
+class UsageCatalog:
+    """
+    A persisted record of how often and how recently each video was asked about.
+
+    Description:
+    ------------
+    Every chat about a video updates its row in a small SQLite database, so the record survives restarts and deploys and
+    tells the startup warmup which videos to preload. Videos are ranked by their number of uses, discounted by the days
+    since their last use.
+
+    Attributes:
+    -----------
+    database_path : str
+        The path of the SQLite database.
+
+    Methods:
+    --------
+    record(video_id: str):
+        Counts a use of the video.
+
+    hot_videos(limit: int) -> List[str]:
+        Returns the IDs of the most used recent videos, hottest first.
+    """
+
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS video_usage (
+                video_id TEXT PRIMARY KEY,
+                use_count INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._connection.commit()
+
+    def record(self, video_id: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                INSERT INTO video_usage (video_id, use_count, last_used) VALUES (?, 1, ?)
+                ON CONFLICT (video_id) DO UPDATE SET use_count = use_count + 1, last_used = excluded.last_used
+                """,
+                (video_id, time.time())
+            )
+
+    def hot_videos(self, limit: int) -> List[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT video_id FROM video_usage ORDER BY use_count / (1.0 + (? - last_used) / 86400.0) DESC LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+
+        return [row[0] for row in rows]
+
+
+usage_catalog = UsageCatalog(USAGE_CATALOG_PATH)
+warmup_status: Dict[str, Any] = {"ready": False}
+
+
+def warm_up(
+        max_videos: int = WARMUP_MAX_VIDEOS,
+        max_bytes: int = WARMUP_MAX_BYTES
+) -> Dict[str, Any]:
+    """
+    Preloads the indexes, model clients, prompt chains and hot videos, and marks the backend as ready.
+
+    Description:
+    ------------
+    Both corpus indexes are opened and cached, the embedding model answers one query, which loads local models and opens
+    the connection of remote ones. The chat model's connection is opened with a free model listing, or an in-process
+    chat model generates its first token. The prompts of the answer chains are rendered and counted, which loads the
+    tokenizer. Then the hottest videos of the usage catalog get their caption timelines built and their transcription
+    vectors paged in, as long as they fit into `max_bytes`. A failing step is reported in the status but never keeps
+    the backend from becoming ready.
+
+    Args:
+    ------------
+    max_videos (int): The maximum number of videos to preload.
+    max_bytes (int): The memory budget of the preloaded video data in bytes.
+
+    Returns:
+    ------------
+    Dict[str, Any]: The warmup status, also served by the `/ready` endpoint.
+    """
+    print("---BEGIN: WARMING UP---")
+    start = time.perf_counter()
+    warmed_videos = []
+    used_bytes = 0
+    errors = []
+
+    try:
+        embedding_model.embed_query("warmup")
+        for profile in model_router.profiles.values():
+            warm_up_chat_model(profile["model"])
+        warm_up_chains()
+
+    except Exception as err:
+        print(f"---WARNING: MODEL WARMUP FAILED -> {err}---")
+        errors.append(str(err))
+
+    try:
+        for folder_path in (VECTORSTORE_PATH, METADATA_PATH):
+            if os.path.exists(os.path.join(folder_path, MANIFEST_FILE)):
+                load_vectorstore(folder_path)
+
+        for video_id in usage_catalog.hot_videos(max_videos):
+            if not corpus_contains(METADATA_PATH, video_id):
+                continue
+
+            timeline = load_video_timeline(METADATA_PATH, video_id)
+            video_bytes = timeline.nbytes
+            if corpus_contains(VECTORSTORE_PATH, video_id):
+                transcription = load_vectorstore(VECTORSTORE_PATH)
+                video_bytes += transcription.reconstruct(transcription.docstore.video_ids(video_id)).nbytes
+
+            if used_bytes + video_bytes > max_bytes:
+                # Colder but smaller videos may still fit the remaining budget
+                vectorstore_cache.invalidate(timeline_cache_key(METADATA_PATH, video_id))
+                continue
+
+            used_bytes += video_bytes
+            warmed_videos.append(video_id)
+
+    except Exception as err:
+        print(f"---WARNING: INDEX WARMUP FAILED -> {err}---")
+        errors.append(str(err))
+
+    warmup_status.update({
+        "ready": True,
+        "videos": warmed_videos,
+        "bytes": used_bytes,
+        "seconds": round(time.perf_counter() - start, 3),
+        "errors": errors
+    })
+    print(f"---DONE: WARMED UP {len(warmed_videos)} VIDEOS IN {warmup_status['seconds']}s---")
+    return warmup_status
@@ -1,7 +1,18 @@
 from fastapi import FastAPI
 from helpers.backend_router import functions_router
+from helpers.warmup import warm_up
 
+from contextlib import asynccontextmanager
 from datetime import datetime
+import asyncio
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The warmup runs in a worker thread, so the server answers liveness checks while `/ready` reports 503
+    app.state.warmup_task = asyncio.create_task(asyncio.to_thread(warm_up))
+    yield
+
 
 app = FastAPI(
     title="TalkYou Backend Server v0.1.0",
@@ -14,7 +25,8 @@ app = FastAPI(
     license_info={
         "name": "MIT License",
         "url": "https://opensource.org/licenses/MIT"
-    }
+    },
+    lifespan=lifespan
 )
 
 app.include_router(functions_router)
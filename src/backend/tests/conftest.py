@@ -0,0 +1,80 @@
+"""
+Shared fixtures of the backend tests.
+
+The tests run offline: the headless Chrome that `helpers.constants` starts on import is replaced by a mock, vectors
+come from a hashing embedding model instead of the OpenAI API, and every index and database lives in a temporary folder.
+"""
+from langchain_core.embeddings import Embeddings
+from unittest import mock
+from typing import List
+import numpy as np
+import tempfile
+import hashlib
+import pytest
+import sys
+import os
+import re
+
+BACKEND_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The prompts are read relative to the backend folder, and nothing may be written into it
+sys.path.insert(0, BACKEND_PATH)
+os.chdir(BACKEND_PATH)
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="talkyou-tests-")
+os.environ["ROUTER_DECISION_LOG_PATH"] = ""
+os.environ["LANGCHAIN_TRACING_V2"] = "false"
+
+for browser_target in (
+        "webdriver_manager.chrome.ChromeDriverManager",
+        "selenium.webdriver.chrome.service.Service",
+        "selenium.webdriver.Chrome"
+):
+    mock.patch(browser_target).start()
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Embeds texts as normalized bags of hashed words, so texts sharing words are close without a model download.
+    """
+
+    model = "test-hashing-embedding"
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self.calls = 0
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.size] += 1.0
+
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        return self._embed(text)
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    from helpers.embedding_cache import CachedQueryEmbeddings
+    import helpers.vectorstore as vectorstore
+
+    embedding_model = CachedQueryEmbeddings(HashingEmbeddings(), model=HashingEmbeddings.model, max_entries=64)
+    monkeypatch.setattr(vectorstore, "embedding_model", embedding_model)
+    return embedding_model
+
+
+@pytest.fixture
+def corpus_folder(tmp_path, embeddings, monkeypatch):
+    import helpers.vectorstore as vectorstore
+
+    # Compactions run in the tests themselves, not in the background executor
+    monkeypatch.setattr(vectorstore, "schedule_compaction", lambda folder_path: False)
+    return str(tmp_path / "corpus")
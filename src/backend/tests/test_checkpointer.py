@@ -0,0 +1,71 @@
+from langgraph.graph import StateGraph, START, END
+from helpers.checkpointer import SqliteCheckpointSaver, conversation_config
+from typing import TypedDict, List, Annotated
+import operator
+import time
+
+
+class CounterState(TypedDict):
+    turns: Annotated[List[str], operator.add]
+
+
+def counter_graph(saver: SqliteCheckpointSaver):
+    workflow = StateGraph(CounterState)
+    workflow.add_node("answer", lambda state: {"turns": [f"turn {len(state['turns']) + 1}"]})
+    workflow.add_edge(START, "answer")
+    workflow.add_edge("answer", END)
+    return workflow.compile(checkpointer=saver)
+
+
+def saver_at(path, **limits) -> SqliteCheckpointSaver:
+    options = {"max_checkpoints_per_thread": 20, "thread_ttl_seconds": 3600, "max_threads": 100}
+    options.update(limits)
+    return SqliteCheckpointSaver(database_path=str(path), **options)
+
+
+def test_threads_are_separate_and_survive_a_restart(tmp_path):
+    path = tmp_path / "conversations.sqlite"
+    graph = counter_graph(saver_at(path))
+    alice, bob = conversation_config("alice", "video"), conversation_config("bob", "video")
+
+    graph.invoke({"turns": []}, alice)
+    graph.invoke({"turns": []}, alice)
+    graph.invoke({"turns": []}, bob)
+
+    restarted = counter_graph(saver_at(path))
+    assert restarted.get_state(alice).values["turns"] == ["turn 1", "turn 2"]
+    assert restarted.get_state(bob).values["turns"] == ["turn 1"]
+
+
+def test_history_per_thread_is_bounded(tmp_path):
+    saver = saver_at(tmp_path / "conversations.sqlite", max_checkpoints_per_thread=3)
+    graph = counter_graph(saver)
+    config = conversation_config("alice", "video")
+
+    for _ in range(5):
+        graph.invoke({"turns": []}, config)
+
+    assert len(list(saver.list(config))) == 3
+    assert graph.get_state(config).values["turns"][-1] == "turn 5"
+
+
+def test_idle_and_excess_threads_are_pruned(tmp_path):
+    saver = saver_at(tmp_path / "conversations.sqlite", max_threads=2, prune_interval_seconds=3600)
+    graph = counter_graph(saver)
+
+    for session in ("a", "b", "c"):
+        graph.invoke({"turns": []}, conversation_config(session, "video"))
+        time.sleep(0.01)
+
+    assert saver.prune() == 1
+    assert saver.stats()["threads"] == 2
+    assert saver.get_tuple(conversation_config("a", "video")) is None
+
+    saver.thread_ttl_seconds = 0
+    assert saver.prune() == 2
+    assert saver.stats()["checkpoints"] == 0
+
+
+def test_sessions_without_id_get_their_own_thread():
+    assert conversation_config(None, "video") != conversation_config(None, "video")
+    assert conversation_config("alice", None)["configurable"]["thread_id"] == "alice:no-video"
@@ -0,0 +1,67 @@
+from langchain_core.documents import Document
+from helpers.context_packer import ContextPacker, merge_segments
+from helpers.tokenizer import count_tokens
+
+
+def segment(text: str, segment_id=None, start=None, end=None, video_id="video"):
+    return Document(
+        page_content=text,
+        metadata={"video_id": video_id, "segment_id": segment_id, "start": start, "end": end}
+    )
+
+
+def test_overlapping_chunks_are_merged_once():
+    text = " ".join(f"w{i:03d}" for i in range(200))
+    first, second = text[:500], text[400:]
+
+    spans = merge_segments([segment(second, 8), segment(first, 7)])
+
+    assert len(spans) == 1
+    assert spans[0]["text"] == text
+    assert (spans[0]["first_id"], spans[0]["last_id"], spans[0]["rank"]) == (7, 8, 0)
+
+
+def test_contained_segments_are_dropped_and_consecutive_captions_merged():
+    spans = merge_segments([
+        segment("the dough rests for an hour", 3, start=10.0, end=14.0),
+        segment("rests for an hour", 40),
+        segment("then it is baked", 4, start=14.0, end=18.0),
+        segment("unrelated text of another video", 4, video_id="other")
+    ])
+
+    assert len(spans) == 2
+    merged = [span for span in spans if span["video_id"] == "video"][0]
+    assert merged["text"] == "the dough rests for an hour then it is baked"
+    assert (merged["start"], merged["end"]) == (10.0, 18.0)
+
+
+def test_distant_segments_stay_apart():
+    spans = merge_segments([
+        segment("preheat the oven", 1, start=0.0, end=5.0),
+        segment("slice the bread", 9, start=300.0, end=305.0)
+    ])
+
+    assert [span["text"] for span in spans] == ["preheat the oven", "slice the bread"]
+
+
+def test_pack_keeps_best_spans_within_budget_in_timeline_order():
+    packer = ContextPacker("gpt-4o-mini", token_budget=40)
+    documents = [
+        segment("the oven is preheated to two hundred degrees", 20, start=200.0, end=210.0),
+        segment("the dough rises for one hour", 10, start=100.0, end=110.0),
+        segment(" ".join(f"filler{i}" for i in range(60)), 5, start=0.0, end=10.0)
+    ]
+
+    context = packer.pack(documents)
+
+    assert count_tokens(context, "gpt-4o-mini") <= 40
+    assert "filler" not in context
+    assert context.index("[01:40 - 01:50]") < context.index("[03:20 - 03:30]")
+
+
+def test_pack_truncates_a_single_oversized_span():
+    packer = ContextPacker("gpt-4o-mini", token_budget=10)
+
+    context = packer.pack([segment(" ".join(f"word{i}" for i in range(200)), 1)])
+
+    assert 0 < count_tokens(context, "gpt-4o-mini") <= 10
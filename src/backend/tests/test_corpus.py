@@ -0,0 +1,146 @@
+from langchain_core.documents import Document
+from helpers.context_packer import ContextPacker
+from helpers.segment_store import SegmentStore
+from helpers.vectorstore import (
+    add_documents_to_corpus,
+    delete_video_from_corpus,
+    compact_corpus,
+    corpus_contains,
+    load_vectorstore,
+    read_manifest,
+    schedule_compaction
+)
+import helpers.vectorstore as vectorstore
+import pytest
+
+
+def lines(video: str, count: int):
+    return [
+        Document(page_content=f"{video} line {i} about topic{i}", metadata={"start": i * 5.0, "end": i * 5.0 + 5})
+        for i in range(count)
+    ]
+
+
+def test_add_assigns_consecutive_ids_and_filters_by_video(corpus_folder):
+    assert add_documents_to_corpus(corpus_folder, lines("alpha", 3), "alpha") == [0, 1, 2]
+    assert add_documents_to_corpus(corpus_folder, lines("beta", 2), "beta") == [3, 4]
+
+    assert corpus_contains(corpus_folder, "alpha") and corpus_contains(corpus_folder, "beta")
+    assert not corpus_contains(corpus_folder, "gamma")
+
+    hits = load_vectorstore(corpus_folder).similarity_search("beta line 1 about topic1", k=3, video_id="beta")
+    assert hits[0].page_content == "beta line 1 about topic1"
+    assert {hit.metadata["video_id"] for hit in hits} == {"beta"}
+    assert hits[0].metadata["start"] == 5.0
+
+
+def test_later_ingestions_are_written_as_shards(corpus_folder):
+    add_documents_to_corpus(corpus_folder, lines("alpha", 3), "alpha")
+    add_documents_to_corpus(corpus_folder, lines("beta", 2), "beta")
+
+    manifest = read_manifest(corpus_folder)
+    assert manifest["shards"] == ["shard-3.faiss"]
+    assert manifest["next_id"] == 5
+
+    hits = load_vectorstore(corpus_folder).similarity_search("beta line 0 about topic0", k=1)
+    assert hits[0].page_content == "beta line 0 about topic0"
+
+
+def test_delete_hides_video_until_compaction_removes_it(corpus_folder):
+    add_documents_to_corpus(corpus_folder, lines("alpha", 3), "alpha")
+    add_documents_to_corpus(corpus_folder, lines("beta", 2), "beta")
+
+    assert delete_video_from_corpus(corpus_folder, "alpha") == 3
+    assert delete_video_from_corpus(corpus_folder, "alpha") == 0
+    assert not corpus_contains(corpus_folder, "alpha")
+    hits = load_vectorstore(corpus_folder).similarity_search("alpha line 0 about topic0", k=5)
+    assert {hit.metadata["video_id"] for hit in hits} == {"beta"}
+
+    assert compact_corpus(corpus_folder) == 3
+    compacted = load_vectorstore(corpus_folder)
+    assert compacted.index.ntotal == 2
+    assert read_manifest(corpus_folder)["shards"] == []
+    assert compacted.docstore.stats()["segments"] == 2
+    assert compact_corpus(corpus_folder) == 0
+
+
+def test_replace_tombstones_previous_segments(corpus_folder):
+    add_documents_to_corpus(corpus_folder, lines("alpha", 3), "alpha")
+    new_ids = add_documents_to_corpus(corpus_folder, lines("alpha v2", 2), "alpha", replace=True)
+
+    assert new_ids == [3, 4]
+    hits = load_vectorstore(corpus_folder).similarity_search("alpha line 0 about topic0", k=5, video_id="alpha")
+    assert sorted(hit.metadata["segment_id"] for hit in hits) == new_ids
+
+
+def test_shards_are_merged_at_compaction(corpus_folder):
+    for video in ("alpha", "beta", "gamma"):
+        add_documents_to_corpus(corpus_folder, lines(video, 2), video)
+
+    assert compact_corpus(corpus_folder) == 0
+    compacted = load_vectorstore(corpus_folder)
+    assert read_manifest(corpus_folder)["shards"] == []
+    assert compacted.index.ntotal == 6
+    assert compacted.similarity_search("gamma line 1 about topic1", k=1)[0].metadata["segment_id"] == 5
+
+
+def test_compaction_is_scheduled_by_shards_and_tombstones(corpus_folder, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(vectorstore, "INDEX_MAX_SHARDS", 2)
+    monkeypatch.setattr(vectorstore.compaction_executor, "submit", lambda function, folder_path: submitted.append(folder_path))
+
+    add_documents_to_corpus(corpus_folder, lines("alpha", 4), "alpha")
+    add_documents_to_corpus(corpus_folder, lines("beta", 1), "beta")
+    assert not schedule_compaction(corpus_folder)
+
+    delete_video_from_corpus(corpus_folder, "alpha")
+    assert schedule_compaction(corpus_folder)
+
+    compact_corpus(corpus_folder)
+    add_documents_to_corpus(corpus_folder, lines("gamma", 1), "gamma")
+    add_documents_to_corpus(corpus_folder, lines("delta", 1), "delta")
+    assert schedule_compaction(corpus_folder)
+    assert submitted == [corpus_folder, corpus_folder]
+
+
+def test_empty_transcript_is_ingested_without_embedding(corpus_folder, embeddings):
+    assert add_documents_to_corpus(corpus_folder, [], "silent") == []
+    assert not corpus_contains(corpus_folder, "silent")
+
+    add_documents_to_corpus(corpus_folder, lines("alpha", 2), "alpha")
+    calls = embeddings.embeddings.calls
+    assert add_documents_to_corpus(corpus_folder, [], "silent") == []
+    assert embeddings.embeddings.calls == calls
+
+
+def test_empty_replacement_removes_previous_segments(corpus_folder):
+    add_documents_to_corpus(corpus_folder, lines("alpha", 2), "alpha")
+    add_documents_to_corpus(corpus_folder, lines("beta", 2), "beta")
+
+    assert add_documents_to_corpus(corpus_folder, [], "alpha", replace=True) == []
+    assert not corpus_contains(corpus_folder, "alpha")
+    assert corpus_contains(corpus_folder, "beta")
+
+
+def test_vectors_without_segments_are_skipped(corpus_folder, monkeypatch):
+    add_documents_to_corpus(corpus_folder, lines("alpha", 3), "alpha")
+
+    # An ingestion stopping after its shard was written leaves vectors without segments
+    def fail(self, ids, documents):
+        raise RuntimeError("stopped before storing the segments")
+
+    with monkeypatch.context() as failing_insert, pytest.raises(RuntimeError):
+        failing_insert.setattr(SegmentStore, "insert", fail)
+        add_documents_to_corpus(corpus_folder, lines("orphan", 3), "orphan")
+
+    corpus = load_vectorstore(corpus_folder)
+    assert corpus.index.ntotal + sum(shard.ntotal for shard in corpus.shards) == 6
+    for documents in (
+            corpus.similarity_search("orphan line 0 about topic0", k=6),
+            corpus.hybrid_search("orphan line 0 about topic0", k=6),
+            corpus.batch_hybrid_search(["orphan line 1 about topic1"], k=6)[0]
+    ):
+        assert {document.metadata["video_id"] for document in documents} == {"alpha"}
+        assert ContextPacker("gpt-4o-mini", 1000).pack(documents)
+
+    assert corpus.docstore.search("4") is None
@@ -0,0 +1,47 @@
+from helpers.embedding_cache import CachedQueryEmbeddings
+from langchain_core.embeddings import Embeddings
+from typing import List
+import asyncio
+
+
+class RecordingEmbeddings(Embeddings):
+    def __init__(self):
+        self.texts = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.texts.extend(texts)
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def test_original_text_is_embedded_and_normalized_text_is_the_key():
+    recorder = RecordingEmbeddings()
+    cache = CachedQueryEmbeddings(recorder, model="recording", max_entries=8)
+
+    first = cache.embed_query("What does  GPT stand for?")
+    assert cache.embed_query("what does gpt stand for?") == first
+    assert recorder.texts == ["What does  GPT stand for?"]
+
+
+def test_batch_misses_are_embedded_once_with_their_original_text():
+    recorder = RecordingEmbeddings()
+    cache = CachedQueryEmbeddings(recorder, model="recording", max_entries=8)
+    cache.embed_query("Cached Question")
+
+    embeddings = asyncio.run(cache.aembed_queries(["New  Question", "new question", "cached question"]))
+
+    assert recorder.texts == ["Cached Question", "New  Question"]
+    assert embeddings[0] == embeddings[1]
+    assert len(embeddings) == 3
+
+
+def test_documents_are_never_cached_or_normalized():
+    recorder = RecordingEmbeddings()
+    cache = CachedQueryEmbeddings(recorder, model="recording", max_entries=8)
+
+    cache.embed_documents(["Line  One", "Line  One"])
+
+    assert recorder.texts == ["Line  One", "Line  One"]
+    assert cache.stats()["entries"] == 0
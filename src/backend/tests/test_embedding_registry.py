@@ -0,0 +1,46 @@
+from langchain_openai import OpenAIEmbeddings
+from helpers.constants import EMBEDDING_MODEL_REGISTRY, load_embedding_model
+from helpers.vectorstore import get_embedding_dimensions
+from tests.conftest import HashingEmbeddings
+import pytest
+
+
+class NamedModel:
+    def __init__(self, model: str, dimensions=None):
+        self.model = model
+        self.dimensions = dimensions
+
+    def embed_query(self, text):
+        raise AssertionError("registered models must not be probed")
+
+
+def test_unknown_model_is_rejected():
+    with pytest.raises(ValueError, match="Unknown embedding model"):
+        load_embedding_model("no-such-model")
+
+
+def test_dimensions_only_for_shortenable_models():
+    with pytest.raises(ValueError, match="does not support"):
+        load_embedding_model("text-embedding-ada-002", dimensions=256)
+
+    embedding_model = load_embedding_model("text-embedding-3-small", dimensions=256)
+    assert isinstance(embedding_model, OpenAIEmbeddings)
+    assert embedding_model.dimensions == 256
+
+
+def test_registered_dimensions_need_no_request():
+    assert get_embedding_dimensions(NamedModel("text-embedding-3-small")) == 1536
+    assert get_embedding_dimensions(NamedModel("sentence-transformers/all-MiniLM-L6-v2")) == 384
+    assert get_embedding_dimensions(NamedModel("text-embedding-3-small", dimensions=512)) == 512
+
+
+def test_unregistered_model_is_probed_once():
+    embedding_model = HashingEmbeddings(size=24)
+    embedding_model.model = "test-probed-embedding"
+    try:
+        assert get_embedding_dimensions(embedding_model) == 24
+        assert get_embedding_dimensions(embedding_model) == 24
+        assert embedding_model.calls == 1
+        assert EMBEDDING_MODEL_REGISTRY["test-probed-embedding"]["dimensions"] == 24
+    finally:
+        EMBEDDING_MODEL_REGISTRY.pop("test-probed-embedding", None)
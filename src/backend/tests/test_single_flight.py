@@ -0,0 +1,109 @@
+from helpers.single_flight import SingleFlight
+import asyncio
+import pytest
+
+
+def test_concurrent_identical_requests_share_one_computation():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(
+            flights.run("video", "answer", "What is  the BREAD about?", compute),
+            flights.run("video", "answer", "what is the bread about?", compute),
+            flights.run("other", "answer", "what is the bread about?", compute)
+        )
+
+    assert asyncio.run(main()) == ["answer"] * 3
+    assert len(calls) == 2
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_later_requests_compute_again():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        return [await flights.run("video", "ingest", None, compute) for _ in range(2)]
+
+    assert asyncio.run(main()) == [1, 2]
+
+
+def test_exceptions_reach_every_waiter():
+    flights = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("download failed")
+
+    async def main():
+        return await asyncio.gather(
+            *[flights.run("video", "download", None, compute) for _ in range(3)],
+            return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelled_waiter_does_not_cancel_the_computation():
+    flights = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "indexed"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.run("video", "index", None, compute))
+        follower = asyncio.ensure_future(flights.run("video", "index", None, compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == "indexed"
+
+
+def test_disabled_flights_compute_every_request():
+    flights = SingleFlight(enabled=False)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*[flights.run("video", "answer", "same", compute) for _ in range(3)])
+
+    asyncio.run(main())
+    assert len(calls) == 3
+
+
+def test_coalesced_node_is_keyed_by_video_and_message():
+    flights = SingleFlight()
+    calls = []
+
+    @flights.coalesce("classify", message_field="chat_message")
+    async def node(state):
+        calls.append(state["chat_message"])
+        await asyncio.sleep(0.01)
+        return {"identified_request": "information"}
+
+    async def main():
+        return await asyncio.gather(
+            node({"video_id": "video", "chat_message": "hello there"}),
+            node({"video_id": "video", "chat_message": "Hello  there"}),
+            node({"video_id": "video", "chat_message": "take a screenshot"})
+        )
+
+    results = asyncio.run(main())
+    assert results[0] == results[1] == {"identified_request": "information"}
+    assert calls == ["hello there", "take a screenshot"]
@@ -1,3 +1,4 @@
 # ENDPOINTS
 backend_signal_url = "http://backend:8000/"
 agent_url = "http://backend:8000/process/converse_with_agent"
+stream_agent_url = "http://backend:8000/process/stream_agent"
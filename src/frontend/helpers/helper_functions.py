@@ -5,17 +5,20 @@ from pathlib import Path
 import httpx
 from helpers.constants import (
     backend_signal_url,
-    agent_url
+    agent_url,
+    stream_agent_url
 )
 from typing import (
     Optional,
     Union,
+    Iterator,
     Dict,
     Any
 )
 from jinja2 import Template
 import streamlit as st
 import requests
+import json
 import time
 
 
@@ -39,7 +42,8 @@ async def chat_bot(
     try:
         form_data = {
             "video_url": video_url,
-            "chat_message": chat_message
+            "chat_message": chat_message,
+            "session_id": st.session_state.get("session_id")
         }
 
         response = requests.post(
@@ -55,6 +59,43 @@ async def chat_bot(
         st.warning(f"Error While Chat Bot: {err}")
 
 
+def stream_chat_bot(
+        video_url: str,
+        chat_message: str,
+        final_state: Dict[str, Any]
+) -> Iterator[str]:
+    """
+    Description:
+    -----------
+    Streams the agent's answer tokens from the backend's Server-Sent Events as they are generated, so they can be
+    rendered with `st.write_stream`. The final graph state of the "done" event is copied into `final_state`.
+
+    Returns:
+    -----------
+    An iterator over the answer tokens.
+    """
+    form_data = {
+        "video_url": video_url,
+        "chat_message": chat_message,
+        "session_id": st.session_state.get("session_id")
+    }
+
+    with requests.post(url=stream_agent_url, data=form_data, stream=True) as response:
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "token":
+                    yield data["token"]
+                elif event == "done":
+                    final_state.update(data)
+                elif event == "error":
+                    st.warning(f"Error While Chat Bot: {data['detail']}")
+
+
 def submit_video_url(video_url: str) -> None:
     if "youtube" not in video_url:
         place_holder = st.empty()
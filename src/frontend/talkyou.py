@@ -1,12 +1,14 @@
 from helpers.helper_functions import (
     load_sidebar_html,
     chat_bot,
+    stream_chat_bot,
     submit_video_url,
     render_landing_page
 )
 import streamlit as st
 import asyncio
 import base64
+import uuid
 
 st.set_page_config(
     page_title="TalkYou - Talk With Videos!",
@@ -19,6 +21,10 @@ st.set_page_config(
 if "video_url" not in st.session_state:
     st.session_state["video_url"] = None
 
+# Each browser session keeps its own conversation with the backend agent
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+
 with st.sidebar:
     sidebar_content = load_sidebar_html()
     st.html(sidebar_content)
@@ -57,20 +63,20 @@ elif st.session_state.video_url is not None:
         with st.chat_message("user"):
             st.write(user_message)
 
-        with st.spinner("Looking for an answer..."):
-            ai_message = asyncio.run(
-                chat_bot(
+        # Answer tokens are rendered as they arrive, screenshots once the stream is done
+        ai_message = {}
+        with st.chat_message("assistant"):
+            streamed_answer = st.write_stream(
+                stream_chat_bot(
                     video_url=st.session_state.video_url,
-                    chat_message=user_message
+                    chat_message=user_message,
+                    final_state=ai_message
                 )
             )
 
-            if "screenshot_base64" in ai_message.keys() and ai_message["identified_request"] == "image":
+            if ai_message.get("screenshot_base64") and ai_message.get("identified_request") == "image":
                 converted_image = base64.b64decode(ai_message["screenshot_base64"])
-                with st.chat_message("assistant"):
-                    st.image(converted_image)
+                st.image(converted_image)
 
-            else:
-                st.session_state.messages.append({"role": "assistant", "content": ai_message["response"]})
-                with st.chat_message("assistant"):
-                    st.write(ai_message["response"])
+            elif streamed_answer:
+                st.session_state.messages.append({"role": "assistant", "content": streamed_answer})